@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from yampa.plugins import PluginBase, PluginManager, Plugin
+
+
+def make_manager(impls: list[PluginBase]) -> PluginManager:
+    """Create a plugin manager with the given plugin instances loaded, bypassing the ./plugins directory."""
+    pm = PluginManager()
+    plugins = {}
+    for i, impl in enumerate(impls):
+        plugin = Plugin(f"bench_{i}")
+        plugin._impl = impl
+        plugins[plugin.name] = plugin
+    pm._swap(plugins)
+    return pm
+
+
+def measure(coroutine_function, iterations: int, repeat: int = 5) -> float:
+    """Run `coroutine_function` `iterations` times per round, and return the best per-iteration time in seconds."""
+
+    async def run():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                await coroutine_function()
+            best = min(best, (time.perf_counter() - start) / iterations)
+        return best
+
+    return asyncio.run(run())
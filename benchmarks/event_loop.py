@@ -0,0 +1,195 @@
+"""Benchmark of the proxy pipeline on each available event loop implementation.
+
+The handlers of the proxy run against in-memory stand-ins for the wireguard servers and streams, with a no-op filter
+plugin loaded, so the numbers show the overhead of the event loop and the proxy rather than of wireguard:
+
+- connections: connections per second opened, carrying a request and a response each, and closed, 64 at a time
+- chunks: chunks per second forwarded through a single connection, each sent once the previous one arrived, and the
+  median and 99th percentile latency per chunk from the client transport to the server transport
+- udp: datagrams per second handled, 64 at a time, with the default udp batching (`UDP_BATCH_SIZE`)
+
+uvloop is only measured if it is installed, e.g. with `pip install uvloop`.
+
+Run from the repository root: python -m benchmarks.event_loop
+"""
+import asyncio
+import os
+import time
+
+import mitmproxy_wireguard as wireguard
+
+from yampa import *
+from yampa.proxy import EventLoop, Proxy
+from yampa.proxy.event_loop import loop_factory, run
+
+from .common import make_manager
+from .stream import Transport
+
+CONNECTIONS = 5000
+CONCURRENCY = 64
+CHUNKS = 20000
+CHUNK = b"C" * 1024
+DATAGRAMS = 100000
+REQUEST = b"A" * 200
+RESPONSE = b"B" * 1000
+
+
+class FilterPlugin(PluginBase):
+    def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                   context: Context) -> None | tuple[FilterAction, bytes | None]:
+        return None
+
+    def udp_filter(self, metadata: Metadata, data: bytes) -> None | tuple[FilterAction, bytes | None]:
+        return None
+
+
+class Server:
+    """Stand-in for a wireguard Server. New connections to it get the transport made by `make_transport`."""
+
+    def __init__(self, make_transport=None):
+        self.make_transport = make_transport
+        self.datagrams = 0
+        self.sent = asyncio.Event()
+        self.expected = 0
+
+    async def new_connection(self, src_addr, dst_addr) -> Transport:
+        return self.make_transport()
+
+    def send_datagram(self, data, src_addr, dst_addr):
+        self.datagrams += 1
+        if self.datagrams == self.expected:
+            self.sent.set()
+
+    def close(self):
+        pass
+
+
+class Client(Transport):
+    def __init__(self, src_addr, on_write=None):
+        super().__init__(on_write)
+        self._extra = {"peername": src_addr, "original_dst": ("10.0.0.2", 80)}
+
+    def get_extra_info(self, name: str):
+        return self._extra[name]
+
+
+def make_proxy() -> Proxy:
+    # The wireguard servers are never started, but the configuration needs keys
+    for side in ("NETWORK", "PROXY"):
+        key = wireguard.genkey()
+        os.environ.setdefault(f"{side}_OWN_PRIVATE", key)
+        os.environ.setdefault(f"{side}_OWN_PUBLIC", wireguard.pubkey(key))
+        os.environ.setdefault(f"{side}_PEER_PUBLIC", wireguard.pubkey(wireguard.genkey()))
+    os.environ["METRICS_LISTEN"] = ""
+
+    proxy = Proxy()
+    proxy._pm = make_manager([FilterPlugin()])
+    proxy._proxy_server = Server()
+    proxy._network_server = Server()
+    proxy._log_queue.start()
+    proxy._connections.start()
+    return proxy
+
+
+async def connections() -> float:
+    """:returns: The connections per second."""
+    proxy = make_proxy()
+
+    def make_server():
+        def on_write(data):
+            server.feed(RESPONSE)
+            server.feed_eof()
+
+        server = Transport(on_write)
+        return server
+
+    proxy._proxy_server.make_transport = make_server
+
+    async def connection(i: int):
+        done = asyncio.Event()
+        client = Client(("10.0.0.1", 10000 + i), lambda data: done.set())
+        client.feed(REQUEST)
+        handler = asyncio.create_task(proxy._handle_connection(proxy._proxy_server, client))
+        await done.wait()
+        client.feed_eof()
+        await handler
+
+    start = time.perf_counter()
+    for i in range(0, CONNECTIONS, CONCURRENCY):
+        await asyncio.gather(*(connection(j) for j in range(i, min(i + CONCURRENCY, CONNECTIONS))))
+    duration = time.perf_counter() - start
+
+    proxy.close()
+    return CONNECTIONS / duration
+
+
+async def chunks() -> tuple[float, float, float]:
+    """:returns: The chunks per second, and the median and 99th percentile latency per chunk in microseconds."""
+    proxy = make_proxy()
+    arrived = asyncio.Event()
+    received = 0
+
+    def on_write(data):
+        nonlocal received
+        received += len(data)
+        if received >= len(CHUNK):
+            received -= len(CHUNK)
+            arrived.set()
+
+    proxy._proxy_server.make_transport = lambda: Transport(on_write)
+    client = Client(("10.0.0.1", 10000))
+    handler = asyncio.create_task(proxy._handle_connection(proxy._proxy_server, client))
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(CHUNKS):
+        chunk_start = time.perf_counter()
+        arrived.clear()
+        client.feed(CHUNK)
+        await arrived.wait()
+        latencies.append(time.perf_counter() - chunk_start)
+    duration = time.perf_counter() - start
+
+    client.feed_eof()
+    await handler
+    proxy.close()
+
+    latencies.sort()
+    return CHUNKS / duration, latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+async def datagrams() -> float:
+    """:returns: The datagrams per second."""
+    proxy = make_proxy()
+    server = proxy._proxy_server
+    server.expected = DATAGRAMS
+
+    start = time.perf_counter()
+    for i in range(0, DATAGRAMS, CONCURRENCY):
+        # Concurrently, like the wireguard server calls the handler for every packet
+        await asyncio.gather(*(proxy._handle_datagram(server, CHUNK, ("10.0.0.1", 10000 + j % 100), ("10.0.0.2", 53))
+                               for j in range(i, min(i + CONCURRENCY, DATAGRAMS))))
+    await server.sent.wait()
+    duration = time.perf_counter() - start
+
+    proxy.close()
+    return DATAGRAMS / duration
+
+
+def main():
+    print(f"{'loop':>8} {'connections/s':>14} {'chunks/s':>10} {'p50 [us]':>9} {'p99 [us]':>9} {'datagrams/s':>12}")
+    for kind in (EventLoop.ASYNCIO, EventLoop.UVLOOP):
+        try:
+            loop_factory(kind)
+        except ImportError:
+            print(f"{kind.value:>8} not installed")
+            continue
+        connection_rate = run(connections(), kind)
+        chunk_rate, p50, p99 = run(chunks(), kind)
+        datagram_rate = run(datagrams(), kind)
+        print(f"{kind.value:>8} {connection_rate:>14.0f} {chunk_rate:>10.0f} {p50:>9.1f} {p99:>9.1f} "
+              f"{datagram_rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark of udp handling under a flood, with and without limits on pending packets.
+
+One source floods the proxy with datagrams of many flows, in bursts every millisecond that outpace the event loop, while
+another peer sends a datagram every millisecond. The filter plugin waits a bit for every datagram, like one asking an
+external engine. The settings are no limits, the default limits, and only a tight `MAX_PENDING_PER_SOURCE` of 128. For
+each this prints:
+
+- the median and 99th percentile latency of the datagrams of the other peer
+- the peak number of tasks alive, a proxy for the memory held by pending packets
+- the share of flood datagrams dropped
+
+Limits that are never reached by the flood do not change anything, so the defaults are chosen to be reached by it. The
+latency that is left with them is the cost of the handler task the benchmark spawns for every flood datagram, as the
+wireguard server does, which no limit on pending packets avoids.
+
+Run from the repository root: python -m benchmarks.flood
+"""
+import asyncio
+import os
+import time
+
+from yampa import *
+from yampa.metrics import PACKET_DROPS
+
+from .common import make_manager
+from .event_loop import Server, make_proxy
+
+FLOOD = 50000
+BURST = 500
+PROBES = 200
+# Time the filter waits for every datagram
+FILTER_DELAY = 0.005
+SETTINGS = [("unbounded", "0", "0"), ("defaults", "1024", "256"), ("per-source", "0", "128")]
+
+
+class SlowFilterPlugin(PluginBase):
+    async def udp_filter(self, metadata: Metadata, data: bytes) -> None | tuple[FilterAction, bytes | None]:
+        await asyncio.sleep(FILTER_DELAY)
+        return None
+
+
+class ProbeServer(Server):
+    def __init__(self):
+        super().__init__()
+        self.arrived: dict[bytes, float] = {}
+
+    def send_datagram(self, data, src_addr, dst_addr):
+        if src_addr[0] == "10.0.0.3":
+            self.arrived[data] = time.perf_counter()
+
+
+async def flood(limit: str, source_limit: str) -> tuple[float, float, int, float]:
+    """:returns: The median and 99th percentile probe latency in milliseconds, the peak number of tasks and the share
+    of flood datagrams dropped."""
+    os.environ["MAX_PENDING_PACKETS"] = limit
+    os.environ["MAX_PENDING_PER_SOURCE"] = source_limit
+    # Batches call an async filter for one packet after another, so only measure the scheduling of single packets
+    os.environ["UDP_BATCH_SIZE"] = "1"
+    proxy = make_proxy()
+    proxy._pm = make_manager([SlowFilterPlugin()])
+    server = proxy._proxy_server = ProbeServer()
+    drops = PACKET_DROPS.labels(Protocol.UDP.value, "overload"), PACKET_DROPS.labels(Protocol.UDP.value, "source")
+    dropped = sum(drop.value for drop in drops)
+
+    tasks = set()
+    peak = 0
+
+    def spawn(coroutine):
+        # Like the wireguard server, which runs the handler of every packet as a task of its own
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def flooder():
+        for i in range(0, FLOOD, BURST):
+            for j in range(i, i + BURST):
+                spawn(proxy._handle_datagram(server, b"F", ("10.0.0.1", 1024 + j % 60000), ("10.0.0.2", 53)))
+            await asyncio.sleep(0.001)
+
+    sent = {}
+    flooding = asyncio.create_task(flooder())
+    for i in range(PROBES):
+        data = b"%d" % i
+        sent[data] = time.perf_counter()
+        spawn(proxy._handle_datagram(server, data, ("10.0.0.3", 1000), ("10.0.0.2", 53)))
+        peak = max(peak, len(asyncio.all_tasks()))
+        await asyncio.sleep(0.001)
+    await flooding
+    while tasks:
+        await asyncio.gather(*tasks)
+    await asyncio.sleep(0.1)
+    proxy.close()
+
+    latencies = sorted(server.arrived[data] - start for data, start in sent.items() if data in server.arrived)
+    dropped = sum(drop.value for drop in drops) - dropped
+    return (latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3, peak,
+            dropped / FLOOD)
+
+
+def main():
+    print(f"{'setting':>10} {'p50 [ms]':>9} {'p99 [ms]':>9} {'peak tasks':>11} {'dropped':>8}")
+    for name, limit, source_limit in SETTINGS:
+        p50, p99, peak, dropped = asyncio.run(flood(limit, source_limit))
+        print(f"{name:>10} {p50:>9.2f} {p99:>9.2f} {peak:>11} {dropped:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark of the forwarding latency of the TCP path with slow log hooks loaded.
+
+Each logger awaits some simulated I/O per chunk, like a plugin writing to a file or a socket would. With the log queue
+disabled, the log stage runs inline and every logger adds its latency to every forwarded chunk. With the log queue, the
+latency of the forwarding path stays the same no matter how many loggers are loaded, as long as they keep up on
+average.
+
+Run from the repository root: python -m benchmarks.log_queue
+"""
+import asyncio
+import time
+
+from yampa import *
+from yampa.proxy import LogQueue, OverflowPolicy
+
+from .common import make_manager
+
+CHUNKS = 500
+LOGGER_COUNTS = (0, 1, 10)
+# Simulated I/O per logged chunk
+LOG_LATENCY = 0.0002
+
+
+class SlowLogPlugin(PluginBase):
+    async def tcp_log(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                      action: None | tuple[FilterAction, bytes | None]) -> None:
+        await asyncio.sleep(LOG_LATENCY)
+
+
+async def forward(count: int, queue_size: int) -> tuple[float, float]:
+    """Forward `CHUNKS` chunks through the decrypt, filter, log and encrypt stages like `ProxyConnection` does, and
+    return the mean and 99th percentile latency per chunk."""
+    pm = make_manager([SlowLogPlugin() for _ in range(count)])
+    log_queue = LogQueue(queue_size, OverflowPolicy.BLOCK, 4)
+    log_queue.start()
+
+    connection = object()
+    metadata = Metadata("10.0.0.1", 31337, "10.0.0.2", 80, (ProxyDirection.INBOUND, ConnectionDirection.TO_SERVER))
+    data = b"A" * 1024
+    context = {ProxyDirection.INBOUND: data, ProxyDirection.OUTBOUND: b""}
+
+    latencies = []
+    for _ in range(CHUNKS):
+        start = time.perf_counter()
+        decrypted = await pm.tcp_decrypt(connection, metadata, data)
+        action = await pm.tcp_filter(connection, metadata, decrypted, context)
+        await log_queue.submit(connection, pm.tcp_log, connection, metadata, decrypted, action)
+        await pm.tcp_encrypt(connection, metadata, decrypted)
+        latencies.append(time.perf_counter() - start)
+        # Pace the chunks, so that the loggers keep up
+        await asyncio.sleep(LOG_LATENCY * 2)
+
+    await log_queue.barrier(connection)
+    log_queue.close()
+
+    latencies.sort()
+    return sum(latencies) / len(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    print(f"{'loggers':>8} {'inline mean [us]':>17} {'inline p99 [us]':>16} {'queued mean [us]':>17} "
+          f"{'queued p99 [us]':>16}")
+    for count in LOGGER_COUNTS:
+        inline_mean, inline_p99 = asyncio.run(forward(count, 0))
+        queued_mean, queued_p99 = asyncio.run(forward(count, 4096))
+        print(f"{count:>8} {inline_mean * 1e6:>17.1f} {inline_p99 * 1e6:>16.1f} {queued_mean * 1e6:>17.1f} "
+              f"{queued_p99 * 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmark of the memory and allocations of the packet metadata.
+
+- Connections: memory held by 10k concurrent TCP connections, and the share of their metadata, compared with the
+  previous dict-based Metadata, of which every connection held one and each of its two forwarding tasks another one
+  with its own direction tuple.
+- UDP: objects allocated per datagram for its metadata, and the time it takes, creating a dict-based Metadata per
+  datagram like before, a slotted one per datagram, and looking it up in the udp flow table of the proxy. The datagrams
+  cycle through a fixed set of flows.
+
+Run from the repository root: python -m benchmarks.metadata
+"""
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from yampa import *
+from yampa.proxy import UdpFlowTable
+
+CONNECTIONS = 10000
+DATAGRAMS = 100000
+FLOWS = 100
+
+
+@dataclass
+class LegacyMetadata:
+    src_ip: str
+    src_port: int
+    dst_ip: str
+    dst_port: int
+    direction: ProxyDirection | tuple[ProxyDirection, ConnectionDirection]
+
+
+def addresses(i: int) -> tuple[tuple[str, int], tuple[str, int]]:
+    return (f"10.0.{i // 256 % 256}.{i % 256}", 30000 + i % 30000), ("10.1.0.1", 80)
+
+
+def size(metadata) -> int:
+    """The bytes held by `metadata` itself, including its `__dict__` and direction tuple, but not the addresses."""
+    size = sys.getsizeof(metadata)
+    if hasattr(metadata, "__dict__"):
+        size += sys.getsizeof(metadata.__dict__)
+    if isinstance(metadata.direction, tuple):
+        size += sys.getsizeof(metadata.direction)
+    return size
+
+
+def connection_memory() -> tuple[int, int, int]:
+    """:returns: The bytes per connection held by all of it, by its metadata, and by the previous metadata."""
+    streams = [addresses(i) for i in range(CONNECTIONS)]
+
+    tracemalloc.start()
+    connections = [ProxyConnection(None, None, {}, src, dst, ProxyDirection.INBOUND) for src, dst in streams]
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Direction tuples are shared by all connections now
+    shared = set()
+    metadata = 0
+    for connection in connections:
+        metadata += sys.getsizeof(connection.metadata)
+        for directed in connection._directed_metadata.values():
+            metadata += sys.getsizeof(directed)
+            shared.add(directed.direction)
+    metadata += sum(map(sys.getsizeof, shared))
+
+    legacy = 0
+    for src, dst in streams:
+        legacy += size(LegacyMetadata(src[0], src[1], dst[0], dst[1], ProxyDirection.INBOUND))
+        legacy += size(LegacyMetadata(src[0], src[1], dst[0], dst[1],
+                                      (ProxyDirection.INBOUND, ConnectionDirection.TO_SERVER)))
+        legacy += size(LegacyMetadata(dst[0], dst[1], src[0], src[1],
+                                      (ProxyDirection.OUTBOUND, ConnectionDirection.TO_CLIENT)))
+
+    return total // CONNECTIONS, metadata // CONNECTIONS, legacy // CONNECTIONS
+
+
+def datagrams(make) -> tuple[float, float]:
+    """:returns: The objects allocated per datagram that are held while it is handled, and the time per datagram in
+        microseconds."""
+    flows = [addresses(i) for i in range(FLOWS)]
+    packets = [(ProxyDirection.INBOUND, *flows[i % FLOWS]) for i in range(DATAGRAMS)]
+
+    # Hold on to the metadata like a batch of datagrams does, to count what was allocated for them
+    make(*packets[0])
+    blocks = sys.getallocatedblocks()
+    held = [make(*packet) for packet in packets]
+    blocks = sys.getallocatedblocks() - blocks
+    # Minus the list holding them
+    blocks -= 1
+    del held
+
+    start = time.perf_counter()
+    for packet in packets:
+        make(*packet)
+    duration = time.perf_counter() - start
+    return blocks / DATAGRAMS, duration / DATAGRAMS * 1e6
+
+
+def main():
+    total, metadata, legacy = connection_memory()
+    print(f"{CONNECTIONS} connections: {total} B per connection, of which {metadata} B metadata, "
+          f"previously {legacy} B metadata")
+
+    flows = UdpFlowTable(0, 0, 0, lambda flow: None)
+    print(f"\n{'udp metadata':>12} {'objects/datagram':>17} {'time [us]':>10}")
+    for name, make in (
+            ("legacy", lambda direction, src, dst: LegacyMetadata(src[0], src[1], dst[0], dst[1], direction)),
+            ("slotted", lambda direction, src, dst: Metadata(src[0], src[1], dst[0], dst[1], direction)),
+            ("flow table", lambda direction, src, dst: (flows.get(direction, src, dst) or
+                                                        flows.add(direction, src, dst))[1])):
+        objects, duration = datagrams(make)
+        print(f"{name:>12} {objects:>17.2f} {duration:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
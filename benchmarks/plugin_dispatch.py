@@ -0,0 +1,116 @@
+"""Micro-benchmark of the per-chunk plugin dispatch overhead of the TCP path.
+
+Every chunk read by `ProxyConnection` goes through the decrypt, filter, log and encrypt stage. This benchmark calls
+those four hooks the same way the connection does, once with the legacy dispatcher which resolved hooks on every call
+through `__getattribute__`, and once with the precompiled dispatch tables of `PluginManager`, both for plugins with
+async hooks and with synchronous hooks. The legacy dispatcher only supports async hooks.
+
+Run from the repository root: python -m benchmarks.plugin_dispatch
+"""
+import asyncio
+import typing
+
+from yampa import *
+from yampa.plugins import PluginManager
+
+from .common import make_manager, measure
+
+ITERATIONS = 20000
+PLUGIN_COUNTS = (0, 1, 10)
+
+
+class PassivePlugin(PluginBase):
+    """A plugin implementing every TCP stage without ever taking action, so that the whole chain is executed."""
+
+    async def tcp_decrypt(self, connection: ProxyConnection, metadata: Metadata, data: bytes) -> None | bytes:
+        return None
+
+    async def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                         context: Context) -> None | tuple[FilterAction, bytes | None]:
+        return None
+
+    async def tcp_log(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                      action: None | tuple[FilterAction, bytes | None]) -> None:
+        pass
+
+    async def tcp_encrypt(self, connection: ProxyConnection, metadata: Metadata, data: bytes) -> None | bytes:
+        return None
+
+
+class SyncPassivePlugin(PluginBase):
+    """Same as `PassivePlugin`, implemented with synchronous hooks."""
+
+    def tcp_decrypt(self, connection: ProxyConnection, metadata: Metadata, data: bytes) -> None | bytes:
+        return None
+
+    def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                   context: Context) -> None | tuple[FilterAction, bytes | None]:
+        return None
+
+    def tcp_log(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                action: None | tuple[FilterAction, bytes | None]) -> None:
+        pass
+
+    def tcp_encrypt(self, connection: ProxyConnection, metadata: Metadata, data: bytes) -> None | bytes:
+        return None
+
+
+class LegacyDispatch:
+    """The dispatcher as it was before the dispatch tables, resolving hooks on every single call."""
+
+    def __init__(self, pm: PluginManager):
+        self._pm = pm
+
+    def __getattr__(self, name):
+        spec = getattr(PluginBase, name)
+        plugins = self._pm._plugins
+        default = getattr(self._pm._default_plugin, name)
+
+        async def catchall(plugin, awaitable):
+            try:
+                return await awaitable
+            except Exception:
+                return None
+
+        if typing.get_type_hints(spec)["return"] is type(None):
+            async def _my_plugin_forwarder(*args, **kwargs):
+                await asyncio.gather(*[catchall(plugin, getattr(plugin, name)(*args, **kwargs))
+                                       for plugin in plugins.values() if hasattr(plugin, name)])
+        else:
+            async def _my_plugin_forwarder(*args, **kwargs):
+                for plugin in [x for x in plugins.values() if hasattr(x, name)]:
+                    if (ret := await catchall(plugin, getattr(plugin, name)(*args, **kwargs))) is not None:
+                        return ret
+                return await default(*args, **kwargs)
+
+        return _my_plugin_forwarder
+
+
+def chunk(pm, connection, metadata, data, context):
+    async def run():
+        decrypted = await pm.tcp_decrypt(connection, metadata, data)
+        action = await pm.tcp_filter(connection, metadata, decrypted, context)
+        await pm.tcp_log(connection, metadata, decrypted, action)
+        await pm.tcp_encrypt(connection, metadata, decrypted)
+
+    return run
+
+
+def main():
+    connection = object()
+    metadata = Metadata("10.0.0.1", 31337, "10.0.0.2", 80, (ProxyDirection.INBOUND, ConnectionDirection.TO_SERVER))
+    data = b"A" * 1024
+    context = {ProxyDirection.INBOUND: data, ProxyDirection.OUTBOUND: b""}
+
+    print(f"{'plugins':>8} {'legacy [us/chunk]':>18} {'tables [us/chunk]':>18} {'speedup':>8} {'sync [us/chunk]':>16}")
+    for count in PLUGIN_COUNTS:
+        pm = make_manager([PassivePlugin() for _ in range(count)])
+        legacy = measure(chunk(LegacyDispatch(pm), connection, metadata, data, context), ITERATIONS)
+        tables = measure(chunk(pm, connection, metadata, data, context), ITERATIONS)
+        sync = measure(chunk(make_manager([SyncPassivePlugin() for _ in range(count)]), connection, metadata, data,
+                             context), ITERATIONS)
+        print(f"{count:>8} {legacy * 1e6:>18.2f} {tables * 1e6:>18.2f} {legacy / tables:>7.1f}x {sync * 1e6:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark of the throughput of a bulk transfer through a single TCP connection.
+
+The transfer is forwarded once with no plugin loaded, so that the connection is spliced, once with a plugin filtering
+every chunk, and once with that plugin releasing the connection right away. The streams are in memory and always have
+data ready, so the numbers are the upper bound the proxy itself allows for.
+
+Run from the repository root: python -m benchmarks.splice
+"""
+import asyncio
+import time
+
+from yampa import *
+from yampa.proxy import LogQueue, OverflowPolicy
+
+from .common import make_manager
+
+TRANSFER_SIZE = 256 * 1024 * 1024
+
+
+class SourceStream(ProxyStream):
+    """A peer sending `size` bytes as fast as they are read."""
+
+    def __init__(self, size: int):
+        super().__init__()
+        self._remaining = size
+        self._chunk = bytes(ProxyConnection.SPLICE_BUFFER_SIZE)
+
+    async def do_read(self, n) -> bytes:
+        n = min(n, self._remaining, len(self._chunk))
+        self._remaining -= n
+        # Yield like a socket read does
+        await asyncio.sleep(0)
+        return self._chunk[:n]
+
+    async def do_write(self, data: bytes):
+        pass
+
+    def do_close(self, force_close: bool):
+        self._remaining = 0
+
+
+class SinkStream(ProxyStream):
+    """A peer receiving everything and sending nothing."""
+
+    def __init__(self):
+        super().__init__()
+        self.received = 0
+        self._closed = asyncio.Event()
+
+    async def do_read(self, n) -> bytes:
+        await self._closed.wait()
+        return b""
+
+    async def do_write(self, data: bytes):
+        self.received += len(data)
+
+    def do_close(self, force_close: bool):
+        self._closed.set()
+
+
+class FilterPlugin(PluginBase):
+    def __init__(self, release: bool):
+        self._release = release
+
+    def tcp_new_connection(self, connection: ProxyConnection) -> None:
+        if self._release:
+            connection.release()
+
+    def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                   context: Context) -> None | tuple[FilterAction, bytes | None]:
+        return None
+
+
+async def transfer(plugins: list[PluginBase]) -> float:
+    """:returns: The throughput of the transfer in MiB/s."""
+    pm = make_manager(plugins)
+    log_queue = LogQueue(0, OverflowPolicy.BLOCK, 1)
+    sink = SinkStream()
+    streams = {ConnectionDirection.TO_CLIENT: SourceStream(TRANSFER_SIZE), ConnectionDirection.TO_SERVER: sink}
+    connection = ProxyConnection(pm, log_queue, streams, ("10.0.0.1", 31337), ("10.0.0.2", 80),
+                                 ProxyDirection.INBOUND)
+
+    start = time.perf_counter()
+    await pm.tcp_new_connection(connection)
+    await connection.wait_closed()
+    duration = time.perf_counter() - start
+    await pm.tcp_connection_closed(connection)
+
+    assert sink.received == TRANSFER_SIZE
+    return TRANSFER_SIZE / duration / 1024 / 1024
+
+
+def main():
+    print(f"{'mode':>10} {'throughput [MiB/s]':>19}")
+    for mode, plugins in (("spliced", []), ("inspected", [FilterPlugin(False)]), ("released", [FilterPlugin(True)])):
+        print(f"{mode:>10} {asyncio.run(transfer(plugins)):>19.0f}")
+
+
+if __name__ == "__main__":
+    main()
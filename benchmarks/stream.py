@@ -0,0 +1,180 @@
+"""Benchmark of the TCP path from transport to transport, through the wireguard streams and a connection.
+
+The wireguard transports are replaced by in-memory stand-ins, whose `drain` takes an event loop iteration like waiting
+for the transport task does. Two traffic patterns are forwarded through a connection inspected by a no-op filter:
+
+- bulk: the client sends a large upload as fast as the proxy reads it
+- request/response: the client sends a small request, the server answers with a small response, one at a time
+
+Both run with the previous behaviour (fixed 8 KiB reads, draining after every write), and with adaptive read sizes and
+write coalescing using the defaults of the proxy, once with the default context size of 8 KiB and once with a context
+size of 64 KiB, which only changes the cost of tracking the context, as read sizes do not depend on it.
+
+Run from the repository root: python -m benchmarks.stream
+"""
+import asyncio
+import time
+
+from yampa import *
+from yampa.proxy import LogQueue, OverflowPolicy
+from yampa.proxy.stream import WireguardStream
+
+from .common import make_manager
+
+BULK_SIZE = 64 * 1024 * 1024
+MODES = {"legacy": 8192, "8k": 8192, "64k": 65536}
+REQUESTS = 5000
+REQUEST = b"A" * 200
+RESPONSE = b"B" * 1000
+
+
+class Transport:
+    """Stand-in for a wireguard TcpStream. Data fed to it is read by the proxy, data the proxy writes to it is handed to
+    `on_write`."""
+
+    def __init__(self, on_write=None):
+        self._inbox = bytearray()
+        self._readable = asyncio.Event()
+        self._eof = False
+        self._on_write = on_write
+        self.writes = 0
+
+    def feed(self, data: bytes):
+        self._inbox += data
+        self._readable.set()
+
+    def feed_eof(self):
+        self._eof = True
+        self._readable.set()
+
+    async def read(self, n: int) -> bytes:
+        while not self._inbox and not self._eof:
+            self._readable.clear()
+            await self._readable.wait()
+        data = bytes(self._inbox[:n])
+        del self._inbox[:n]
+        return data
+
+    def write(self, data: bytes):
+        self.writes += 1
+        if self._on_write is not None:
+            self._on_write(data)
+
+    async def drain(self):
+        await asyncio.sleep(0)
+
+    def write_eof(self):
+        self.feed_eof()
+
+    def close(self):
+        self.feed_eof()
+
+
+class BulkTransport(Transport):
+    """A client sending `size` bytes as fast as they are read."""
+
+    def __init__(self, size: int):
+        super().__init__()
+        self._remaining = size
+        self._chunk = bytes(ProxyConnection.SPLICE_BUFFER_SIZE)
+
+    async def read(self, n: int) -> bytes:
+        await asyncio.sleep(0)
+        n = min(n, self._remaining, len(self._chunk))
+        self._remaining -= n
+        return self._chunk[:n]
+
+
+class FilterPlugin(PluginBase):
+    def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
+                   context: Context) -> None | tuple[FilterAction, bytes | None]:
+        return None
+
+
+def connect(client: Transport, server: Transport, mode: str) -> ProxyConnection:
+    legacy = mode == "legacy"
+    if legacy:
+        streams = {ConnectionDirection.TO_CLIENT: WireguardStream(client),
+                   ConnectionDirection.TO_SERVER: WireguardStream(server)}
+    else:
+        streams = {ConnectionDirection.TO_CLIENT: WireguardStream(client, 65536, 0, 262144),
+                   ConnectionDirection.TO_SERVER: WireguardStream(server, 65536, 0, 262144)}
+
+    connection = ProxyConnection(make_manager([FilterPlugin()]), LogQueue(0, OverflowPolicy.BLOCK, 1), streams,
+                                 ("10.0.0.1", 31337), ("10.0.0.2", 80), ProxyDirection.INBOUND,
+                                 MODES[mode])
+    if legacy:
+        # Fixed read size
+        connection.MIN_READ_SIZE = connection.MAX_READ_SIZE = ProxyConnection.BUFFER_SIZE
+    connection.init()
+    return connection
+
+
+async def bulk(mode: str) -> tuple[float, int]:
+    """:returns: The throughput in MiB/s and the number of writes to the server transport."""
+    received = 0
+
+    def on_write(data):
+        nonlocal received
+        received += len(data)
+
+    client = BulkTransport(BULK_SIZE)
+    server = Transport(on_write)
+    start = time.perf_counter()
+    await connect(client, server, mode).wait_closed()
+    duration = time.perf_counter() - start
+
+    assert received == BULK_SIZE
+    return BULK_SIZE / duration / 1024 / 1024, server.writes
+
+
+async def request_response(mode: str) -> tuple[float, float]:
+    """:returns: The requests per second and the 99th percentile round trip time in microseconds."""
+    response_done = asyncio.Event()
+    received = {"server": 0, "client": 0}
+
+    def server_write(data):
+        received["server"] += len(data)
+        if received["server"] == len(REQUEST):
+            received["server"] = 0
+            server.feed(RESPONSE)
+
+    def client_write(data):
+        received["client"] += len(data)
+        if received["client"] == len(RESPONSE):
+            received["client"] = 0
+            response_done.set()
+
+    client = Transport(client_write)
+    server = Transport(server_write)
+    connection = connect(client, server, mode)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        request_start = time.perf_counter()
+        response_done.clear()
+        client.feed(REQUEST)
+        await response_done.wait()
+        latencies.append(time.perf_counter() - request_start)
+    duration = time.perf_counter() - start
+
+    client.feed_eof()
+    await connection.wait_closed()
+
+    latencies.sort()
+    return REQUESTS / duration, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def main():
+    print(f"{'pattern':>16} {'mode':>8} {'throughput':>16} {'p99 [us]':>9} {'writes':>7}")
+    for mode in MODES:
+        throughput, writes = asyncio.run(bulk(mode))
+        print(f"{'bulk':>16} {mode:>8} {throughput:>10.0f} MiB/s {'':>9} {writes:>7}")
+    for mode in MODES:
+        rate, p99 = asyncio.run(request_response(mode))
+        print(f"{'request/response':>16} {mode:>8} {rate:>12.0f} / s {p99:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
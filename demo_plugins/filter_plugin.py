@@ -1,7 +1,7 @@
 import json
 import os
 from datetime import datetime
-from typing import Set, Dict
+from typing import Set
 import logging
 import asyncio
 
@@ -9,6 +9,9 @@ from yampa import *
 
 from filter_engine import *
 
+# Only reload the plugin, and recompile the rules, if the plugin or the rules changed
+RELOAD_DEPENDENCIES = ["./rules/*.rls"]
+
 
 def constructor():
     rules = ""
@@ -25,28 +28,30 @@ logger = logging.getLogger(__name__)
 
 
 class FilterEnginePlugin(PluginBase):
-    BUFFER_SIZE = 4096
-
     def __init__(self, rules: str) -> None:
         super().__init__()
         self._eve = None
 
         async def init_engine(r):
             engine = await create_filterengine_from_ruleset(r)
+            # Smaller payloads with fewer rules to match are matched right away instead of on the rayon pool
+            engine.offload_size = int(os.environ.get("FILTER_OFFLOAD_SIZE", engine.offload_size))
+            engine.offload_rules = int(os.environ.get("FILTER_OFFLOAD_RULES", engine.offload_rules))
             self._eve = open("./rules/eve.json", "a")
             return engine
 
         self.engine = asyncio.create_task(init_engine(rules))
-        self.udp_conns: dict[tuple[str, int, str, int], Dict[ProxyDirection, bytes]] = {}
-        self.flow_bits: dict[ProxyConnection | tuple[str, int, str, int], Set[str]] = {}
-        self.flow_starts: dict[ProxyConnection | tuple[str, int, str, int], str] = {}
+        self.flow_bits: dict[ProxyConnection | UdpFlow, Set[str]] = {}
+        self.flow_starts: dict[ProxyConnection | UdpFlow, str] = {}
+        # Both directions of every connection are matched chunk by chunk instead of rescanning their context
+        self.streams: dict[ProxyConnection, dict[ProxyDirection, FilterStream]] = {}
 
     def __del__(self):
         if self._eve is not None:
             self._eve.close()
             self._eve = None
 
-    async def tcp_new_connection(self, connection: ProxyConnection) -> None:
+    def _track(self, connection: ProxyConnection | UdpFlow):
         # Persist flowbits across plugin reloads
         flowbit_marker = "FILTER_ENGINE_FLOWBITS"
         flowstart_marker = "FILTER_ENGINE_FLOWSTARTS"
@@ -60,18 +65,31 @@ class FilterEnginePlugin(PluginBase):
         self.flow_bits[connection] = connection.extra[flowbit_marker]
         self.flow_starts[connection] = connection.extra[flowstart_marker]
 
-    async def tcp_connection_closed(self, connection: ProxyConnection) -> None:
+    def _untrack(self, connection: ProxyConnection | UdpFlow):
         del self.flow_bits[connection]
         del self.flow_starts[connection]
+        self.streams.pop(connection, None)
+
+    async def tcp_new_connection(self, connection: ProxyConnection) -> None:
+        self._track(connection)
+
+    async def tcp_connection_closed(self, connection: ProxyConnection) -> None:
+        self._untrack(connection)
+
+    async def udp_flow_new(self, flow: UdpFlow) -> None:
+        self._track(flow)
 
-    async def _log(self, connection: ProxyConnection | tuple[str, int, str, int], metadata: Metadata, effect: PyEffects):
+    async def udp_flow_expired(self, flow: UdpFlow) -> None:
+        self._untrack(flow)
+
+    async def _log(self, connection: ProxyConnection | UdpFlow, metadata: Metadata, effect: PyEffects):
         # This is a minimal version of suricata's eve.json
         log = {
             "src_ip": metadata.src_ip,
             "src_port": metadata.src_port,
             "dest_ip": metadata.dst_ip,
             "dest_port": metadata.dst_port,
-            "flow": {"start": self.flow_starts[connection]},
+            "flow": {"start": self.flow_starts.get(connection)},
             "alert": {
                 "signature": effect.action.message,
                 "signature_id": 0,
@@ -86,10 +104,12 @@ class FilterEnginePlugin(PluginBase):
         self._eve.write(f"{json.dumps(log)}\n")
         self._eve.flush()
 
-    async def _filter(self, connection: ProxyConnection | tuple[str, int, str, int], metadata: Metadata,
-                      context: bytes) -> FilterAction | None:
-        engine = await self.engine
+    async def _engine(self) -> FilterEngine:
+        # Shared by all calls, so shielded from the cancellation of hooks exceeding their budget
+        return await asyncio.shield(self.engine)
 
+    @staticmethod
+    def _pymetadata(metadata: Metadata) -> PyMetadata:
         match metadata.direction:
             case ProxyDirection.INBOUND | (ProxyDirection.INBOUND, _):
                 pymetadata = PyMetadata(inner_port=metadata.dst_port, outer_port=metadata.src_port,
@@ -99,10 +119,13 @@ class FilterEnginePlugin(PluginBase):
                                         direction=PyProxyDirection.OutBound)
             case _:
                 pymetadata = PyMetadata(0, 0, PyProxyDirection.InBound)
+        return pymetadata
 
-        effect = await engine.filter(pymetadata, context, list(self.flow_bits[connection]))
-
-        [self.flow_bits[connection].add(bit) for bit in effect.flow_sets]
+    async def _apply(self, connection: ProxyConnection | UdpFlow, metadata: Metadata,
+                     effect: PyEffects) -> FilterAction | None:
+        # Packets without a flow have no flow bits to set
+        if connection in self.flow_bits:
+            [self.flow_bits[connection].add(bit) for bit in effect.flow_sets]
 
         if effect.action is None:
             return None
@@ -118,34 +141,59 @@ class FilterEnginePlugin(PluginBase):
                 return FilterAction.REJECT
 
     async def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
-                         context: dict[ProxyDirection, bytes]) -> None | tuple[FilterAction, bytes | None]:
-        ret = await self._filter(connection, metadata, context[metadata.direction[0]])
+                         context: Context) -> None | tuple[FilterAction, bytes | None]:
+        engine = await self._engine()
+        direction = metadata.direction[0]
+        streams = self.streams.setdefault(connection, {})
+        stream = streams.get(direction)
+        if stream is None:
+            # Starts with the context, which holds the connection so far if the plugin was reloaded meanwhile, unless
+            # the chunk does not fit into it. Without a context, i.e. with CONTEXT_SIZE=0, every chunk is matched on its
+            # own.
+            stream = streams[direction] = engine.stream(self._pymetadata(metadata), context.capacity)
+            chunk = context.view(direction) if len(data) < context.capacity else data
+        else:
+            chunk = data
+
+        effect = await stream.filter(chunk, list(self.flow_bits[connection]))
+        ret = await self._apply(connection, metadata, effect)
         if ret is not None:
             return ret, data
         else:
             return None
 
-    async def udp_filter(self, metadata: Metadata, data: bytes) -> None | tuple[FilterAction, bytes | None]:
-        # Context tracking
-        conn_tuple = (metadata.src_ip, metadata.src_port, metadata.dst_ip, metadata.dst_port)
-        return_tuple = (metadata.dst_ip, metadata.dst_port, metadata.src_ip, metadata.src_port)
-        if conn_tuple in self.udp_conns:
-            # seen this connection before, do nothing
-            pass
-        elif return_tuple in self.udp_conns:
-            # this is a response to a seen connection
-            conn_tuple = return_tuple
-        else:
-            # fresh connection
-            self.udp_conns[conn_tuple] = {ProxyDirection.INBOUND: b"", ProxyDirection.OUTBOUND: b""}
-            self.flow_bits[conn_tuple] = set()
-            self.flow_starts[conn_tuple] = datetime.utcnow().isoformat() + "+0000"
-
-        self.udp_conns[conn_tuple][metadata.direction] = (self.udp_conns[conn_tuple][metadata.direction] + data)[
-                                                         -self.BUFFER_SIZE:]
-
-        ret = await self._filter(conn_tuple, metadata, self.udp_conns[conn_tuple][metadata.direction])
+    @staticmethod
+    def _udp_payload(metadata: Metadata, data: bytes, flow: UdpFlow | None) -> bytes | memoryview:
+        # The context of a flow ends with the packet, unless it is disabled with UDP_CONTEXT_SIZE=0
+        if flow is None or flow.context.capacity == 0:
+            return data
+        return flow.context.view(metadata.direction)
+
+    async def udp_filter(self, metadata: Metadata, data: bytes,
+                         flow: UdpFlow | None = None) -> None | tuple[FilterAction, bytes | None]:
+        # The proxy tracks the flow and its context, and expires it once idle
+        engine = await self._engine()
+        effect = await engine.filter(self._pymetadata(metadata), self._udp_payload(metadata, data, flow),
+                                     list(self.flow_bits.get(flow, ())))
+        ret = await self._apply(flow, metadata, effect)
         if ret is not None:
             return ret, data
         else:
             return None
+
+    async def udp_filter_batch(self, packets: list[tuple[Metadata, bytes]], flows: list[UdpFlow] | None = None
+                               ) -> list[None | tuple[FilterAction, bytes | None]]:
+        # A batch holds at most one packet per flow, so the context of every flow ends with its packet
+        engine = await self._engine()
+        if flows is None:
+            flows = [None] * len(packets)
+        effects = engine.filter_batch([
+            (self._pymetadata(metadata), self._udp_payload(metadata, data, flow), list(self.flow_bits.get(flow, ())))
+            for (metadata, data), flow in zip(packets, flows)
+        ])
+
+        results = []
+        for (metadata, data), flow, effect in zip(packets, flows, effects):
+            ret = await self._apply(flow, metadata, effect)
+            results.append((ret, data) if ret is not None else None)
+        return results
@@ -0,0 +1,141 @@
+//! Benchmark of matching a full 8 KiB context against rulesets of growing
+//! size, comparing the compiled `RuleSet`, which scans the data once for the
+//! regexes of all relevant rules, with applying every rule on its own as the
+//! engine did before, on the rayon pool.
+//!
+//! The rules of the `any port` group apply to all traffic, the ones of the
+//! `by port` group are spread over 20 services, so only a twentieth of them is
+//! relevant to the data.
+//!
+//! The `stream` group feeds a connection of 1 KiB chunks to the rules, either
+//! matching each chunk once as it arrives, or rescanning the latest 8 KiB of
+//! the connection for every chunk like a context.
+//!
+//! The `batch` group matches a burst of small packets for the services,
+//! spread over the rayon pool like `FilterEngine.filter_batch`, or one after
+//! another.
+//!
+//! Run from `filter_engine/`: cargo bench --no-default-features --bench filter
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use rayon::prelude::*;
+
+use filter_engine::datatypes::{Effects, ProxyDirection, RuleSet};
+use filter_engine::parser::parse;
+
+const RULE_COUNTS: [usize; 4] = [10, 100, 500, 1000];
+const CONTEXT_SIZE: usize = 8192;
+const SERVICES: usize = 20;
+const CHUNK_SIZE: usize = 1024;
+const CHUNKS: usize = 64;
+const BATCH_SIZE: usize = 256;
+const PACKET_SIZE: usize = 512;
+
+/// Rules like the ones written during a game, with one regex each, either for
+/// any port or bound to one of the services
+fn ruleset(count: usize, by_port: bool) -> String {
+    (0..count)
+        .map(|i| {
+            let direction = if by_port { format!("IN({})", 8000 + i % SERVICES) } else { "IN".to_string() };
+            format!(r#"DROP("rule {i}") TAGS("exploit-{i}") : {direction} : "/api/v{i}/[a-z]+\?id='\+OR\+{i}";"#)
+        })
+        .collect::<Vec<_>>()
+        .join(" ")
+}
+
+fn traffic(size: usize) -> Vec<u8> {
+    let request = b"GET /api/v1/items?id=42 HTTP/1.1\r\nHost: service\r\nUser-Agent: checker\r\n\r\n";
+    request.iter().copied().cycle().take(size).collect()
+}
+
+fn filter(c: &mut Criterion) {
+    let data = traffic(CONTEXT_SIZE);
+    let flowbits = Vec::new();
+
+    for (name, by_port) in [("filter any port", false), ("filter by port", true)] {
+        let mut group = c.benchmark_group(name);
+        group.throughput(Throughput::Bytes(data.len() as u64));
+
+        for count in RULE_COUNTS {
+            let rules = parse(ruleset(count, by_port)).expect("benchmark rules should parse");
+            let rule_set = RuleSet::new(parse(ruleset(count, by_port)).expect("benchmark rules should parse"));
+
+            group.bench_with_input(BenchmarkId::new("rule set", count), &count, |b, _| {
+                b.iter(|| rule_set.apply(&data, 8000, 40000, ProxyDirection::InBound, &flowbits))
+            });
+            group.bench_with_input(BenchmarkId::new("per rule", count), &count, |b, _| {
+                b.iter(|| {
+                    rules
+                        .par_iter()
+                        .filter_map(|r| r.apply(&data, 8000, 40000, ProxyDirection::InBound, &flowbits))
+                        .reduce(|| Effects::empty(), |a, b| a + b)
+                })
+            });
+        }
+        group.finish();
+    }
+}
+
+fn stream(c: &mut Criterion) {
+    let data = traffic(CHUNK_SIZE * CHUNKS);
+    let flowbits = Vec::new();
+
+    let mut group = c.benchmark_group("stream");
+    group.throughput(Throughput::Bytes(data.len() as u64));
+
+    for count in RULE_COUNTS {
+        let rule_set = RuleSet::new(parse(ruleset(count, false)).expect("benchmark rules should parse"));
+
+        group.bench_with_input(BenchmarkId::new("stream", count), &count, |b, _| {
+            b.iter(|| {
+                let mut stream = rule_set.stream(ProxyDirection::InBound, 8000, 40000, CONTEXT_SIZE);
+                for chunk in data.chunks(CHUNK_SIZE) {
+                    rule_set.apply_stream(&mut stream, chunk, &flowbits);
+                }
+            })
+        });
+        group.bench_with_input(BenchmarkId::new("rescan context", count), &count, |b, _| {
+            b.iter(|| {
+                for end in (CHUNK_SIZE..=data.len()).step_by(CHUNK_SIZE) {
+                    let context = &data[end.saturating_sub(CONTEXT_SIZE)..end];
+                    rule_set.apply(context, 8000, 40000, ProxyDirection::InBound, &flowbits);
+                }
+            })
+        });
+    }
+    group.finish();
+}
+
+fn batch(c: &mut Criterion) {
+    let packets: Vec<(u16, Vec<u8>)> = (0..BATCH_SIZE)
+        .map(|i| ((8000 + i % SERVICES) as u16, traffic(PACKET_SIZE)))
+        .collect();
+    let flowbits = Vec::new();
+
+    let mut group = c.benchmark_group("batch");
+    group.throughput(Throughput::Elements(packets.len() as u64));
+
+    for count in RULE_COUNTS {
+        let rule_set = RuleSet::new(parse(ruleset(count, true)).expect("benchmark rules should parse"));
+
+        group.bench_with_input(BenchmarkId::new("parallel", count), &count, |b, _| {
+            b.iter(|| {
+                packets
+                    .par_iter()
+                    .map(|(port, data)| rule_set.apply(data, *port, 40000, ProxyDirection::InBound, &flowbits))
+                    .collect::<Vec<_>>()
+            })
+        });
+        group.bench_with_input(BenchmarkId::new("sequential", count), &count, |b, _| {
+            b.iter(|| {
+                packets
+                    .iter()
+                    .map(|(port, data)| rule_set.apply(data, *port, 40000, ProxyDirection::InBound, &flowbits))
+                    .collect::<Vec<_>>()
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, filter, stream, batch);
+criterion_main!(benches);
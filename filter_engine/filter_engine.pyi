@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List
+from typing import List, Tuple
 
 class PyEffects:
     action: PyAction | None
@@ -35,7 +35,25 @@ class PyProxyDirection(Enum):
 
 
 class FilterEngine:
-    async def filter(self, metadata: PyMetadata, data: bytes, flowbits: List[str]) -> PyEffects: ...
+    offload_size: int
+    offload_rules: int
+
+    async def filter(self, metadata: PyMetadata, data: bytes | bytearray | memoryview, flowbits: List[str]) -> PyEffects: ...
+    def filter_sync(self, metadata: PyMetadata, data: bytes | bytearray | memoryview, flowbits: List[str]) -> PyEffects: ...
+    def filter_batch(self, items: List[Tuple[PyMetadata, bytes | bytearray | memoryview, List[str]]]) -> List[PyEffects]: ...
+    def stream(self, metadata: PyMetadata, window: int) -> FilterStream:
+        """Start matching one direction of a connection chunk by chunk.
+
+        Rules match if all their regexes matched within the latest `window` bytes of the stream, or the latest chunk if
+        it is longer, including matches spanning several chunks. Unlike when filtering a context of `window` bytes, matches count as long as they end
+        within the window, even if they start before it, and `^` only matches at the start of the stream, not at the
+        start of the window. A `window` of 0 matches every chunk on its own, like `filter`."""
+        ...
+
+
+class FilterStream:
+    async def filter(self, data: bytes | bytearray | memoryview, flowbits: List[str]) -> PyEffects: ...
+    def filter_sync(self, data: bytes | bytearray | memoryview, flowbits: List[str]) -> PyEffects: ...
 
 
 async def create_filterengine_from_ruleset(connection) -> FilterEngine: ...
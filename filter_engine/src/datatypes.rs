@@ -1,9 +1,14 @@
+use std::collections::HashMap;
 use std::fmt::Debug;
 
-use regex::bytes::Regex;
+use regex::bytes::{Regex, RegexSet};
+use regex_automata::hybrid::dfa::{Cache, DFA};
+use regex_automata::hybrid::LazyStateID;
 
 pub mod effects;
 pub mod rule;
+pub mod ruleset;
+pub mod stream;
 
 /// Represents a single effect, being either an `Action`, a `Tag`, or a `FlowSet`
 #[derive(Debug)]
@@ -67,7 +72,7 @@ pub enum Direction {
 }
 
 /// Represents just the direction
-#[derive(Debug, Clone)]
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
 pub enum ProxyDirection {
     InBound,
     OutBound,
@@ -90,3 +95,95 @@ pub struct Rule {
 }
 
 pub type Rules = Vec<Rule>;
+
+/// Represents the compiled form of `Rules`, which the filter engine matches
+/// data against.
+///
+/// Rules are put into buckets by the direction and inner port they apply to,
+/// so only the rules relevant to the data are looked at. The bucket of a
+/// specific port also holds all rules for any port of that direction.
+#[derive(Debug)]
+pub struct RuleSet {
+    pub rules: Rules,
+    /// The buckets by direction and inner port, `None` for the rules for any
+    /// port, which apply to traffic to or from every port in addition to the
+    /// rules of its bucket
+    pub buckets: HashMap<(ProxyDirection, Option<Port>), RuleBucket>,
+}
+
+/// Represents the rules of a `RuleSet` for one direction and inner port.
+///
+/// The regexes of all of them are combined into a single `RegexSet`, so the
+/// data is scanned once for all of them instead of once per rule. Regexes
+/// shared by several rules are only part of the set once.
+#[derive(Debug)]
+pub struct RuleBucket {
+    /// Indices of the rules in `RuleSet::rules`, in their original order
+    pub rules: Vec<usize>,
+    /// The distinct regexes of the rules, `None` if they are too many to be
+    /// combined, in which case every rule matches its regexes on its own
+    pub regexes: Option<RegexSet>,
+    /// For every rule, the indices of its regexes in `regexes`
+    pub rule_regexes: Vec<Vec<usize>>,
+    /// The same regexes as `regexes` for matching streams chunk by chunk,
+    /// `None` if they use features the lazy DFA does not support, in which
+    /// case streams rescan their latest data on every chunk
+    pub dfa: Option<DFA>,
+}
+
+/// Represents the matching state of one direction of a connection, so that
+/// every chunk of it only has to be scanned once as it arrives.
+///
+/// The state of the DFA is kept between chunks, so matches spanning several
+/// chunks are found as well. Like with rescanning the latest data of the
+/// stream, only matches that end within the latest `window` bytes count, or
+/// within the latest chunk, if it is longer than that.
+///
+/// As the DFA keeps matching across the window, a match counts as long as it
+/// ends within the window, even if it starts before it, unlike when rescanning
+/// the window. Likewise `^` and `\A` only match at the start of the stream,
+/// not at the start of the window.
+///
+/// Every stream builds the states of the DFA it needs in a cache of its own,
+/// so streams never wait for each other. States are only valid until that
+/// cache runs full and is cleared, after which the stream starts over with its
+/// latest `window` bytes, so matches can no longer start before them then. A
+/// `window` of 0 matches every chunk on its own, with `^` matching at its start.
+///
+/// Buckets without a DFA rescan the latest `window` bytes on every chunk, so
+/// their matches have to start within the window, and `^` matches at its
+/// start.
+#[derive(Debug)]
+pub struct RuleStream {
+    pub direction: ProxyDirection,
+    pub home_port: Port,
+    pub out_port: Port,
+    pub window: usize,
+    /// The scans of the buckets of the stream, see `RuleSet::buckets`
+    pub scans: Vec<BucketScan>,
+    /// The number of bytes of the stream so far
+    pub offset: u64,
+    /// The latest `window` bytes of the stream, to start over with, or to
+    /// rescan on every chunk if a bucket has no DFA
+    pub context: Vec<u8>,
+    /// The byte of the stream right before `context`, so that starting over
+    /// with `context` does not match `^` at its start
+    pub look_behind: Option<u8>,
+}
+
+/// Represents the matching state of a `RuleStream` for one of its buckets.
+#[derive(Debug)]
+pub struct BucketScan {
+    /// The key of the bucket in `RuleSet::buckets`
+    pub bucket: (ProxyDirection, Option<Port>),
+    /// The state of the DFA of the bucket after all data so far, along with
+    /// the number of times its cache was cleared back then. `None` if the
+    /// bucket has no DFA, or the stream still has to start over.
+    pub state: Option<(LazyStateID, usize)>,
+    /// The states of the DFA of the bucket built for the stream so far,
+    /// created with the first chunk
+    pub cache: Option<Cache>,
+    /// The offset the latest match of every regex of the bucket ended at, by
+    /// the index of the regex
+    pub match_ends: HashMap<usize, u64>,
+}
@@ -89,6 +89,20 @@ impl Rule {
         Rule { matchers, ..self }
     }
 
+    /// Whether the rule applies to traffic in `direction` between the given
+    /// ports, regardless of its matchers
+    pub fn applies_to(&self, direction: ProxyDirection, home_port: u16, out_port: u16) -> bool {
+        match_direction(&self.direction, direction, home_port, out_port)
+    }
+
+    /// Whether all `FlowIsSet` matchers of the rule match
+    pub fn flows_match(&self, flowbits: &Vec<String>) -> bool {
+        self.matchers.iter().all(|m| match m {
+            Matcher::FlowIsSet(s) => flowbits.contains(s),
+            Matcher::Regex(_) => true,
+        })
+    }
+
     pub fn apply(
         &self,
         data: &[u8],
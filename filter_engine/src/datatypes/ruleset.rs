@@ -0,0 +1,190 @@
+use std::collections::HashMap;
+
+use regex::bytes::RegexSetBuilder;
+use regex_automata::hybrid::dfa::DFA;
+use regex_automata::nfa::thompson;
+use regex_automata::{util::syntax, MatchKind};
+
+use super::{Direction, Effects, Matcher, Port, ProxyDirection, RuleBucket, RulePort, RuleSet, Rules};
+
+/// Size limit of the compiled `RegexSet` of a bucket, which is way larger than
+/// the one of a single regex, as it holds the regexes of many rules
+const REGEX_SET_SIZE_LIMIT: usize = 256 * 1024 * 1024;
+
+/// Size limit of the states of the lazy DFA of a bucket built for a single
+/// stream, beyond which they are thrown away and built again as needed. Every
+/// stream has a cache of its own, which only grows as far as its data needs.
+const DFA_CACHE_CAPACITY: usize = 2 * 1024 * 1024;
+
+impl RuleSet {
+    /// Compiles rules into a `RuleSet`
+    pub fn new(rules: Rules) -> RuleSet {
+        let mut indices: HashMap<(ProxyDirection, Option<Port>), Vec<usize>> = HashMap::new();
+        for direction in [ProxyDirection::InBound, ProxyDirection::OutBound] {
+            indices.insert((direction, None), Vec::new());
+        }
+        for (i, rule) in rules.iter().enumerate() {
+            let (direction, ports) = match &rule.direction {
+                Direction::InBound(ports) => (ProxyDirection::InBound, ports),
+                Direction::OutBound(ports) => (ProxyDirection::OutBound, ports),
+            };
+            let port = match ports.ours {
+                RulePort::Specific(port) => Some(port),
+                RulePort::All => None,
+            };
+            indices.entry((direction, port)).or_default().push(i);
+        }
+
+        // Rules for any port are kept in a bucket of their own, which is
+        // matched alongside the one for the port instead of being copied into
+        // every bucket for a specific port
+        let buckets = indices
+            .into_iter()
+            .map(|(key, bucket)| (key, RuleBucket::new(&rules, bucket)))
+            .collect();
+
+        RuleSet { rules, buckets }
+    }
+
+    /// The number of rules that might apply to traffic in `direction` to or
+    /// from `home_port`
+    pub fn bucket_len(&self, direction: ProxyDirection, home_port: u16) -> usize {
+        self.buckets(direction, home_port).map(|key| self.buckets[&key].rules.len()).sum()
+    }
+
+    /// The keys of the buckets of the rules for `direction` and `home_port`,
+    /// the one for `home_port` if there is one, and the one for any port
+    pub fn buckets(
+        &self,
+        direction: ProxyDirection,
+        home_port: u16,
+    ) -> impl Iterator<Item = (ProxyDirection, Option<Port>)> {
+        let port = Some((direction, Some(home_port))).filter(|key| self.buckets.contains_key(key));
+        port.into_iter().chain([(direction, None)])
+    }
+
+    /// Applies all rules to `data` and returns their combined effects
+    pub fn apply(
+        &self,
+        data: &[u8],
+        home_port: u16,
+        out_port: u16,
+        direction: ProxyDirection,
+        flowbits: &Vec<String>,
+    ) -> Effects {
+        self.buckets(direction, home_port)
+            .map(|key| self.buckets[&key].apply(&self.rules, data, home_port, out_port, direction, flowbits))
+            .fold(Effects::empty(), |a, b| a + b)
+    }
+}
+
+impl RuleBucket {
+    /// Compiles the rules at `indices` of `rules` into a bucket
+    pub fn new(rules: &Rules, indices: Vec<usize>) -> RuleBucket {
+        let mut patterns: Vec<&str> = Vec::new();
+        let mut pattern_indices: HashMap<&str, usize> = HashMap::new();
+        let rule_regexes = indices
+            .iter()
+            .map(|&i| {
+                rules[i]
+                    .matchers
+                    .iter()
+                    .filter_map(|m| match m {
+                        Matcher::Regex(r) => Some(r.as_str()),
+                        Matcher::FlowIsSet(_) => None,
+                    })
+                    .map(|pattern| {
+                        *pattern_indices.entry(pattern).or_insert_with(|| {
+                            patterns.push(pattern);
+                            patterns.len() - 1
+                        })
+                    })
+                    .collect()
+            })
+            .collect();
+
+        let regexes = RegexSetBuilder::new(&patterns)
+            .size_limit(REGEX_SET_SIZE_LIMIT)
+            .build()
+            .ok();
+
+        // Like `regex::bytes`, match arbitrary bytes instead of only valid UTF-8
+        let dfa = DFA::builder()
+            .configure(
+                DFA::config()
+                    .match_kind(MatchKind::All)
+                    .cache_capacity(DFA_CACHE_CAPACITY),
+            )
+            .syntax(syntax::Config::new().utf8(false))
+            .thompson(thompson::Config::new().utf8(false))
+            .build_many(&patterns)
+            .ok();
+
+        RuleBucket {
+            rules: indices,
+            regexes,
+            rule_regexes,
+            dfa,
+        }
+    }
+
+    /// Applies the rules of the bucket to `data` and returns their combined
+    /// effects.
+    ///
+    /// The outer port and flow bits of every rule are checked first, and only
+    /// if any rule with regexes is left, `data` is scanned once for the regexes
+    /// of all rules.
+    pub fn apply(
+        &self,
+        rules: &Rules,
+        data: &[u8],
+        home_port: u16,
+        out_port: u16,
+        direction: ProxyDirection,
+        flowbits: &Vec<String>,
+    ) -> Effects {
+        let candidates = self.candidates(rules, home_port, out_port, direction, flowbits);
+
+        if candidates.iter().all(|&i| self.rule_regexes[i].is_empty()) {
+            return self.combine(rules, candidates, |_| true);
+        }
+
+        match &self.regexes {
+            Some(regexes) => {
+                let matches = regexes.matches(data);
+                self.combine(rules, candidates, |r| matches.matched(r))
+            }
+            None => candidates
+                .into_iter()
+                .filter_map(|i| rules[self.rules[i]].apply(data, home_port, out_port, direction, flowbits))
+                .fold(Effects::empty(), |a, b| a + b),
+        }
+    }
+
+    /// The rules of the bucket whose ports, direction and flow bits match, as
+    /// indices into `self.rules`
+    pub fn candidates(
+        &self,
+        rules: &Rules,
+        home_port: u16,
+        out_port: u16,
+        direction: ProxyDirection,
+        flowbits: &Vec<String>,
+    ) -> Vec<usize> {
+        (0..self.rules.len())
+            .filter(|&i| {
+                let rule = &rules[self.rules[i]];
+                rule.applies_to(direction, home_port, out_port) && rule.flows_match(flowbits)
+            })
+            .collect()
+    }
+
+    /// Combines the effects of all `candidates` for which `matched` is true
+    /// for all of their regexes, given by their index in `self.regexes`
+    pub fn combine(&self, rules: &Rules, candidates: Vec<usize>, matched: impl Fn(usize) -> bool) -> Effects {
+        candidates
+            .into_iter()
+            .filter(|&i| self.rule_regexes[i].iter().all(|&r| matched(r)))
+            .fold(Effects::empty(), |a, i| a + rules[self.rules[i]].effects.clone())
+    }
+}
@@ -0,0 +1,166 @@
+use std::collections::HashMap;
+
+use regex_automata::hybrid::dfa::{Cache, DFA};
+use regex_automata::hybrid::LazyStateID;
+use regex_automata::util::start;
+use regex_automata::Anchored;
+
+use super::{BucketScan, Effects, Port, ProxyDirection, RuleSet, RuleStream};
+
+impl RuleSet {
+    /// Starts matching one direction of a connection chunk by chunk, with
+    /// matches counting while they end within the latest `window` bytes
+    pub fn stream(&self, direction: ProxyDirection, home_port: Port, out_port: Port, window: usize) -> RuleStream {
+        RuleStream {
+            direction,
+            home_port,
+            out_port,
+            window,
+            scans: self
+                .buckets(direction, home_port)
+                .map(|bucket| BucketScan {
+                    bucket,
+                    state: None,
+                    cache: None,
+                    match_ends: HashMap::new(),
+                })
+                .collect(),
+            offset: 0,
+            context: Vec::new(),
+            look_behind: None,
+        }
+    }
+
+    /// Applies all rules to the next chunk of a stream and returns their
+    /// combined effects
+    pub fn apply_stream(&self, stream: &mut RuleStream, data: &[u8], flowbits: &Vec<String>) -> Effects {
+        // The context has to end at the offset, so both move along before
+        // anything can fail, and the context is only cut down to `window`
+        // bytes once done
+        stream.context.extend_from_slice(data);
+        stream.offset += data.len() as u64;
+
+        // Every chunk is matched as a whole, even if it is longer than the window
+        let window = if stream.window == 0 { data.len() } else { stream.window.max(data.len()) };
+        let latest = stream.context.len().saturating_sub(window);
+        let since = stream.offset - (stream.context.len() - latest) as u64;
+        // Every chunk on its own starts at the start of the haystack, like with
+        // a context
+        let look_behind = if stream.window == 0 { None } else { stream.look_behind };
+        let mut effects = Effects::empty();
+        for bucket_scan in &mut stream.scans {
+            let bucket = &self.buckets[&bucket_scan.bucket];
+            let scanned = bucket.dfa.as_ref().map_or(false, |dfa| {
+                let mut cache = bucket_scan.cache.take().unwrap_or_else(|| dfa.create_cache());
+                let scanned =
+                    scan(dfa, &mut cache, bucket_scan, &stream.context, look_behind, stream.offset, data).is_some();
+                bucket_scan.cache = Some(cache);
+                scanned
+            });
+            if stream.window == 0 {
+                // Start over with the next chunk alone
+                bucket_scan.state = None;
+            }
+
+            effects = effects
+                + if scanned {
+                    let candidates =
+                        bucket.candidates(&self.rules, stream.home_port, stream.out_port, stream.direction, flowbits);
+                    bucket.combine(&self.rules, candidates, |r| {
+                        bucket_scan.match_ends.get(&r).map_or(false, |&end| end > since)
+                    })
+                } else {
+                    // Rescan the chunk or the latest `window` bytes, like for a context
+                    bucket.apply(
+                        &self.rules,
+                        &stream.context[latest..],
+                        stream.home_port,
+                        stream.out_port,
+                        stream.direction,
+                        flowbits,
+                    )
+                };
+        }
+
+        let excess = stream.context.len().saturating_sub(stream.window);
+        if excess > 0 {
+            stream.look_behind = Some(stream.context[excess - 1]);
+        }
+        stream.context.drain(..excess);
+        effects
+    }
+}
+
+/// Feeds `data`, the chunk a stream just moved along by to `offset`, to the
+/// DFA of a bucket and records the end of every match in it, starting over
+/// with `context`, the latest data of the stream ending with `data` and
+/// following `look_behind`, if the state of the scan is no longer valid
+///
+/// # Returns
+/// `None` if the DFA could not be used for the stream, which has to start
+/// over with its next chunk then
+fn scan(
+    dfa: &DFA,
+    cache: &mut Cache,
+    bucket_scan: &mut BucketScan,
+    context: &[u8],
+    look_behind: Option<u8>,
+    offset: u64,
+    data: &[u8],
+) -> Option<()> {
+    let state = match bucket_scan.state.take() {
+        Some((state, clears)) if clears == cache.clear_count() => {
+            let start = offset - data.len() as u64;
+            feed(dfa, cache, state, data, start, &mut bucket_scan.match_ends)?
+        }
+        _ => {
+            let state = dfa
+                .start_state(cache, &start::Config::new().anchored(Anchored::No).look_behind(look_behind))
+                .ok()?;
+            let start = offset - context.len() as u64;
+            feed(dfa, cache, state, context, start, &mut bucket_scan.match_ends)?
+        }
+    };
+    // Taken before looking ahead, which might clear the cache as well
+    bucket_scan.state = Some((state, cache.clear_count()));
+
+    // Matches ending with `data` would only be reported with the next byte,
+    // so look ahead as if the stream ended here, without keeping that state
+    let eoi = dfa.next_eoi_state(cache, state).ok()?;
+    if eoi.is_match() {
+        record(dfa, cache, eoi, offset, &mut bucket_scan.match_ends);
+    }
+    Some(())
+}
+
+/// Feeds `data` starting at `offset` of a stream to the DFA in `state`
+///
+/// # Returns
+/// The state of the DFA after `data`, `None` if it gave up
+fn feed(
+    dfa: &DFA,
+    cache: &mut Cache,
+    mut state: LazyStateID,
+    data: &[u8],
+    offset: u64,
+    match_ends: &mut HashMap<usize, u64>,
+) -> Option<LazyStateID> {
+    for (i, &byte) in data.iter().enumerate() {
+        state = dfa.next_state(cache, state, byte).ok()?;
+        if state.is_tagged() {
+            if state.is_match() {
+                // Matches are reported one byte late, so they ended before this byte
+                record(dfa, cache, state, offset + i as u64, match_ends);
+            } else if state.is_quit() {
+                return None;
+            }
+        }
+    }
+    Some(state)
+}
+
+fn record(dfa: &DFA, cache: &Cache, state: LazyStateID, end: u64, match_ends: &mut HashMap<usize, u64>) {
+    for i in 0..dfa.match_len(cache, state) {
+        match_ends.insert(dfa.match_pattern(cache, state, i).as_usize(), end);
+    }
+}
@@ -8,7 +8,7 @@ use python::*;
 
 /// Setup function for the pymodule.
 ///
-/// Adds the `PyEffects`, `PyActionType` and `FilterEngine` classes, and the
+/// Adds the `PyEffects`, `PyActionType`, `FilterEngine` and `FilterStream` classes, and the
 /// `create_filterengine_from_ruleset` function to be available from python
 #[pymodule]
 fn filter_engine(_py: Python, m: &PyModule) -> PyResult<()> {
@@ -21,6 +21,7 @@ fn filter_engine(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<PyMetadata>()?;
     m.add_class::<PyProxyDirection>()?;
     m.add_class::<FilterEngine>()?;
+    m.add_class::<FilterStream>()?;
 
     Ok(())
 }
@@ -2,4 +2,4 @@ mod datatypes;
 mod filter_engine;
 
 pub use datatypes::{PyEffects, PyAction, PyActionType, PyMetadata, PyProxyDirection};
-pub use filter_engine::{create_filterengine_from_ruleset, rules_lint, FilterEngine};
+pub use filter_engine::{create_filterengine_from_ruleset, rules_lint, FilterEngine, FilterStream};
@@ -1,37 +1,183 @@
 use std::io;
 use std::io::Read;
-use std::sync::Arc;
+use std::sync::{Arc, Mutex};
+use pyo3::buffer::PyBuffer;
 use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
 use rayon::prelude::*;
-use crate::datatypes::{Rules, Effects};
+use crate::datatypes::{Rules, RuleSet, RuleStream};
 use crate::parser::parse;
 use crate::python::PyEffects;
 use crate::python::datatypes::PyMetadata;
 
+/// Payload size from which `filter` matches on the rayon pool instead of inline
+const DEFAULT_OFFLOAD_SIZE: usize = 4096;
+/// Number of rules for the direction and port of a payload from which `filter` matches on the rayon pool instead of
+/// inline
+const DEFAULT_OFFLOAD_RULES: usize = 256;
+
 /// Instance of a Filter Engine
 /// Create this using `create_filterengine_from_ruleset`
 #[pyclass]
 #[derive(Debug)]
 pub struct FilterEngine {
-    pub(crate) rules: Arc<Rules>,
+    pub(crate) rules: Arc<RuleSet>,
+    /// Payloads of at least this many bytes are matched on the rayon pool by `filter`
+    #[pyo3(get, set)]
+    pub(crate) offload_size: usize,
+    /// Payloads for which at least this many rules apply are matched on the rayon pool by `filter`
+    #[pyo3(get, set)]
+    pub(crate) offload_rules: usize,
 }
 
 /// Instantiates a new filter_engine from a ruleset string
 #[pymethods]
 impl FilterEngine {
     /// Apply the filter rules and return a list of Effects.
-    fn filter<'a>(&self, py: Python<'a>, metadata: PyMetadata, data: Vec<u8>, flowbits: Vec<String>) -> PyResult<&'a PyAny> {
+    ///
+    /// `data` can be any object supporting the buffer protocol, like `bytes` or a `memoryview` of the connection
+    /// context. It is copied in a single pass before returning, so the buffer may change afterwards.
+    ///
+    /// Small payloads with few rules to match are matched right away with the GIL released, like `filter_sync`, and
+    /// a future that is already done is returned, which saves the hop to the rayon pool and back. Only payloads of at
+    /// least `offload_size` bytes, or with at least `offload_rules` rules for their direction and port, are matched
+    /// on the rayon pool, so they do not hold up the event loop.
+    fn filter<'a>(&self, py: Python<'a>, metadata: PyMetadata, data: PyBuffer<u8>, flowbits: Vec<String>) -> PyResult<&'a PyAny> {
+        let data = data.to_vec(py)?;
         let rules = self.rules.clone();
+        let direction = metadata.direction.into();
+        if !self.offload(data.len(), rules.bucket_len(direction, metadata.inner_port)) {
+            let effects = py.allow_threads(move || {
+                PyEffects::from(rules.apply(&data, metadata.inner_port, metadata.outer_port, direction, &flowbits))
+            });
+            return ready(py, effects);
+        }
         pyo3_asyncio::tokio::future_into_py(py, async move {
             tokio_rayon::spawn(move || -> Result<PyEffects, _> {
-                Ok(rules.par_iter()
-                    .filter_map(move |r| r.apply(&data, metadata.inner_port, metadata.outer_port, metadata.direction.into(), &flowbits))
-                    .reduce(|| Effects::empty(), |a, b| a + b)
-                    .into())
+                Ok(rules.apply(&data, metadata.inner_port, metadata.outer_port, direction, &flowbits).into())
             }).await
         })
     }
+
+    /// Apply the filter rules and return a list of Effects, like `filter`, but right away on the calling thread with
+    /// the GIL released.
+    ///
+    /// This has the lowest latency for small payloads, but blocks the event loop while matching.
+    fn filter_sync(&self, py: Python<'_>, metadata: PyMetadata, data: PyBuffer<u8>, flowbits: Vec<String>) -> PyResult<PyEffects> {
+        let data = data.to_vec(py)?;
+        let rules = &self.rules;
+        Ok(py.allow_threads(|| {
+            rules.apply(&data, metadata.inner_port, metadata.outer_port, metadata.direction.into(), &flowbits).into()
+        }))
+    }
+
+    /// Apply the filter rules to many payloads at once and return the Effects of each, in the same order.
+    ///
+    /// Every item is a tuple of the metadata, data and flow bits of a payload, like the arguments of `filter`. The
+    /// payloads are copied first, then matched in parallel on the rayon pool with the GIL released once for the whole
+    /// batch, which saves the per-call overhead of `filter` for bursts of packets. Like `filter_sync`, this returns
+    /// once all payloads are matched.
+    fn filter_batch(&self, py: Python<'_>, items: Vec<(PyMetadata, PyBuffer<u8>, Vec<String>)>) -> PyResult<Vec<PyEffects>> {
+        let items = items.into_iter()
+            .map(|(metadata, data, flowbits)| Ok((metadata, data.to_vec(py)?, flowbits)))
+            .collect::<PyResult<Vec<_>>>()?;
+        let rules = &self.rules;
+        Ok(py.allow_threads(|| {
+            items.par_iter()
+                .map(|(metadata, data, flowbits)| {
+                    rules.apply(data, metadata.inner_port, metadata.outer_port, metadata.direction.into(), flowbits)
+                        .into()
+                })
+                .collect()
+        }))
+    }
+
+    /// Start matching one direction of a connection chunk by chunk, see `FilterStream`.
+    ///
+    /// Rules match if all their regexes matched within the latest `window` bytes of the stream, or the latest chunk if it
+    /// is longer, like when filtering a context of that size, including matches spanning several chunks. Unlike with a
+    /// context, matches count as long as they end within the window, even if they start before it, and `^` only matches
+    /// at the start of the stream, not at the start of the window. A `window` of 0 matches every chunk on its own, like
+    /// filtering it.
+    fn stream(&self, metadata: PyMetadata, window: usize) -> FilterStream {
+        let direction = metadata.direction.into();
+        FilterStream {
+            rules: self.rules.clone(),
+            stream: Arc::new(Mutex::new(
+                self.rules.stream(direction, metadata.inner_port, metadata.outer_port, window)
+            )),
+            offload_size: self.offload_size,
+            offload_rules: self.offload(0, self.rules.bucket_len(direction, metadata.inner_port)),
+        }
+    }
+}
+
+impl FilterEngine {
+    pub(crate) fn new(rules: RuleSet) -> FilterEngine {
+        FilterEngine {
+            rules: Arc::new(rules),
+            offload_size: DEFAULT_OFFLOAD_SIZE,
+            offload_rules: DEFAULT_OFFLOAD_RULES,
+        }
+    }
+
+    /// Whether to match a payload of `size` bytes with `rules` rules to apply on the rayon pool
+    fn offload(&self, size: usize, rules: usize) -> bool {
+        size >= self.offload_size || rules >= self.offload_rules
+    }
+}
+
+/// Matching state of one direction of a connection, so that each chunk is only scanned once as it arrives instead of
+/// rescanning the whole context for every chunk.
+/// Create this using `FilterEngine.stream`
+#[pyclass]
+pub struct FilterStream {
+    rules: Arc<RuleSet>,
+    stream: Arc<Mutex<RuleStream>>,
+    /// `FilterEngine.offload_size` when the stream was created
+    offload_size: usize,
+    /// Whether the stream has enough rules to apply to always match on the rayon pool
+    offload_rules: bool,
+}
+
+#[pymethods]
+impl FilterStream {
+    /// Apply the filter rules to the next chunk of the stream and return a list of Effects.
+    ///
+    /// `data` is only the chunk that arrived, which is copied before returning. Chunks have to be filtered one after
+    /// another in the order they arrived. Like `FilterEngine.filter`, small chunks are matched right away.
+    fn filter<'a>(&self, py: Python<'a>, data: PyBuffer<u8>, flowbits: Vec<String>) -> PyResult<&'a PyAny> {
+        let data = data.to_vec(py)?;
+        let rules = self.rules.clone();
+        let stream = self.stream.clone();
+        if !self.offload_rules && data.len() < self.offload_size {
+            let effects = py.allow_threads(move || {
+                PyEffects::from(rules.apply_stream(&mut stream.lock().unwrap(), &data, &flowbits))
+            });
+            return ready(py, effects);
+        }
+        pyo3_asyncio::tokio::future_into_py(py, async move {
+            tokio_rayon::spawn(move || -> Result<PyEffects, _> {
+                Ok(rules.apply_stream(&mut stream.lock().unwrap(), &data, &flowbits).into())
+            }).await
+        })
+    }
+
+    /// Apply the filter rules to the next chunk of the stream and return a list of Effects, like `filter`, but right
+    /// away on the calling thread with the GIL released.
+    fn filter_sync(&self, py: Python<'_>, data: PyBuffer<u8>, flowbits: Vec<String>) -> PyResult<PyEffects> {
+        let data = data.to_vec(py)?;
+        let rules = &self.rules;
+        let stream = &self.stream;
+        Ok(py.allow_threads(|| rules.apply_stream(&mut stream.lock().unwrap(), &data, &flowbits).into()))
+    }
+}
+
+/// Returns a future of the running event loop that is already done with `value`, so awaiting it does not suspend
+fn ready(py: Python<'_>, value: impl IntoPy<PyObject>) -> PyResult<&PyAny> {
+    let future = pyo3_asyncio::get_running_loop(py)?.call_method0("create_future")?;
+    future.call_method1("set_result", (value.into_py(py),))?;
+    Ok(future)
 }
 
 fn parse_rulestring(ruleset: String) -> Result<Rules, String> {
@@ -51,9 +197,7 @@ fn parse_rulestring(ruleset: String) -> Result<Rules, String> {
 pub fn create_filterengine_from_ruleset(py: Python<'_>, ruleset: String) -> PyResult<&PyAny> {
     pyo3_asyncio::tokio::future_into_py(py, async move {
         tokio_rayon::spawn(move || {
-            Ok(FilterEngine {
-                rules: Arc::new(parse_rulestring(ruleset).map_err(|s| PyValueError::new_err(s))?)
-            })
+            Ok(FilterEngine::new(RuleSet::new(parse_rulestring(ruleset).map_err(|s| PyValueError::new_err(s))?)))
         }).await
     })
 }
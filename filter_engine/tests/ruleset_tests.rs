@@ -0,0 +1,203 @@
+#[cfg(test)]
+mod tests {
+    use rayon::prelude::*;
+    use regex::bytes::Regex;
+
+    use filter_engine::datatypes::{
+        Action, Direction, Effects, Matcher, ProxyDirection, Rule, RulePort, RulePorts, RuleSet, Rules,
+    };
+
+    const PATTERNS: [&str; 6] = ["abc", "a+b", r"x[0-9]{2}", "^GET", r"flag\{[a-z]+\}", "(?i)ABC"];
+
+    /// Deterministic pseudo random numbers below `n`, so failures can be reproduced
+    struct Random(u64);
+
+    impl Random {
+        fn below(&mut self, n: usize) -> usize {
+            self.0 = self.0.wrapping_mul(6364136223846793005).wrapping_add(1442695040888963407);
+            ((self.0 >> 33) % n as u64) as usize
+        }
+    }
+
+    fn ports(ours: Option<u16>, theirs: Option<u16>) -> RulePorts {
+        RulePorts {
+            ours: ours.map_or(RulePort::All, RulePort::Specific),
+            theirs: theirs.map_or(RulePort::All, RulePort::Specific),
+        }
+    }
+
+    fn rule(action: Action, tag: &str, direction: Direction, patterns: &[&str], flows: &[&str]) -> Rule {
+        let mut matchers: Vec<Matcher> = patterns.iter().map(|p| Matcher::Regex(Regex::new(p).unwrap())).collect();
+        matchers.extend(flows.iter().map(|f| Matcher::FlowIsSet(f.to_string())));
+        Rule::empty()
+            .with_action(action)
+            .with_tags(vec![tag.to_string()])
+            .with_direction(direction)
+            .with_matchers(matchers)
+    }
+
+    /// Rules for specific ports and any port in both directions, sharing regexes and flow bits. Called twice to get
+    /// the same rules for the `RuleSet` and for applying them one by one.
+    fn random_rules(seed: u64) -> Rules {
+        let mut random = Random(seed);
+        (0..80)
+            .map(|i| {
+                let action = match random.below(3) {
+                    0 => Action::Accept(None),
+                    1 => Action::Alert(Some(format!("alert {i}"))),
+                    _ => Action::Drop(Some(format!("drop {i}"))),
+                };
+                let patterns: Vec<&str> = (0..random.below(3)).map(|_| PATTERNS[random.below(PATTERNS.len())]).collect();
+                let flows: &[&str] = if random.below(3) == 0 { &["bit"] } else { &[] };
+                let ours = (random.below(2) == 0).then(|| 80 + random.below(3) as u16);
+                let theirs = (random.below(4) == 0).then_some(1000);
+                let direction = if random.below(2) == 0 {
+                    Direction::InBound(ports(ours, theirs))
+                } else {
+                    Direction::OutBound(ports(ours, theirs))
+                };
+                let rule = rule(action, &format!("tag {i}"), direction, &patterns, flows);
+                if i % 7 == 0 { rule.with_flow_sets(vec![format!("flow {i}")]) } else { rule }
+            })
+            .collect()
+    }
+
+    /// Applies every rule on its own, like the engine did before compiling rules into a `RuleSet`
+    fn apply_per_rule(
+        rules: &Rules,
+        data: &[u8],
+        home_port: u16,
+        out_port: u16,
+        direction: ProxyDirection,
+        flowbits: &Vec<String>,
+    ) -> Effects {
+        rules
+            .iter()
+            .filter_map(|r| r.apply(data, home_port, out_port, direction, flowbits))
+            .fold(Effects::empty(), |a, b| a + b)
+    }
+
+    /// Effects with their tags and flow sets sorted, as their order depends on the order the buckets are applied in
+    fn normalized(effects: Effects) -> (Option<Action>, Vec<String>, Vec<String>) {
+        let mut tags = effects.tags;
+        tags.sort();
+        let mut flow_sets = effects.flow_sets;
+        flow_sets.sort();
+        (effects.action, tags, flow_sets)
+    }
+
+    fn cases() -> Vec<(&'static [u8], u16, u16, ProxyDirection, Vec<String>)> {
+        let payloads: [&'static [u8]; 6] = [b"", b"abc", b"GET aab x12 flag{xy}", b"zzz", b"x99 ABC", b"\xffab\xfe"];
+        let mut cases = Vec::new();
+        for data in payloads {
+            for home_port in [80, 81, 82, 83] {
+                for out_port in [1000, 2000] {
+                    for direction in [ProxyDirection::InBound, ProxyDirection::OutBound] {
+                        for flowbits in [vec![], vec!["bit".to_string()]] {
+                            cases.push((data, home_port, out_port, direction, flowbits));
+                        }
+                    }
+                }
+            }
+        }
+        cases
+    }
+
+    #[test]
+    fn rule_set_matches_applying_every_rule() {
+        for seed in 0..5 {
+            let rules = random_rules(seed);
+            let rule_set = RuleSet::new(random_rules(seed));
+            for (data, home_port, out_port, direction, flowbits) in cases() {
+                assert_eq!(
+                    normalized(rule_set.apply(data, home_port, out_port, direction, &flowbits)),
+                    normalized(apply_per_rule(&rules, data, home_port, out_port, direction, &flowbits)),
+                    "seed {seed}, {data:?} to port {home_port} from {out_port} {direction:?} with {flowbits:?}",
+                );
+            }
+        }
+    }
+
+    #[test]
+    fn buckets_without_regex_set_apply_every_rule() {
+        let rules = random_rules(42);
+        let mut rule_set = RuleSet::new(random_rules(42));
+        for bucket in rule_set.buckets.values_mut() {
+            bucket.regexes = None;
+        }
+        for (data, home_port, out_port, direction, flowbits) in cases() {
+            assert_eq!(
+                normalized(rule_set.apply(data, home_port, out_port, direction, &flowbits)),
+                normalized(apply_per_rule(&rules, data, home_port, out_port, direction, &flowbits)),
+            );
+        }
+    }
+
+    #[test]
+    fn rules_for_any_port_apply_alongside_the_port() {
+        let any_port = || Direction::InBound(ports(None, None));
+        let port = || Direction::InBound(ports(Some(80), None));
+        let rule_set = RuleSet::new(vec![
+            rule(Action::Alert(Some("any".to_string())), "any", any_port(), &["abc"], &[]),
+            rule(Action::Drop(Some("port".to_string())), "port", port(), &["abc"], &[]),
+            rule(Action::Accept(None), "other port", Direction::InBound(ports(Some(81), None)), &["abc"], &[]),
+        ]);
+
+        assert_eq!(rule_set.bucket_len(ProxyDirection::InBound, 80), 2);
+        assert_eq!(rule_set.bucket_len(ProxyDirection::InBound, 82), 1);
+        assert_eq!(rule_set.bucket_len(ProxyDirection::OutBound, 80), 0);
+        assert_eq!(
+            normalized(rule_set.apply(b"abc", 80, 1, ProxyDirection::InBound, &vec![])),
+            (Some(Action::Drop(Some("port".to_string()))), vec!["any".to_string(), "port".to_string()], vec![]),
+        );
+        assert_eq!(
+            normalized(rule_set.apply(b"abc", 82, 1, ProxyDirection::InBound, &vec![])),
+            (Some(Action::Alert(Some("any".to_string()))), vec!["any".to_string()], vec![]),
+        );
+        assert!(rule_set.apply(b"abc", 80, 1, ProxyDirection::OutBound, &vec![]).action.is_none());
+    }
+
+    #[test]
+    fn worse_actions_win_regardless_of_bucket_and_order() {
+        let actions = [Action::Accept(None), Action::Alert(None), Action::Drop(None)];
+        for first in &actions {
+            for second in &actions {
+                for (first_port, second_port) in [(None, None), (Some(80), None), (None, Some(80)), (Some(80), Some(80))] {
+                    let rules = || {
+                        vec![
+                            rule(first.clone(), "first", Direction::InBound(ports(first_port, None)), &["abc"], &[]),
+                            rule(second.clone(), "second", Direction::InBound(ports(second_port, None)), &["a+b"], &[]),
+                        ]
+                    };
+                    let effects = RuleSet::new(rules()).apply(b"xabc", 80, 1, ProxyDirection::InBound, &vec![]);
+                    assert_eq!(effects.action.as_ref(), Some(first.max(second)));
+                    assert_eq!(
+                        normalized(effects),
+                        normalized(apply_per_rule(&rules(), b"xabc", 80, 1, ProxyDirection::InBound, &vec![])),
+                    );
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn batches_match_like_single_payloads() {
+        let rule_set = RuleSet::new(random_rules(7));
+        let items = cases();
+        // Like `FilterEngine.filter_batch`
+        let batch: Vec<Effects> = items
+            .par_iter()
+            .map(|(data, home_port, out_port, direction, flowbits)| {
+                rule_set.apply(data, *home_port, *out_port, *direction, flowbits)
+            })
+            .collect();
+
+        assert_eq!(batch.len(), items.len());
+        for (effects, (data, home_port, out_port, direction, flowbits)) in batch.into_iter().zip(items) {
+            assert_eq!(
+                normalized(effects),
+                normalized(rule_set.apply(data, home_port, out_port, direction, &flowbits)),
+            );
+        }
+    }
+}
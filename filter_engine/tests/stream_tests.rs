@@ -0,0 +1,161 @@
+#[cfg(test)]
+mod tests {
+    use regex::bytes::Regex;
+
+    use filter_engine::datatypes::{
+        Action, Direction, Effects, Matcher, ProxyDirection, Rule, RulePort, RulePorts, RuleSet, RuleStream,
+    };
+
+    /// Deterministic pseudo random numbers below `n`, so failures can be reproduced
+    struct Random(u64);
+
+    impl Random {
+        fn below(&mut self, n: usize) -> usize {
+            self.0 = self.0.wrapping_mul(6364136223846793005).wrapping_add(1442695040888963407);
+            ((self.0 >> 33) % n as u64) as usize
+        }
+    }
+
+    fn rule(tag: &str, port: Option<u16>, pattern: &str) -> Rule {
+        let ours = port.map_or(RulePort::All, RulePort::Specific);
+        Rule::empty()
+            .with_action(Action::Drop(None))
+            .with_tags(vec![tag.to_string()])
+            .with_direction(Direction::InBound(RulePorts { ours, theirs: RulePort::All }))
+            .with_matchers(vec![Matcher::Regex(Regex::new(pattern).unwrap())])
+    }
+
+    fn rule_set(patterns: &[&str]) -> RuleSet {
+        RuleSet::new(patterns.iter().map(|p| rule(p, None, p)).collect())
+    }
+
+    fn tags(effects: Effects) -> Vec<String> {
+        let mut tags = effects.tags;
+        tags.sort();
+        tags
+    }
+
+    /// The tags of the rules matching after every chunk of a new stream
+    fn stream_tags(rule_set: &RuleSet, window: usize, chunks: &[&[u8]]) -> Vec<Vec<String>> {
+        let mut stream = rule_set.stream(ProxyDirection::InBound, 80, 1, window);
+        chunks
+            .iter()
+            .map(|chunk| tags(rule_set.apply_stream(&mut stream, chunk, &vec![])))
+            .collect()
+    }
+
+    fn filter_tags(rule_set: &RuleSet, data: &[u8]) -> Vec<String> {
+        tags(rule_set.apply(data, 80, 1, ProxyDirection::InBound, &vec![]))
+    }
+
+    #[test]
+    fn matches_spanning_chunks() {
+        let rules = rule_set(&[r"flag\{[a-z]+\}"]);
+        assert_eq!(
+            stream_tags(&rules, 1024, &[b"GET fl", b"ag{ab", b"c} x", b"y"]),
+            [vec![], vec![], vec![r"flag\{[a-z]+\}".to_string()], vec![r"flag\{[a-z]+\}".to_string()]],
+        );
+    }
+
+    #[test]
+    fn matches_count_while_they_end_within_the_window() {
+        let rules = rule_set(&["abc"]);
+        let abc = vec!["abc".to_string()];
+        assert_eq!(stream_tags(&rules, 8, &[b"abc", b"12345", b"678"]), [abc.clone(), abc.clone(), vec![]]);
+        // Chunks longer than the window are matched as a whole
+        assert_eq!(stream_tags(&rules, 2, &[b"abc12345", b"6"]), [abc.clone(), vec![]]);
+        // Every chunk on its own
+        assert_eq!(stream_tags(&rules, 0, &[b"ab", b"c", b"abc", b""]), [vec![], vec![], abc, vec![]]);
+    }
+
+    #[test]
+    fn matches_may_start_before_the_window() {
+        let rules = rule_set(&["abcdef"]);
+        assert_eq!(stream_tags(&rules, 4, &[b"abc", b"def"]), [vec![], vec!["abcdef".to_string()]]);
+        // Unlike when filtering the window as a context
+        assert!(filter_tags(&rules, b"cdef").is_empty());
+    }
+
+    #[test]
+    fn anchors_match_at_the_start_of_the_stream() {
+        let rules = rule_set(&["^GET"]);
+        let get = vec!["^GET".to_string()];
+        assert_eq!(stream_tags(&rules, 3, &[b"GET", b" /x", b"GET"]), [get.clone(), vec![], vec![]]);
+        // Unlike when filtering the window as a context
+        assert_eq!(filter_tags(&rules, b"GET"), get);
+        // Every chunk on its own
+        assert_eq!(stream_tags(&rules, 0, &[b"GET", b" /", b"GET"]), [get.clone(), vec![], get]);
+    }
+
+    /// Feeds random bits, which the regex `1[01]{20}2` never matches, but has to track over 2^20 states of the DFA for,
+    /// until the states of the DFA of the stream were thrown away once more
+    fn flood(rules: &RuleSet, stream: &mut RuleStream, random: &mut Random) {
+        let clears = |stream: &RuleStream| stream.scans[0].cache.as_ref().map_or(0, |c| c.clear_count());
+        let before = clears(stream);
+        while clears(stream) == before {
+            let chunk: Vec<u8> = (0..4096).map(|_| b'0' + random.below(2) as u8).collect();
+            assert!(rules.apply_stream(stream, &chunk, &vec![]).tags.is_empty());
+        }
+    }
+
+    #[test]
+    fn streams_start_over_once_their_dfa_ran_full() {
+        let rules = rule_set(&["1[01]{20}2", "needle", "^GET"]);
+        let mut random = Random(1);
+        let mut stream = rules.stream(ProxyDirection::InBound, 80, 1, 64);
+        let needle = vec!["needle".to_string()];
+        let dfa = rules.buckets[&stream.scans[0].bucket].dfa.as_ref().unwrap();
+        assert_eq!(tags(rules.apply_stream(&mut stream, b"GET ", &vec![])), ["^GET"]);
+
+        flood(&rules, &mut stream, &mut random);
+        assert!(tags(rules.apply_stream(&mut stream, b"GET nee", &vec![])).is_empty());
+        assert_eq!(tags(rules.apply_stream(&mut stream, b"dle", &vec![])), needle);
+
+        // Throw away the states of the DFA between two chunks, so the stream has to start over with its window, which
+        // is not the start of the stream
+        flood(&rules, &mut stream, &mut random);
+        let window = [&b"GET "[..], &[b'0'; 57], b"nee"].concat();
+        assert!(tags(rules.apply_stream(&mut stream, &window, &vec![])).is_empty());
+        stream.scans[0].cache.as_mut().unwrap().reset(dfa);
+        assert!(tags(rules.apply_stream(&mut stream, b"", &vec![])).is_empty());
+        assert_eq!(tags(rules.apply_stream(&mut stream, b"dle", &vec![])), needle);
+        assert!(tags(rules.apply_stream(&mut stream, &[b'0'; 64], &vec![])).is_empty());
+    }
+
+    #[test]
+    fn streams_match_like_filtering_their_data() {
+        let patterns = ["abc", "a+b", r"x[0-9]{2}", r"flag\{[a-z]+\}", r"(?-u:\xff)z", r"\bxyz"];
+        let alphabet = b"abcxyz0123456789flg{} \xff";
+        let mut random = Random(2);
+        let mut rules = Vec::new();
+        for (i, pattern) in patterns.iter().enumerate() {
+            rules.push(rule(&format!("any port {i}"), None, pattern));
+            rules.push(rule(&format!("port {i}"), Some(80), pattern));
+        }
+        let rules = RuleSet::new(rules);
+
+        for _ in 0..300 {
+            let data: Vec<u8> = (0..random.below(200)).map(|_| alphabet[random.below(alphabet.len())]).collect();
+            let window = [0, 1, 5, 16, 64, 1000][random.below(6)];
+            let mut stream = rules.stream(ProxyDirection::InBound, 80, 1, window);
+            let mut end = 0;
+            while end < data.len() {
+                let start = end;
+                end = (end + 1 + random.below(20)).min(data.len());
+                let effects = tags(rules.apply_stream(&mut stream, &data[start..end], &vec![]));
+
+                if window == 0 {
+                    assert_eq!(effects, filter_tags(&rules, &data[start..end]));
+                } else if window >= data.len() {
+                    assert_eq!(effects, filter_tags(&rules, &data[..end]));
+                } else {
+                    // At least what matches within the window or the chunk, at most what matches in the stream so far
+                    let latest = filter_tags(&rules, &data[end.saturating_sub(window).min(start)..end]);
+                    let so_far = filter_tags(&rules, &data[..end]);
+                    assert!(latest.iter().all(|t| effects.contains(t)), "{effects:?} misses {latest:?}");
+                    assert!(effects.iter().all(|t| so_far.contains(t)), "{effects:?} exceeds {so_far:?}");
+                }
+            }
+        }
+    }
+}
@@ -0,0 +1,3 @@
+#!/bin/bash
+
+docker compose kill -s SIGUSR2 yampa
@@ -98,13 +98,12 @@ class EncryptedClientStream(EncryptedStream):
 class SSLTerminationPlugin(PluginBase):
     CONNECTION_MARKER = "SSL_TERMINATED_BY_PLUGIN"
 
+    subscription = Subscription(ports=443, protocols=Protocol.TCP)
+
     async def tcp_new_connection(self, connection: ProxyConnection) -> None:
         if self.CONNECTION_MARKER in connection.extra:
             return None
 
-        if connection.metadata.dst_port != 443:
-            return None
-
         cert = os.environ["HTTPS_CERTIFICATE"]
         key = os.environ["HTTPS_KEY"]
 
@@ -0,0 +1,21 @@
+import pytest
+
+from yampa.plugins import Plugin, PluginBase, PluginManager
+from yampa.plugins.budget import HookBudgets
+
+
+@pytest.fixture
+def make_manager():
+    """Create a plugin manager with the given plugin instances loaded, bypassing the ./plugins directory."""
+
+    def make_manager(impls: list[PluginBase], budgets: HookBudgets = HookBudgets()) -> PluginManager:
+        manager = PluginManager(budgets)
+        plugins = {}
+        for i, impl in enumerate(impls):
+            plugin = Plugin(f"plugin_{i}")
+            plugin._impl = impl
+            plugins[plugin.name] = plugin
+        manager._swap(plugins)
+        return manager
+
+    return make_manager
@@ -0,0 +1,62 @@
+import asyncio
+
+from yampa.proxy.batch import Batcher
+
+
+def run_batcher(submit, size: int, delay: float) -> list[list[int]]:
+    async def main():
+        batches = []
+
+        async def handle(batch):
+            batches.append(batch)
+
+        batcher = Batcher(handle, size, delay)
+        await submit(batcher)
+        await asyncio.sleep(delay + 0.05)
+        return batches
+
+    return asyncio.run(main())
+
+
+def test_items_of_one_iteration_form_a_batch():
+    async def submit(batcher):
+        for i in range(3):
+            batcher.submit(i)
+        await asyncio.sleep(0)
+        batcher.submit(3)
+
+    assert run_batcher(submit, 64, 0) == [[0, 1, 2], [3]]
+
+
+def test_full_batches_are_handled_right_away():
+    async def submit(batcher):
+        for i in range(5):
+            batcher.submit(i)
+
+    assert run_batcher(submit, 2, 0) == [[0, 1], [2, 3], [4]]
+
+
+def test_delay_collects_items_of_several_iterations():
+    async def submit(batcher):
+        for i in range(3):
+            batcher.submit(i)
+            await asyncio.sleep(0)
+
+    assert run_batcher(submit, 64, 0.05) == [[0, 1, 2]]
+
+
+def test_failing_handlers_do_not_stop_later_batches():
+    async def main():
+        batches = []
+
+        async def handle(batch):
+            batches.append(batch)
+            raise RuntimeError("handler failed")
+
+        batcher = Batcher(handle, 1, 0)
+        batcher.submit(0)
+        batcher.submit(1)
+        await asyncio.sleep(0.01)
+        return batches
+
+    assert asyncio.run(main()) == [[0], [1]]
@@ -0,0 +1,125 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+
+from yampa import ConnectionDirection, FilterAction, Metadata, PluginBase, ProxyDirection
+from yampa.plugins.budget import HookBudgets
+
+METADATA = Metadata("10.0.0.1", 1234, "10.0.0.2", 80, (ProxyDirection.INBOUND, ConnectionDirection.TO_SERVER))
+UDP_METADATA = Metadata("10.0.0.1", 1234, "10.0.0.2", 53, ProxyDirection.INBOUND)
+
+
+class SlowFilter(PluginBase):
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.calls = 0
+
+    async def tcp_filter(self, connection, metadata, data, context):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return FilterAction.ACCEPT, b"too late"
+
+    async def udp_filter(self, metadata, data):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return FilterAction.ACCEPT, b"too late"
+
+
+class Rejecting(PluginBase):
+    async def tcp_filter(self, connection, metadata, data, context):
+        return FilterAction.REJECT, data
+
+
+async def timed(awaitable):
+    start = perf_counter()
+    result = await awaitable
+    return result, perf_counter() - start
+
+
+def test_slow_hooks_fail_open(make_manager):
+    async def main():
+        manager = make_manager([SlowFilter()], HookBudgets(0.02))
+        return await timed(manager.tcp_filter(None, METADATA, b"data", None))
+
+    result, duration = asyncio.run(main())
+    assert result is None
+    assert duration < 0.4
+
+
+def test_slow_hooks_are_skipped_for_the_next_plugin(make_manager):
+    async def main():
+        manager = make_manager([SlowFilter(), Rejecting()], HookBudgets(0.02))
+        return await manager.tcp_filter(None, METADATA, b"data", None)
+
+    assert asyncio.run(main()) == (FilterAction.REJECT, b"data")
+
+
+def test_filter_hooks_fail_closed_on_request(make_manager):
+    async def main():
+        manager = make_manager([SlowFilter()], HookBudgets(0.02, filter_timeout=FilterAction.REJECT))
+        return (await manager.tcp_filter(None, METADATA, b"data", None),
+                await manager.udp_filter_batch([(UDP_METADATA, b"a"), (UDP_METADATA, b"b")]))
+
+    tcp, udp = asyncio.run(main())
+    assert tcp == (FilterAction.REJECT, b"data")
+    assert udp == [(FilterAction.REJECT, b"a"), (FilterAction.REJECT, b"b")]
+
+
+def test_plugins_exceeding_budgets_are_bypassed_and_retried(make_manager):
+    async def main():
+        slow = SlowFilter(0.05)
+        budgets = HookBudgets(0.01, violations=2, window=10, bypass_duration=0.2,
+                              filter_timeout=FilterAction.REJECT)
+        manager = make_manager([slow], budgets)
+        for _ in range(2):
+            assert await manager.tcp_filter(None, METADATA, b"data", None) == (FilterAction.REJECT, b"data")
+        assert slow.calls == 2
+
+        # Bypassed, filter hooks included, even though they fail closed
+        result, duration = await timed(manager.tcp_filter(None, METADATA, b"data", None))
+        assert (result, slow.calls) == (None, 2)
+        assert duration < 0.01
+
+        await asyncio.sleep(0.3)
+        slow.delay = 0
+        assert await manager.tcp_filter(None, METADATA, b"data", None) == (FilterAction.ACCEPT, b"too late")
+        assert slow.calls == 3
+
+    asyncio.run(main())
+
+
+def test_shared_tasks_survive_exceeding_the_budget(make_manager):
+    class SharedTask(PluginBase):
+        def __init__(self):
+            self.task = None
+
+        def tcp_filter(self, connection, metadata, data, context):
+            if self.task is None:
+                self.task = asyncio.ensure_future(asyncio.sleep(0.1, (FilterAction.ACCEPT, data)))
+            return self.task
+
+    class AwaitingSharedTask(SharedTask):
+        async def tcp_filter(self, connection, metadata, data, context):
+            # Plugins awaiting shared tasks in a coroutine have to shield them themselves
+            return await asyncio.shield(super().tcp_filter(connection, metadata, data, context))
+
+    async def main():
+        for plugin in (SharedTask(), AwaitingSharedTask()):
+            manager = make_manager([plugin], HookBudgets(0.02))
+            assert await manager.tcp_filter(None, METADATA, b"data", None) is None
+            assert await plugin.task == (FilterAction.ACCEPT, b"data")
+
+    asyncio.run(main())
+
+
+def test_cancelling_the_caller_is_not_mistaken_for_a_timeout(make_manager):
+    async def main():
+        manager = make_manager([SlowFilter()], HookBudgets(0.2))
+        call = asyncio.create_task(manager.tcp_filter(None, METADATA, b"data", None))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+import asyncio
+import socket
+
+from yampa.proxy.channel import Channel, MessageType
+
+
+def test_messages_arrive_framed_and_in_order():
+    async def main():
+        front_socket, worker_socket = socket.socketpair()
+        front, worker = await Channel.connect(front_socket), await Channel.connect(worker_socket)
+
+        front.send(MessageType.TCP_OPEN, 1, 2, b"addresses")
+        front.send(MessageType.TCP_DATA, 2**64 - 1, 255, b"x" * 100_000)
+        front.send(MessageType.TCP_ACK, 1, 0, Channel.ACK.pack(12345))
+        front.send(MessageType.RELOAD)
+        await front.drain()
+
+        received = [await worker.receive() for _ in range(4)]
+        front.close()
+        closed = await worker.receive()
+        worker.close()
+        return received, closed
+
+    received, closed = asyncio.run(main())
+    assert received[0] == (MessageType.TCP_OPEN, 1, 2, b"addresses")
+    assert received[1] == (MessageType.TCP_DATA, 2**64 - 1, 255, b"x" * 100_000)
+    assert Channel.ACK.unpack(received[2][3]) == (12345,)
+    assert received[3] == (MessageType.RELOAD, 0, 0, b"")
+    assert closed is None
+
+
+def test_truncated_messages_count_as_closed():
+    async def main():
+        front_socket, worker_socket = socket.socketpair()
+        worker = await Channel.connect(worker_socket)
+        # Only half of the body arrives before the front goes away
+        front_socket.sendall(Channel.HEADER.pack(10, MessageType.UDP, 1, 0) + b"12345")
+        front_socket.close()
+        received = await worker.receive()
+        worker.close()
+        return received
+
+    assert asyncio.run(main()) is None
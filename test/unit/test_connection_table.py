@@ -0,0 +1,113 @@
+import asyncio
+from time import monotonic
+
+import pytest
+
+from yampa import Metadata, ProxyDirection
+from yampa.proxy.connection_table import ConnectionTable, EvictionPolicy
+from yampa.proxy.timing_wheel import TimingWheel
+
+
+class Connection:
+    """The parts of a ProxyConnection the table looks at."""
+
+    def __init__(self, port: int):
+        self.metadata = Metadata("10.0.0.1", port, "10.0.0.2", 80, ProxyDirection.INBOUND)
+        self.opened = self.last_activity = monotonic()
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+def open_connections(table: ConnectionTable, count: int) -> list[Connection]:
+    connections = []
+    for port in range(count):
+        assert table.admit()
+        connections.append(Connection(port))
+        table.add(connections[-1])
+    return connections
+
+
+def test_admitted_connections_count_before_they_are_added():
+    table = ConnectionTable(2, EvictionPolicy.IDLE, 0, 0)
+    assert table.admit()
+    assert table.admit()
+    # Both are still being opened, so there is nothing to evict
+    assert not table.admit()
+
+    table.release()
+    assert table.admit()
+    table.add(Connection(1))
+    table.add(Connection(2))
+    assert len(table) == 2
+
+
+@pytest.mark.parametrize("policy", [EvictionPolicy.IDLE, EvictionPolicy.OLDEST])
+def test_full_table_evicts(policy):
+    table = ConnectionTable(3, policy, 0, 0)
+    connections = open_connections(table, 3)
+    # Active since it was added
+    connections[0].last_activity = monotonic() + 1
+
+    assert table.admit()
+
+    evicted = [connection for connection in connections if connection.aborted]
+    assert evicted == [connections[1] if policy == EvictionPolicy.IDLE else connections[0]]
+    assert len(table) == 2
+
+
+def test_full_table_rejects():
+    table = ConnectionTable(2, EvictionPolicy.REJECT, 0, 0)
+    connections = open_connections(table, 2)
+
+    assert not table.admit()
+    assert not any(connection.aborted for connection in connections)
+
+    table.remove(connections[0])
+    assert table.admit()
+
+
+def test_without_size_connections_are_unlimited():
+    table = ConnectionTable(0, EvictionPolicy.REJECT, 0, 0)
+    connections = open_connections(table, 100)
+
+    assert len(table) == 100
+    assert not any(connection.aborted for connection in connections)
+
+
+def test_idle_connections_are_closed():
+    async def main():
+        table = ConnectionTable(0, EvictionPolicy.IDLE, 0.05, 0)
+        table._wheel = TimingWheel(table._expired, 0.01, 8)
+        table.start()
+        idle, active = open_connections(table, 2)
+        for _ in range(100):
+            active.last_activity = monotonic()
+            await asyncio.sleep(0.01)
+            if idle.aborted:
+                break
+        table.close()
+
+        assert idle.aborted
+        assert not active.aborted
+
+    asyncio.run(main())
+
+
+def test_connections_are_closed_after_their_lifetime():
+    async def main():
+        table = ConnectionTable(0, EvictionPolicy.IDLE, 0, 0.05)
+        table._wheel = TimingWheel(table._expired, 0.01, 8)
+        table.start()
+        connection, = open_connections(table, 1)
+        for _ in range(100):
+            connection.last_activity = monotonic()
+            await asyncio.sleep(0.01)
+            if connection.aborted:
+                break
+        table.close()
+
+        assert connection.aborted
+
+    asyncio.run(main())
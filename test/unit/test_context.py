@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from yampa import Context, ProxyDirection
+
+
+@pytest.mark.parametrize("capacity", [0, 1, 7, 64, 1000])
+def test_context_holds_the_latest_bytes(capacity):
+    rng = random.Random(capacity)
+    context = Context(capacity)
+    stream = b""
+    for _ in range(500):
+        data = rng.randbytes(rng.choice([0, 1, 5, capacity // 2, capacity, 2 * capacity + 3]))
+        context.append(ProxyDirection.INBOUND, data if rng.random() < 0.5 else memoryview(data))
+        stream += data
+        expected = stream[max(len(stream) - capacity, 0):] if capacity else b""
+
+        assert bytes(context.view(ProxyDirection.INBOUND)) == expected
+        assert context[ProxyDirection.INBOUND] == expected
+        assert context[ProxyDirection.OUTBOUND] == b""
+
+
+def test_views_stay_intact_after_new_traffic():
+    context = Context(100)
+    context.append(ProxyDirection.INBOUND, b"a" * 10)
+    view = context.view(ProxyDirection.INBOUND)
+    context.append(ProxyDirection.INBOUND, b"b" * 95)
+    assert bytes(view) == b"a" * 10
+    assert context[ProxyDirection.INBOUND] == b"a" * 5 + b"b" * 95
+
+
+def test_context_holds_both_directions():
+    context = Context(4)
+    context.append(ProxyDirection.INBOUND, b"request")
+    context.append(ProxyDirection.OUTBOUND, b"response")
+
+    assert context.capacity == 4
+    assert dict(context) == {ProxyDirection.INBOUND: b"uest", ProxyDirection.OUTBOUND: b"onse"}
+    assert bytes(context.view(ProxyDirection.INBOUND)) == b"uest"
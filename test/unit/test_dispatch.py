@@ -0,0 +1,135 @@
+import asyncio
+
+from yampa import ConnectionDirection, FilterAction, Metadata, PluginBase, ProxyDirection
+
+METADATA = Metadata("10.0.0.1", 1234, "10.0.0.2", 80, (ProxyDirection.INBOUND, ConnectionDirection.TO_SERVER))
+
+
+class Connection:
+    def __init__(self):
+        self.metadata = Metadata("10.0.0.1", 1234, "10.0.0.2", 80, ProxyDirection.INBOUND)
+
+
+class Recording(PluginBase):
+    """Records its hook calls in `calls`, shared by all instances, and returns `result` from its filter hook."""
+
+    def __init__(self, name: str, calls: list, result=None):
+        self.name = name
+        self.calls = calls
+        self.result = result
+
+    async def tcp_new_connection(self, connection):
+        self.calls.append(self.name)
+        await asyncio.sleep(0)
+
+    async def tcp_filter(self, connection, metadata, data, context):
+        self.calls.append(self.name)
+        return self.result
+
+
+def test_results_are_taken_from_the_first_plugin_returning_one(make_manager):
+    calls = []
+    manager = make_manager([Recording("first", calls), Recording("second", calls, (FilterAction.ACCEPT, b"second")),
+                            Recording("third", calls, (FilterAction.REJECT, b"third"))])
+
+    result = asyncio.run(manager.tcp_filter(Connection(), METADATA, b"data", None))
+    assert result == (FilterAction.ACCEPT, b"second")
+    # Plugins after the first result are not called
+    assert calls == ["first", "second"]
+
+
+def test_the_default_is_returned_if_no_plugin_returns_a_result(make_manager):
+    calls = []
+    manager = make_manager([Recording("first", calls), Recording("second", calls)])
+
+    assert asyncio.run(manager.tcp_filter(Connection(), METADATA, b"data", None)) is None
+    assert calls == ["first", "second"]
+
+
+def test_hooks_returning_none_are_called_for_all_plugins_in_order(make_manager):
+    calls = []
+    manager = make_manager([Recording(str(i), calls) for i in range(5)])
+
+    assert asyncio.run(manager.tcp_new_connection(Connection())) is None
+    assert calls == [str(i) for i in range(5)]
+
+
+def test_dispatch_tables_follow_the_plugin_set(make_manager):
+    calls = []
+    manager = make_manager([Recording("first", calls, (FilterAction.ACCEPT, b"first")), Recording("second", calls)])
+    generation = manager.generation
+    table = manager._hooks["tcp_filter"]
+    assert [implementation.plugin.name for implementation in table.implementations] == ["plugin_0", "plugin_1"]
+    assert not table.gather and manager._hooks["tcp_new_connection"].gather
+    # Hooks no plugin defines have empty tables
+    assert manager._hooks["udp_filter"].implementations == ()
+
+    manager.unload_plugin("plugin_0")
+    assert manager.generation != generation
+    assert [implementation.plugin.name for implementation in manager._hooks["tcp_filter"].implementations] == [
+        "plugin_1"]
+    assert asyncio.run(manager.tcp_filter(Connection(), METADATA, b"data", None)) is None
+    assert calls == ["second"]
+
+
+class Synchronous(PluginBase):
+    def __init__(self, calls: list, result=None):
+        self.calls = calls
+        self.result = result
+
+    def tcp_new_connection(self, connection):
+        self.calls.append("sync")
+
+    def tcp_filter(self, connection, metadata, data, context):
+        self.calls.append("sync")
+        return self.result
+
+    def udp_filter(self, metadata, data):
+        return (FilterAction.REJECT, data) if data == b"bad" else None
+
+
+class Decorated(PluginBase):
+    """Defines a synchronous hook returning a coroutine, like a coroutine function hidden behind a decorator."""
+
+    def tcp_filter(self, connection, metadata, data, context):
+        async def filter():
+            await asyncio.sleep(0)
+            return FilterAction.REJECT, data
+        return filter()
+
+
+def test_synchronous_hooks_are_called_inline(make_manager):
+    calls = []
+    manager = make_manager([Synchronous(calls), Recording("async", calls), Synchronous(calls)])
+    assert [implementation.is_async for implementation in manager._hooks["tcp_filter"].implementations] == [
+        False, True, False]
+
+    async def main():
+        assert await manager.tcp_new_connection(Connection()) is None
+        assert await manager.tcp_filter(Connection(), METADATA, b"data", None) is None
+
+    asyncio.run(main())
+    # Synchronous hooks returning None are called before the coroutines are awaited
+    assert calls == ["sync", "sync", "async", "sync", "async", "sync"]
+
+
+def test_results_of_synchronous_hooks_are_taken_as_they_are(make_manager):
+    calls = []
+    manager = make_manager([Synchronous(calls, (FilterAction.ACCEPT, b"sync")), Recording("async", calls)])
+
+    assert asyncio.run(manager.tcp_filter(Connection(), METADATA, b"data", None)) == (FilterAction.ACCEPT, b"sync")
+    assert calls == ["sync"]
+
+
+def test_awaitables_returned_by_synchronous_hooks_are_awaited(make_manager):
+    manager = make_manager([Decorated()])
+
+    assert asyncio.run(manager.tcp_filter(Connection(), METADATA, b"data", None)) == (FilterAction.REJECT, b"data")
+
+
+def test_synchronous_hooks_are_batched(make_manager):
+    manager = make_manager([Synchronous([])])
+    metadata = Metadata("10.0.0.1", 1234, "10.0.0.2", 53, ProxyDirection.INBOUND)
+
+    results = asyncio.run(manager.udp_filter_batch([(metadata, b"good"), (metadata, b"bad")]))
+    assert results == [None, (FilterAction.REJECT, b"bad")]
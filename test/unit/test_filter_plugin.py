@@ -0,0 +1,69 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from yampa import FilterAction, Metadata, ProxyDirection
+from yampa.proxy.udp_flow import UdpFlow
+
+# Built with maturin from ./filter_engine, whose sources are found as a namespace package otherwise
+if not hasattr(pytest.importorskip("filter_engine"), "create_filterengine_from_ruleset"):
+    pytest.skip("filter_engine is not built", allow_module_level=True)
+
+RULES = 'DROP("evil") : IN(53) : "evil";'
+CLIENT = ("10.0.0.1", 1234)
+SERVER = ("10.0.0.2", 53)
+METADATA = Metadata(*CLIENT, *SERVER, ProxyDirection.INBOUND)
+
+
+@pytest.fixture
+def filter_plugin(tmp_path, monkeypatch):
+    # The plugin logs alerts to ./rules/eve.json
+    (tmp_path / "rules").mkdir()
+    monkeypatch.chdir(tmp_path)
+    path = Path(__file__).parents[2] / "plugins" / "filter_plugin.py"
+    spec = importlib.util.spec_from_file_location("filter_plugin", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_udp_packets_are_filtered_without_context(filter_plugin):
+    async def main():
+        plugin = filter_plugin.FilterEnginePlugin(RULES)
+        flow = UdpFlow(CLIENT, SERVER, ProxyDirection.INBOUND, 0)
+        await plugin.udp_flow_new(flow)
+
+        assert await plugin.udp_filter(METADATA, b"evil", flow) == (FilterAction.REJECT, b"evil")
+        assert await plugin.udp_filter(METADATA, b"fine", flow) is None
+        await plugin.udp_flow_expired(flow)
+
+    asyncio.run(main())
+
+
+def test_udp_packets_are_filtered_without_flow(filter_plugin):
+    async def main():
+        plugin = filter_plugin.FilterEnginePlugin(RULES)
+
+        assert await plugin.udp_filter(METADATA, b"evil") == (FilterAction.REJECT, b"evil")
+        assert await plugin.udp_filter_batch([(METADATA, b"evil"), (METADATA, b"fine")]) == [
+            (FilterAction.REJECT, b"evil"), None]
+
+    asyncio.run(main())
+
+
+def test_udp_packets_are_filtered_with_the_context_of_their_flow(filter_plugin):
+    async def main():
+        plugin = filter_plugin.FilterEnginePlugin(RULES)
+        flow = UdpFlow(CLIENT, SERVER, ProxyDirection.INBOUND, 16)
+        await plugin.udp_flow_new(flow)
+
+        # The proxy adds every packet to the context of its flow before filtering it
+        flow.context.append(ProxyDirection.INBOUND, b"ev")
+        assert await plugin.udp_filter(METADATA, b"ev", flow) is None
+        flow.context.append(ProxyDirection.INBOUND, b"il")
+        assert await plugin.udp_filter_batch([(METADATA, b"il")], [flow]) == [(FilterAction.REJECT, b"il")]
+        await plugin.udp_flow_expired(flow)
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import asyncio
+
+from yampa.proxy.log_queue import LogQueue, OverflowPolicy
+
+
+def test_events_of_a_key_are_logged_in_order():
+    async def main():
+        queue = LogQueue(8, OverflowPolicy.BLOCK, 2)
+        queue.start()
+        logged = []
+
+        async def tcp_log(key, i):
+            await asyncio.sleep(0)
+            logged.append((key, i))
+
+        for i in range(20):
+            for key in "abc":
+                await queue.submit(key, tcp_log, key, i)
+        await asyncio.gather(*[queue.barrier(key) for key in "abc"])
+        queue.close()
+
+        assert len(logged) == 60
+        for key in "abc":
+            assert [i for k, i in logged if k == key] == list(range(20))
+
+    asyncio.run(main())
+
+
+def test_drop_newest_keeps_queued_events():
+    async def main():
+        queue = LogQueue(2, OverflowPolicy.DROP_NEWEST, 1)
+        logged = []
+
+        async def tcp_log(i):
+            logged.append(i)
+
+        # Not started, so nothing is taken from the queue meanwhile
+        for i in range(4):
+            await queue.submit("a", tcp_log, i)
+        queue.start()
+        await queue.barrier("a")
+        queue.close()
+
+        assert logged == [0, 1]
+
+    asyncio.run(main())
+
+
+def test_drop_oldest_keeps_latest_events():
+    async def main():
+        queue = LogQueue(2, OverflowPolicy.DROP_OLDEST, 1)
+        logged = []
+
+        async def tcp_log(i):
+            logged.append(i)
+
+        for i in range(4):
+            await queue.submit("a", tcp_log, i)
+        queue.start()
+        await queue.barrier("a")
+        queue.close()
+
+        assert logged == [2, 3]
+
+    asyncio.run(main())
+
+
+def test_drop_oldest_releases_barriers_only_after_the_event_in_flight():
+    async def main():
+        queue = LogQueue(1, OverflowPolicy.DROP_OLDEST, 1)
+        queue.start()
+        proceed = asyncio.Event()
+        logged = []
+
+        async def tcp_log(i):
+            await proceed.wait()
+            logged.append(i)
+
+        await queue.submit("a", tcp_log, 0)
+        await asyncio.sleep(0)
+        barrier = asyncio.create_task(queue.barrier("a"))
+        await asyncio.sleep(0)
+        # Drops the barrier from the full queue while the worker is still logging the first event
+        await queue.submit("a", tcp_log, 1)
+        await asyncio.sleep(0.01)
+        assert not barrier.done()
+
+        proceed.set()
+        await asyncio.wait_for(barrier, 1)
+        assert logged[0] == 0
+        queue.close()
+
+    asyncio.run(main())
+
+
+def test_without_size_events_are_logged_inline():
+    async def main():
+        queue = LogQueue(0, OverflowPolicy.BLOCK, 4)
+        logged = []
+
+        async def tcp_log(i):
+            logged.append(i)
+
+        await queue.submit("a", tcp_log, 0)
+        assert logged == [0]
+        await queue.barrier("a")
+
+    asyncio.run(main())
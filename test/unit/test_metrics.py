@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from yampa.metrics.registry import Counter, Gauge, Histogram, Metric, Registry
+from yampa.metrics.server import start_metrics_server
+
+
+def test_counters_and_gauges_render_their_children():
+    registry = Registry()
+    counter = registry.register(Counter("requests_total", "Requests", ["method"]))
+    gauge = registry.register(Gauge("open", "Open connections"))
+    counter.labels("GET").inc()
+    counter.labels("GET").inc(2)
+    counter.labels('say "hi"\n').inc(0.5)
+    gauge.labels().inc(3)
+    gauge.labels().dec()
+
+    assert registry.render() == (
+        "# HELP requests_total Requests\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{method="GET"} 3\n'
+        'requests_total{method="say \\"hi\\"\\n"} 0.5\n'
+        "# HELP open Open connections\n"
+        "# TYPE open gauge\n"
+        "open 2\n"
+    )
+
+
+def test_histograms_render_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ["hook"], buckets=[0.1, 0.01])
+    child = histogram.labels("tcp_filter")
+    for value in (0.005, 0.01, 0.05, 2):
+        child.observe(value)
+
+    assert histogram.render().splitlines()[2:] == [
+        'latency_seconds_bucket{hook="tcp_filter",le="0.01"} 2',
+        'latency_seconds_bucket{hook="tcp_filter",le="0.1"} 3',
+        'latency_seconds_bucket{hook="tcp_filter",le="+Inf"} 4',
+        'latency_seconds_sum{hook="tcp_filter"} 2.065',
+        'latency_seconds_count{hook="tcp_filter"} 4',
+    ]
+
+
+def test_labels_have_to_match_the_label_names():
+    counter = Counter("requests_total", "Requests", ["method"])
+    with pytest.raises(ValueError):
+        counter.labels()
+    assert counter.labels("GET") is counter.labels("GET")
+
+
+def test_metrics_have_to_define_their_children():
+    class Untyped(Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Untyped("untyped", "Untyped")
+
+
+def test_metrics_are_registered_once():
+    registry = Registry()
+    registry.register(Counter("requests_total", "Requests"))
+    with pytest.raises(ValueError):
+        registry.register(Gauge("requests_total", "Requests"))
+
+
+def test_server_serves_the_registry():
+    async def get(port: int, path: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def main():
+        registry = Registry()
+        registry.register(Counter("requests_total", "Requests")).labels().inc()
+        server = await start_metrics_server("127.0.0.1:0", registry)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await get(port, "/metrics"), await get(port, "/other")
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    metrics, other = asyncio.run(main())
+    assert metrics.startswith(b"HTTP/1.0 200 OK\r\n")
+    assert metrics.endswith(b"\r\n\r\n# HELP requests_total Requests\n# TYPE requests_total counter\nrequests_total 1\n")
+    assert other.startswith(b"HTTP/1.0 404 Not Found\r\n")
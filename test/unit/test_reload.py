@@ -0,0 +1,173 @@
+import asyncio
+import sys
+import textwrap
+
+import pytest
+
+from yampa import Metadata, ProxyDirection
+from yampa.plugins import PluginManager
+
+PLUGIN = """
+from yampa import *
+
+VERSION = {version}
+
+
+class CountingPlugin(PluginBase):
+    def __init__(self):
+        self.version = VERSION
+        self.connections = []
+
+    async def tcp_new_connection(self, connection):
+        self.connections.append(connection)
+
+    async def tcp_connection_closed(self, connection):
+        self.connections.remove(connection)
+
+
+def constructor():
+    return CountingPlugin()
+"""
+
+PACKAGE = """
+from yampa import *
+
+from .version import VERSION
+
+
+class PackagePlugin(PluginBase):
+    def __init__(self):
+        self.version = VERSION
+
+
+def constructor():
+    return PackagePlugin()
+"""
+
+
+class Connection:
+    def __init__(self):
+        self.metadata = Metadata("10.0.0.1", 1234, "10.0.0.2", 80, ProxyDirection.INBOUND)
+
+
+@pytest.fixture
+def plugins(tmp_path, monkeypatch):
+    """A ./plugins directory to load plugins from, returned for writing plugins into it."""
+    directory = tmp_path / "plugins"
+    directory.mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # Import the plugins from here, not from any plugins package imported before
+    for name in [x for x in sys.modules if x == "plugins" or x.startswith("plugins.")]:
+        monkeypatch.delitem(sys.modules, name)
+    yield directory
+    for name in [x for x in sys.modules if x == "plugins" or x.startswith("plugins.")]:
+        del sys.modules[name]
+
+
+def implementation(manager: PluginManager, name: str):
+    return manager._plugins[name]._impl
+
+
+def test_unchanged_plugins_are_kept(plugins):
+    (plugins / "counting.py").write_text(textwrap.dedent(PLUGIN.format(version=1)))
+    (plugins / "other.py").write_text(textwrap.dedent(PLUGIN.format(version=1)))
+
+    async def main():
+        manager = PluginManager()
+        assert await manager.reload()
+        counting, other = implementation(manager, "counting"), implementation(manager, "other")
+
+        assert await manager.reload()
+        assert implementation(manager, "counting") is counting
+        assert implementation(manager, "other") is other
+
+        # Content is compared, rewriting the same code keeps the plugin as well
+        (plugins / "other.py").write_text(textwrap.dedent(PLUGIN.format(version=1)))
+        (plugins / "counting.py").write_text(textwrap.dedent(PLUGIN.format(version=22)))
+        assert await manager.reload()
+        assert implementation(manager, "other") is other
+        assert implementation(manager, "counting") is not counting
+        assert implementation(manager, "counting").version == 22
+
+        (plugins / "other.py").unlink()
+        assert await manager.reload()
+        assert list(manager._plugins) == ["counting"]
+
+    asyncio.run(main())
+
+
+def test_editing_a_submodule_of_a_package_reloads_it(plugins):
+    package = plugins / "package"
+    package.mkdir()
+    (package / "__init__.py").write_text(textwrap.dedent(PACKAGE))
+    (package / "version.py").write_text("VERSION = 1\n")
+
+    async def main():
+        manager = PluginManager()
+        assert await manager.reload()
+        loaded = implementation(manager, "package")
+        assert loaded.version == 1
+
+        assert await manager.reload()
+        assert implementation(manager, "package") is loaded
+
+        (package / "version.py").write_text("VERSION = 22\n")
+        assert await manager.reload()
+        assert implementation(manager, "package") is not loaded
+        assert implementation(manager, "package").version == 22
+
+    asyncio.run(main())
+
+
+def test_open_connections_are_replayed_into_reloaded_plugins(plugins):
+    (plugins / "counting.py").write_text(textwrap.dedent(PLUGIN.format(version=1)))
+
+    async def main():
+        manager = PluginManager()
+        manager.REPLAY_CONCURRENCY = 4
+        assert await manager.reload()
+        connections = [Connection() for _ in range(10)]
+        for connection in connections:
+            await manager.tcp_new_connection(connection)
+        await manager.tcp_connection_closed(connections.pop())
+        old = implementation(manager, "counting")
+        assert old.connections == connections
+
+        (plugins / "counting.py").write_text(textwrap.dedent(PLUGIN.format(version=22)))
+        assert await manager.reload()
+        new = implementation(manager, "counting")
+        assert new is not old and new.version == 22
+        assert sorted(map(id, new.connections)) == sorted(map(id, connections))
+
+        # Closing connections reaches the new plugin only
+        await manager.tcp_connection_closed(connections[0])
+        assert len(new.connections) == 8
+        assert len(old.connections) == 9
+
+    asyncio.run(main())
+
+
+def test_connections_opening_during_the_replay_reach_the_new_plugins(plugins):
+    (plugins / "counting.py").write_text(textwrap.dedent(PLUGIN.format(version=1)))
+
+    async def main():
+        manager = PluginManager()
+        assert await manager.reload()
+        for _ in range(100):
+            await manager.tcp_new_connection(Connection())
+
+        (plugins / "counting.py").write_text(textwrap.dedent(PLUGIN.format(version=22)))
+        reload = asyncio.create_task(manager.reload())
+        # Opens while the replay yields to the event loop, so it is handled by the old plugin set
+        await asyncio.sleep(0)
+        late = Connection()
+        await manager.tcp_new_connection(late)
+        assert await reload
+
+        new = implementation(manager, "counting")
+        assert new.version == 22
+        assert len(new.connections) == 101
+        assert late in new.connections
+
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import asyncio
+
+from yampa import Protocol
+from yampa.proxy.scheduler import PacketScheduler, packet_addresses
+
+
+def test_packets_of_a_flow_are_handled_in_order_by_one_coroutine():
+    async def main():
+        scheduler = PacketScheduler(0, 0)
+        handled = []
+        active = 0
+        peak = 0
+
+        async def handle(flow, i):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.001)
+            handled.append((flow, i))
+            active -= 1
+
+        async def submit(flow, i):
+            assert scheduler.admit(Protocol.UDP, "source")
+            await scheduler.run(flow, "source", handle, flow, i)
+
+        await asyncio.gather(*[submit(flow, i) for i in range(10) for flow in "ab"])
+
+        assert len(scheduler) == 0
+        for flow in "ab":
+            assert [i for f, i in handled if f == flow] == list(range(10))
+        # One packet of each flow at a time
+        assert peak == 2
+
+    asyncio.run(main())
+
+
+def test_limits_drop_packets():
+    scheduler = PacketScheduler(3, 2)
+    assert scheduler.admit(Protocol.UDP, "flood")
+    assert scheduler.admit(Protocol.UDP, "flood")
+    assert not scheduler.admit(Protocol.UDP, "flood")
+    assert scheduler.admit(Protocol.OTHER, "other")
+    assert not scheduler.admit(Protocol.OTHER, "another")
+    assert len(scheduler) == 3
+
+
+def test_barrier_waits_for_queued_packets():
+    async def main():
+        scheduler = PacketScheduler(0, 0)
+        proceed = asyncio.Event()
+        handled = []
+
+        async def handle(i):
+            await proceed.wait()
+            handled.append(i)
+
+        for i in range(3):
+            assert scheduler.admit(Protocol.UDP, "source")
+        first = asyncio.create_task(scheduler.run("flow", "source", handle, 0))
+        await asyncio.sleep(0)
+        await scheduler.run("flow", "source", handle, 1)
+        barrier = asyncio.create_task(scheduler.barrier("flow"))
+        await scheduler.run("flow", "source", handle, 2)
+        await asyncio.sleep(0)
+        assert not barrier.done()
+
+        proceed.set()
+        await barrier
+        assert handled[:2] == [0, 1]
+        await first
+        assert handled == [0, 1, 2]
+        # Flows without packets in progress have nothing to wait for
+        await scheduler.barrier("flow")
+
+    asyncio.run(main())
+
+
+def test_cancelled_flows_give_back_their_room():
+    async def main():
+        scheduler = PacketScheduler(2, 0)
+
+        async def handle():
+            await asyncio.sleep(10)
+
+        for _ in range(2):
+            assert scheduler.admit(Protocol.UDP, "source")
+        task = asyncio.create_task(scheduler.run("flow", "source", handle))
+        await asyncio.sleep(0)
+        await scheduler.run("flow", "source", handle)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        assert len(scheduler) == 0
+        assert scheduler.admit(Protocol.UDP, "source")
+
+    asyncio.run(main())
+
+
+def test_packet_addresses():
+    ipv4 = bytes(12) + bytes([10, 0, 0, 1]) + bytes([10, 0, 0, 2])
+    assert packet_addresses(ipv4) == (bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2]))
+
+    ipv6 = bytes([0x60]) + bytes(7) + bytes(range(16)) + bytes(range(16, 32))
+    assert packet_addresses(ipv6) == (bytes(range(16)), bytes(range(16, 32)))
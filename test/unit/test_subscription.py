@@ -0,0 +1,107 @@
+import asyncio
+
+from yampa import ConnectionDirection, Metadata, PluginBase, Protocol, ProxyDirection
+from yampa.plugins import Subscription
+
+
+class Connection:
+    def __init__(self, port: int):
+        self.metadata = Metadata("10.0.0.1", 40000, "10.0.0.2", port, ProxyDirection.INBOUND)
+
+
+def tcp_metadata(port: int, direction: ProxyDirection = ProxyDirection.INBOUND) -> Metadata:
+    return Metadata("10.0.0.1", 40000, "10.0.0.2", port, (direction, ConnectionDirection.TO_SERVER))
+
+
+def udp_metadata(src_port: int, dst_port: int) -> Metadata:
+    return Metadata("10.0.0.1", src_port, "10.0.0.2", dst_port, ProxyDirection.INBOUND)
+
+
+class Recording(PluginBase):
+    """Records the ports of every packet its hooks are called for."""
+
+    def __init__(self):
+        self.seen = []
+
+    def tcp_filter(self, connection, metadata, data, context):
+        self.seen.append(("tcp", connection.metadata.dst_port))
+
+    def udp_filter(self, metadata, data):
+        self.seen.append(("udp", metadata.dst_port))
+
+    def other_filter(self, direction, data):
+        self.seen.append(("other", None))
+
+
+def subscribed(subscription: Subscription | None) -> Recording:
+    # Subscriptions are declared as class attributes, and only hooks in the class dict of a plugin are called
+    hooks = {name: vars(Recording)[name] for name in ("tcp_filter", "udp_filter", "other_filter")}
+    return type("Subscribed", (Recording,), {"subscription": subscription, **hooks})()
+
+
+def send(manager, tcp_ports=(), udp_ports=(), other=0):
+    async def main():
+        for port in tcp_ports:
+            await manager.tcp_filter(Connection(port), tcp_metadata(port), b"data", None)
+        for src_port, dst_port in udp_ports:
+            await manager.udp_filter(udp_metadata(src_port, dst_port), b"data")
+        for _ in range(other):
+            await manager.other_filter(ProxyDirection.INBOUND, b"data")
+
+    asyncio.run(main())
+
+
+def test_plugins_are_only_called_for_their_ports(make_manager):
+    web, dns, everything = (subscribed(Subscription(ports=80)), subscribed(Subscription(ports=[53, 5353])),
+                            subscribed(None))
+    manager = make_manager([web, dns, everything])
+
+    send(manager, tcp_ports=(80, 443), udp_ports=((40000, 53), (53, 40000), (40000, 5353), (40000, 80)), other=1)
+    assert web.seen == [("tcp", 80), ("udp", 80)]
+    # Udp packets match on either port
+    assert dns.seen == [("udp", 53), ("udp", 40000), ("udp", 5353)]
+    assert len(everything.seen) == 7
+
+
+def test_plugins_are_only_called_for_their_protocols(make_manager):
+    tcp, not_tcp = (subscribed(Subscription(protocols=Protocol.TCP)),
+                    subscribed(Subscription(protocols=[Protocol.UDP, Protocol.OTHER])))
+    manager = make_manager([tcp, not_tcp])
+
+    send(manager, tcp_ports=(80,), udp_ports=((40000, 53),), other=1)
+    assert tcp.seen == [("tcp", 80)]
+    assert not_tcp.seen == [("udp", 53), ("other", None)]
+
+
+def test_ports_and_protocols_have_to_match_both(make_manager):
+    plugin = subscribed(Subscription(ports=53, protocols=Protocol.UDP))
+    manager = make_manager([plugin])
+
+    send(manager, tcp_ports=(53,), udp_ports=((40000, 53), (40000, 80)), other=1)
+    assert plugin.seen == [("udp", 53)]
+
+
+def test_tcp_connections_match_by_the_port_they_were_opened_to(make_manager):
+    plugin = subscribed(Subscription(ports=80, proxy_directions=ProxyDirection.INBOUND))
+    manager = make_manager([plugin])
+    connection = Connection(80)
+
+    async def main():
+        # The response travels from port 80 to the client, but belongs to the same connection
+        await manager.tcp_filter(connection, tcp_metadata(80), b"request", None)
+        await manager.tcp_filter(connection, tcp_metadata(80, ProxyDirection.OUTBOUND), b"response", None)
+
+    asyncio.run(main())
+    assert plugin.seen == [("tcp", 80)]
+    assert manager.inspects(connection, tcp_metadata(80))
+    assert not manager.inspects(connection, tcp_metadata(80, ProxyDirection.OUTBOUND))
+    assert not manager.inspects(Connection(443), tcp_metadata(443))
+
+
+def test_batches_only_pass_on_subscribed_packets(make_manager):
+    plugin = subscribed(Subscription(ports=53))
+    manager = make_manager([plugin])
+
+    packets = [(udp_metadata(40000, 53), b"a"), (udp_metadata(40000, 80), b"b"), (udp_metadata(53, 40000), b"c")]
+    assert asyncio.run(manager.udp_filter_batch(packets)) == [None, None, None]
+    assert plugin.seen == [("udp", 53), ("udp", 40000)]
@@ -0,0 +1,84 @@
+import asyncio
+from time import monotonic
+
+from yampa.proxy.timing_wheel import TimingWheel
+
+
+def run_wheel(schedule, duration: float, resolution: float = 0.01, slots: int = 64) -> dict[str, float]:
+    """Run a wheel for `duration` seconds after `schedule(wheel, start)` scheduled keys on it.
+
+    :returns: When every expired key expired, relative to the start.
+    """
+    async def main():
+        expired = {}
+        start = monotonic()
+        wheel = TimingWheel(lambda key: expired.setdefault(key, monotonic() - start), resolution, slots)
+        wheel.start()
+        schedule(wheel, start)
+        await asyncio.sleep(duration)
+        wheel.close()
+        return expired
+
+    return asyncio.run(main())
+
+
+def test_keys_expire_once_their_deadline_passed():
+    def schedule(wheel, start):
+        wheel.schedule("early", start + 0.02)
+        wheel.schedule("late", start + 0.105)
+        wheel.schedule("never", start + 10)
+
+    expired = run_wheel(schedule, 0.3)
+
+    assert expired.keys() == {"early", "late"}
+    assert 0.02 <= expired["early"] < expired["late"]
+    # At most a tick late, instead of waiting for another turn of the wheel
+    assert 0.105 <= expired["late"] < 0.105 + 0.1
+
+
+def test_deadlines_beyond_a_turn_wait_for_a_later_turn():
+    # A turn of the wheel is 0.08 seconds
+    expired = run_wheel(lambda wheel, start: wheel.schedule("key", start + 0.15), 0.3, slots=8)
+
+    assert 0.15 <= expired["key"]
+
+
+def test_past_deadlines_expire_on_the_next_tick():
+    expired = run_wheel(lambda wheel, start: wheel.schedule("key", start - 1), 0.1)
+
+    assert expired.keys() == {"key"}
+
+
+def test_rescheduling_and_cancelling():
+    def schedule(wheel, start):
+        wheel.schedule("moved", start + 0.02)
+        wheel.schedule("moved", start + 0.06)
+        wheel.schedule("cancelled", start + 0.02)
+        wheel.cancel("cancelled")
+        assert len(wheel) == 1
+        assert "moved" in wheel and "cancelled" not in wheel
+
+    expired = run_wheel(schedule, 0.2)
+
+    assert expired.keys() == {"moved"}
+    assert expired["moved"] >= 0.06
+
+
+def test_callbacks_may_reschedule_keys():
+    async def main():
+        expiries = []
+        wheel = TimingWheel(lambda key: None, 0.01, 8)
+
+        def expired(key):
+            expiries.append(key)
+            if len(expiries) < 3:
+                wheel.schedule(key, monotonic() + 0.02)
+
+        wheel._callback = expired
+        wheel.start()
+        wheel.schedule("key", monotonic())
+        await asyncio.sleep(0.3)
+        wheel.close()
+        return expiries
+
+    assert asyncio.run(main()) == ["key"] * 3
@@ -0,0 +1,71 @@
+import asyncio
+
+from yampa import ProxyDirection
+from yampa.proxy.timing_wheel import TimingWheel
+from yampa.proxy.udp_flow import UdpFlowTable
+
+CLIENT = ("10.0.0.1", 1234)
+SERVER = ("10.0.0.2", 53)
+
+
+def test_both_directions_find_the_same_flow():
+    table = UdpFlowTable(0, 0, 16, lambda flow: None)
+    assert table.get(ProxyDirection.INBOUND, CLIENT, SERVER) is None
+
+    flow, metadata = table.add(ProxyDirection.INBOUND, CLIENT, SERVER)
+    assert metadata is flow.metadata
+    assert (metadata.src_ip, metadata.src_port, metadata.dst_port) == ("10.0.0.1", 1234, 53)
+
+    assert table.get(ProxyDirection.INBOUND, CLIENT, SERVER) == (flow, metadata)
+    returning, reply = table.get(ProxyDirection.OUTBOUND, SERVER, CLIENT)
+    assert returning is flow
+    assert (reply.src_port, reply.dst_port, reply.direction) == (53, 1234, ProxyDirection.OUTBOUND)
+    assert flow.metadata_of(ProxyDirection.INBOUND) is metadata
+    assert flow.metadata_of(ProxyDirection.OUTBOUND) is reply
+    # The same addresses going the other way through the proxy are another flow
+    assert table.get(ProxyDirection.OUTBOUND, CLIENT, SERVER) is None
+
+
+def test_full_table_evicts_the_idlest_flow():
+    expired = []
+    table = UdpFlowTable(2, 0, 16, expired.append)
+    first, _ = table.add(ProxyDirection.INBOUND, ("10.0.0.1", 1), SERVER)
+    second, _ = table.add(ProxyDirection.INBOUND, ("10.0.0.1", 2), SERVER)
+    table.get(ProxyDirection.INBOUND, ("10.0.0.1", 1), SERVER)
+
+    third, _ = table.add(ProxyDirection.INBOUND, ("10.0.0.1", 3), SERVER)
+
+    assert expired == [second]
+    assert list(table) == [first, third]
+    assert table.get(ProxyDirection.OUTBOUND, SERVER, ("10.0.0.1", 2)) is None
+
+
+def test_idle_flows_expire():
+    async def main():
+        expired = []
+        table = UdpFlowTable(0, 0.05, 16, expired.append)
+        table._wheel = TimingWheel(table._expired, 0.01, 8)
+        table.start()
+        idle, _ = table.add(ProxyDirection.INBOUND, ("10.0.0.1", 1), SERVER)
+        active, _ = table.add(ProxyDirection.INBOUND, ("10.0.0.1", 2), SERVER)
+        for _ in range(100):
+            table.get(ProxyDirection.OUTBOUND, SERVER, ("10.0.0.1", 2))
+            await asyncio.sleep(0.01)
+            if expired:
+                break
+        table.close()
+
+        assert expired == [idle]
+        assert list(table) == [active]
+
+    asyncio.run(main())
+
+
+def test_flow_context_holds_both_directions():
+    table = UdpFlowTable(0, 0, 4, lambda flow: None)
+    flow, _ = table.add(ProxyDirection.INBOUND, CLIENT, SERVER)
+    flow.context.append(ProxyDirection.INBOUND, b"query")
+    flow.context.append(ProxyDirection.OUTBOUND, b"answer")
+
+    assert bytes(flow.context.view(ProxyDirection.INBOUND)) == b"uery"
+    assert bytes(flow.context.view(ProxyDirection.OUTBOUND)) == b"swer"
@@ -0,0 +1,228 @@
+import asyncio
+import textwrap
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from yampa import Context, Metadata, ProxyDirection
+from yampa.plugins import worker
+from yampa.plugins.worker import WorkerPlugin
+
+PLUGIN = """
+import time
+
+from yampa import *
+
+
+class SlowPlugin(PluginBase):
+    def tcp_filter(self, connection, metadata, data, context):
+        if data.startswith(b"slow"):
+            time.sleep(0.5)
+        connection.extra["seen"] = connection.extra.get("seen", 0) + 1
+        connection.extra.pop("gone", None)
+        if data == b"release":
+            connection.release()
+        return None
+
+    def udp_filter(self, metadata, data, flow=None):
+        if data == b"slow":
+            time.sleep(0.5)
+        if flow is not None:
+            flow.extra["datagrams"] = flow.extra.get("datagrams", 0) + 1
+            flow.extra["context"] = bytes(flow.context[metadata.direction])
+        return None
+
+    def udp_filter_batch(self, packets, flows=None):
+        return [self.udp_filter(*packet, flow) for packet, flow in zip(packets, flows)]
+
+
+def constructor():
+    return SlowPlugin()
+"""
+
+WRAPPING_PLUGIN = """
+from yampa import *
+
+
+class UpperStream(WrapperStream):
+    pass
+
+
+class WrappingPlugin(PluginBase):
+    async def tcp_new_connection(self, connection):
+        connection.wrap(UpperStream)
+
+
+def constructor():
+    return WrappingPlugin()
+"""
+
+
+class Connection:
+    def __init__(self):
+        self.metadata = Metadata("10.0.0.1", 1234, "10.0.0.2", 80, ProxyDirection.INBOUND)
+        self.extra = {"gone": True}
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+class Flow:
+    def __init__(self):
+        self.metadata = Metadata("10.0.0.1", 5353, "10.0.0.2", 53, ProxyDirection.INBOUND)
+        self.context = Context(16)
+        self.extra = {}
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    memory = SharedMemory(create=True, size=1024)
+    monkeypatch.setattr(worker, "_memory", memory)
+    yield memory
+    memory.close()
+    memory.unlink()
+
+
+@pytest.fixture
+def plugin_module(tmp_path, monkeypatch):
+    (tmp_path / "slow_worker_plugin.py").write_text(textwrap.dedent(PLUGIN))
+    # Spawned worker processes take over the path of the parent
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return "slow_worker_plugin"
+
+
+def test_encode_places_payloads_in_shared_memory(memory):
+    context = Context(16)
+    context.append(ProxyDirection.INBOUND, b"request")
+    context.append(ProxyDirection.OUTBOUND, b"response")
+    args = (b"payload", [memoryview(b"packet"), 42], {"context": context})
+
+    buffer = memory.buf[512:]
+    try:
+        encoded, end = worker._encode(args, buffer, 512, 0)
+    finally:
+        buffer.release()
+
+    assert isinstance(encoded[0], worker._SharedBytes)
+    assert end == len(b"payload" + b"packet" + b"request" + b"response")
+    data, numbers, mapping = worker._decode(encoded)
+    assert (data, numbers) == (b"payload", [b"packet", 42])
+    assert mapping["context"].capacity == 16
+    assert bytes(mapping["context"].view(ProxyDirection.INBOUND)) == b"request"
+    assert bytes(mapping["context"].view(ProxyDirection.OUTBOUND)) == b"response"
+
+
+def test_encode_rejects_payloads_exceeding_the_slot(memory):
+    buffer = memory.buf[:8]
+    try:
+        with pytest.raises(worker._SlotFull):
+            worker._encode((b"12345", b"6789"), buffer, 0, 0)
+    finally:
+        buffer.release()
+
+
+def test_slots_are_kept_until_cancelled_calls_are_done(plugin_module):
+    async def main():
+        plugin = await WorkerPlugin.create(plugin_module, 1)
+        try:
+            connection = Connection()
+            await plugin.tcp_filter(connection, connection.metadata, b"fast", None)
+            assert connection.extra == {"seen": 1}
+            free = len(plugin._free_slots[0])
+
+            calls = [asyncio.create_task(plugin.tcp_filter(connection, connection.metadata, b"slow", None))
+                     for _ in range(2)]
+            await asyncio.sleep(0.1)
+            for call in calls:
+                call.cancel()
+            await asyncio.gather(*calls, return_exceptions=True)
+            # The worker is still reading the payloads of the cancelled calls
+            assert len(plugin._free_slots[0]) == free - 2
+
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if len(plugin._free_slots[0]) == free:
+                    break
+            assert len(plugin._free_slots[0]) == free
+        finally:
+            plugin.close()
+
+    asyncio.run(main())
+
+
+def test_closing_forgets_connections(plugin_module):
+    async def main():
+        plugin = await WorkerPlugin.create(plugin_module, 1)
+        try:
+            connection, unseen = Connection(), Connection()
+            await plugin.tcp_filter(connection, connection.metadata, b"fast", None)
+            assert len(plugin._ids) == 1
+
+            await plugin.tcp_connection_closed(unseen)
+            assert len(plugin._ids) == 1
+            await plugin.tcp_connection_closed(connection)
+            assert len(plugin._ids) == 0
+        finally:
+            plugin.close()
+
+    asyncio.run(main())
+
+
+def test_flow_extra_is_synchronized_back(plugin_module):
+    async def main():
+        plugin = await WorkerPlugin.create(plugin_module, 2)
+        try:
+            flow = Flow()
+            for data in (b"first", b"second"):
+                flow.context.append(ProxyDirection.INBOUND, data)
+                await plugin.udp_filter(flow.metadata, data, flow)
+            assert flow.extra == {"datagrams": 2, "context": b"firstsecond"}
+
+            await plugin.udp_filter_batch([(flow.metadata, b"third"), (flow.metadata, b"fourth")], [flow, flow])
+            assert flow.extra["datagrams"] == 4
+
+            await plugin.udp_flow_expired(flow)
+            assert len(plugin._ids) == 0
+        finally:
+            plugin.close()
+
+    asyncio.run(main())
+
+
+def test_releasing_is_synchronized_back(plugin_module):
+    async def main():
+        plugin = await WorkerPlugin.create(plugin_module, 1)
+        try:
+            connection = Connection()
+            await plugin.tcp_filter(connection, connection.metadata, b"fast", None)
+            assert not connection.released
+            await plugin.tcp_filter(connection, connection.metadata, b"release", None)
+            assert connection.released
+        finally:
+            plugin.close()
+
+    asyncio.run(main())
+
+
+def test_close_lets_calls_in_flight_finish(plugin_module):
+    async def main():
+        plugin = await WorkerPlugin.create(plugin_module, 1)
+        connection = Connection()
+        # The second call is still queued when closing
+        calls = [asyncio.create_task(plugin.tcp_filter(connection, connection.metadata, b"slow", None))
+                 for _ in range(2)]
+        await asyncio.sleep(0.1)
+        plugin.close()
+        assert await asyncio.gather(*calls) == [None, None]
+        assert connection.extra == {"seen": 2}
+
+    asyncio.run(main())
+
+
+def test_plugins_defining_wrapper_streams_are_rejected(tmp_path, monkeypatch):
+    (tmp_path / "wrapping_worker_plugin.py").write_text(textwrap.dedent(WRAPPING_PLUGIN))
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    with pytest.raises(RuntimeError, match="wrapper streams"):
+        asyncio.run(WorkerPlugin.create("wrapping_worker_plugin", 1))
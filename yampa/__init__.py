@@ -1,3 +1,3 @@
-from .plugins import PluginBase
-from .proxy import ProxyConnection, ProxyStream, WrapperStream
+from .plugins import PluginBase, Subscription
+from .proxy import ProxyConnection, ProxyStream, WrapperStream, UdpFlow
 from .shared import *
@@ -2,12 +2,14 @@ import asyncio
 import logging
 import signal
 
-from .proxy import Proxy
+from .proxy import Proxy, ProxyFront, load_config
+from .proxy.event_loop import run, loop_name
 
 
 async def main():
     logging.basicConfig(encoding='utf-8', level=logging.INFO)
-    proxy = Proxy()
+    logging.info("Running on the %s event loop", loop_name(asyncio.get_running_loop()))
+    proxy = ProxyFront() if load_config().proxy_workers > 1 else Proxy()
 
     await proxy.start()
 
@@ -20,8 +22,11 @@ async def main():
 
     asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(close()))
     asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(reload()))
+    asyncio.get_event_loop().add_signal_handler(signal.SIGUSR2, proxy.profile)
 
     await proxy.wait_closed()
 
 
-asyncio.run(main())
+# Guarded, as worker processes of plugins import this module again
+if __name__ == "__main__":
+    run(main(), load_config().event_loop)
@@ -0,0 +1,5 @@
+from .registry import Counter, Gauge, Histogram, Registry, REGISTRY
+from .definitions import HookStats, HOOK_DURATION, HOOK_ERRORS, HOOK_BUDGET_EXCEEDED, PLUGIN_BYPASSES, \
+    OPEN_CONNECTIONS, BYTES, PACKETS, REJECTS, LOG_DROPPED, CONNECTION_DROPS, \
+    WORKER_DROPS, OPEN_UDP_FLOWS, UDP_FLOW_EXPIRIES, PENDING_PACKETS, PACKET_DROPS
+from .server import start_metrics_server
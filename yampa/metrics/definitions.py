@@ -0,0 +1,50 @@
+from .registry import REGISTRY, Counter, Gauge, Histogram
+
+HOOK_DURATION = REGISTRY.register(Histogram(
+    "yampa_hook_duration_seconds",
+    "Execution time of plugin hooks, the count of this histogram is the number of calls", ("plugin", "hook")))
+HOOK_ERRORS = REGISTRY.register(Counter(
+    "yampa_hook_errors_total", "Number of plugin hook calls that raised an exception", ("plugin", "hook")))
+
+OPEN_CONNECTIONS = REGISTRY.register(Gauge(
+    "yampa_open_connections", "Number of currently open tcp connections"))
+BYTES = REGISTRY.register(Counter(
+    "yampa_bytes_total", "Number of payload bytes forwarded by the proxy", ("protocol", "direction")))
+PACKETS = REGISTRY.register(Counter(
+    "yampa_packets_total", "Number of udp and other packets received by the proxy", ("protocol", "direction")))
+REJECTS = REGISTRY.register(Counter(
+    "yampa_rejects_total", "Number of packets rejected by the filter stage", ("protocol", "direction")))
+HOOK_BUDGET_EXCEEDED = REGISTRY.register(Counter(
+    "yampa_hook_budget_exceeded_total", "Number of plugin hook calls that exceeded their latency budget",
+    ("plugin", "hook")))
+PLUGIN_BYPASSES = REGISTRY.register(Counter(
+    "yampa_plugin_bypasses_total", "Number of times a plugin was bypassed for repeatedly exceeding budgets",
+    ("plugin",)))
+CONNECTION_DROPS = REGISTRY.register(Counter(
+    "yampa_connection_drops_total", "Number of tcp connections closed or refused by the proxy itself", ("reason",)))
+OPEN_UDP_FLOWS = REGISTRY.register(Gauge(
+    "yampa_open_udp_flows", "Number of udp flows currently tracked by the proxy"))
+UDP_FLOW_EXPIRIES = REGISTRY.register(Counter(
+    "yampa_udp_flow_expiries_total", "Number of udp flows that timed out or were evicted from the flow table",
+    ("reason",)))
+WORKER_DROPS = REGISTRY.register(Counter(
+    "yampa_worker_drops_total", "Number of udp and other packets dropped because their proxy worker fell behind",
+    ("protocol",)))
+PENDING_PACKETS = REGISTRY.register(Gauge(
+    "yampa_pending_packets", "Number of udp and other packets currently queued or being handled by the proxy"))
+PACKET_DROPS = REGISTRY.register(Counter(
+    "yampa_packet_drops_total", "Number of udp and other packets dropped because too many were already pending",
+    ("protocol", "reason")))
+LOG_DROPPED = REGISTRY.register(Counter(
+    "yampa_log_dropped_total", "Number of log hook calls dropped because the log queue was full", ("hook",)))
+
+
+class HookStats:
+    """The metrics of one hook of one plugin, resolved once when the dispatch tables are built."""
+    __slots__ = ("hook", "duration", "errors", "exceeded")
+
+    def __init__(self, plugin: str, hook: str):
+        self.hook = hook
+        self.duration = HOOK_DURATION.labels(plugin, hook)
+        self.errors = HOOK_ERRORS.labels(plugin, hook)
+        self.exceeded = HOOK_BUDGET_EXCEEDED.labels(plugin, hook)
@@ -0,0 +1,150 @@
+import bisect
+import math
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Metric(ABC):
+    """A metric family with a fixed set of label names. Use `labels` to get the child holding the value for a specific
+    set of label values, and keep a reference to it on hot paths instead of looking it up every time."""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames} for metric {self.name}, got {values}")
+
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        pass
+
+    @abstractmethod
+    def _samples(self, values: tuple[str, ...], child) -> Iterable[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in list(self._children.items()):
+            for name, names, label_values, value in self._samples(values, child):
+                lines.append(f"{name}{_format_labels(names, label_values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def _samples(self, values, child):
+        yield self.name, self.labelnames, values, child.value
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def _new_child(self):
+        return GaugeValue()
+
+
+class HistogramValue:
+    __slots__ = ("_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    type = "histogram"
+    # From 10 microseconds to 1 second, which covers everything from a trivial hook to a badly stalling one
+    DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5,
+                       1.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def _samples(self, values, child):
+        names = self.labelnames + ("le",)
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", names, values + (_format_value(bound),), cumulative
+        yield f"{self.name}_sum", self.labelnames, values, child.sum
+        yield f"{self.name}_count", self.labelnames, values, child.count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """:returns: All registered metrics in the prometheus text exposition format."""
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
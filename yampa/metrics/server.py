@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+from .registry import REGISTRY, Registry
+
+logger = logging.getLogger(__name__)
+
+
+async def start_metrics_server(listen: str, registry: Registry = REGISTRY) -> asyncio.Server:
+    """Serve the metrics of `registry` in the prometheus text format over plain HTTP.
+
+    :param listen: Either `host:port` to listen on tcp, or `unix:/path/to/socket` to listen on a unix socket.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # Skip the headers, nothing in them is of interest
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/", b"/metrics"):
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    if listen.startswith("unix:"):
+        server = await asyncio.start_unix_server(handle, listen[len("unix:"):])
+    else:
+        host, port = listen.rsplit(":", 1)
+        server = await asyncio.start_server(handle, host, int(port))
+
+    logger.info("Metrics server listening on %s", listen)
+    return server
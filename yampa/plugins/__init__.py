@@ -1,3 +1,5 @@
 from .base import PluginBase
+from .budget import HookBudgets
 from .manager import PluginManager
 from .plugin import Plugin
+from .subscription import Subscription
@@ -1,5 +1,6 @@
-from ..shared import Metadata, FilterAction, ProxyDirection
-from ..proxy import ProxyConnection
+from ..shared import Metadata, FilterAction, ProxyDirection, Context
+from ..proxy import ProxyConnection, UdpFlow
+from .subscription import Subscription
 
 
 class PluginBase:
@@ -20,8 +21,18 @@ class PluginBase:
     A plugin defines its hooks by overriding any of the base functions specified here. There is no need to call
     `super()`, as the function implementations here are only the default implementations used if no plugin exposes a
     given hook.
+
+    Hooks may also be implemented as plain functions instead of coroutines, with the same parameters and return values.
+    Such hooks are detected when the plugin is loaded and called inline, which saves allocating and awaiting a
+    coroutine on every packet. Prefer this for hooks that never await anything, like most filters.
+
+    A plugin only interested in some of the traffic can declare so by setting `subscription` as a class attribute,
+    for instance `subscription = Subscription(ports=443, protocols=Protocol.TCP)`. Its hooks are then only called for
+    matching traffic. See `Subscription` for details on the matching rules.
     """
 
+    subscription: Subscription | None = None
+
     async def tcp_new_connection(self, connection: ProxyConnection) -> None:
         """This hook is called every time an incoming connection is opened from either side of the proxy. Use it to
         manage internal state for tracking connections.
@@ -38,6 +49,8 @@ class PluginBase:
 
     async def tcp_connection_closed(self, connection: ProxyConnection) -> None:
         """This hook is called every time an incoming connection is closed. Use this to clean up any internal state.
+        It is called for every connection `tcp_new_connection` was called for, including connections the proxy closed
+        itself because they timed out or to make room for new ones.
 
         :param connection: The tcp connection
         :type connection: ProxyConnection
@@ -64,7 +77,7 @@ class PluginBase:
         return data
 
     async def tcp_filter(self, connection: ProxyConnection, metadata: Metadata, data: bytes,
-                         context: dict[ProxyDirection, bytes]) -> None | tuple[FilterAction, bytes | None]:
+                         context: Context) -> None | tuple[FilterAction, bytes | None]:
         """This hook is called in the filter stage of any tcp connection.
 
         :param connection: The tcp connection
@@ -76,9 +89,11 @@ class PluginBase:
         :type metadata: Metadata
         :param data: The packet bytes, as returned from the decrypt stage
         :type data: bytes
-        :param context: Previous traffic for both directions of the connection, currently any previous traffic up to
-            4096 bytes. Use this to match based on context, to also match across packet boundaries.
-        :type context: dict[ProxyDirection, bytes]
+        :param context: Previous traffic for both directions of the connection, including `data`, up to the configured
+            `CONTEXT_SIZE` (8192 bytes by default). `data` can be longer than that, in which case the context only
+            holds its end. Use this to match based on context, to also match across packet boundaries.
+            `context[direction]` returns the traffic as bytes, `context.view(direction)` as a memoryview of them.
+        :type context: Context
         :returns: None if this plugin takes no action and the next plugin in the chain should be called. Otherwise, a
             tuple should be returned, specifying the taken FilterAction, and the data that should be passed on to the
             next stage. REJECT will close the connection immediately, discarding this packet. ACCEPT will forward the
@@ -127,7 +142,29 @@ class PluginBase:
         """
         return data
 
-    async def udp_decrypt(self, metadata: Metadata, data: bytes) -> None | bytes:
+    async def udp_flow_new(self, flow: UdpFlow) -> None:
+        """This hook is called for the first packet of every udp flow, before any other hook is called for it. Use it to
+        set up per-flow state, just like `tcp_new_connection`.
+
+        Like `tcp_new_connection`, this hook is also called once for every currently tracked flow when the plugin is
+        (re)loaded. Persist state that should survive a reload in `flow.extra`.
+
+        :param flow: The new udp flow. `flow.metadata` is the metadata of its first packet.
+        :type flow: UdpFlow
+        """
+        pass
+
+    async def udp_flow_expired(self, flow: UdpFlow) -> None:
+        """This hook is called once a udp flow saw no packets for `UDP_IDLE_TIMEOUT` seconds, or was evicted to keep
+        at most `MAX_UDP_FLOWS` flows, after all of its log calls are done. Use this to clean up any per-flow state. A
+        later packet between the same peers starts a new flow.
+
+        :param flow: The udp flow
+        :type flow: UdpFlow
+        """
+        pass
+
+    async def udp_decrypt(self, metadata: Metadata, data: bytes, flow: UdpFlow | None = None) -> None | bytes:
         """This hook is called in the decrypt stage of any udp packet.
 
         :param metadata: The metadata of this packet. For this hook, `metadata.direction` is always just ProxyDirection,
@@ -136,6 +173,10 @@ class PluginBase:
         :type metadata: Metadata
         :param data: The bytes in this packet
         :type data: bytes
+        :param flow: The udp flow this packet belongs to, with the context of previous packets and `extra` for
+            per-flow state. Only passed to plugins declaring this parameter, so it stays None for plugins that don't
+            and for plugins running in worker processes.
+        :type flow: UdpFlow | None
         :returns: None if this plugin takes no action and the next plugin in the chain should be called. If the plugin
             can decrypt the given packet and wishes to skip the rest of the pipeline, return a `bytes` object. If all
             plugins return None, `data` is instead used.
@@ -143,7 +184,8 @@ class PluginBase:
         """
         return data
 
-    async def udp_filter(self, metadata: Metadata, data: bytes) -> None | tuple[FilterAction, bytes | None]:
+    async def udp_filter(self, metadata: Metadata, data: bytes,
+                         flow: UdpFlow | None = None) -> None | tuple[FilterAction, bytes | None]:
         """This hook is called in the filter stage of any udp packet.
 
         :param metadata: The metadata of this packet. For this hook, `metadata.direction` is always just ProxyDirection,
@@ -152,6 +194,10 @@ class PluginBase:
         :type metadata: Metadata
         :param data: The packet bytes, as returned from the decrypt stage
         :type data: bytes
+        :param flow: The udp flow this packet belongs to, with the context of previous packets and `extra` for
+            per-flow state. Only passed to plugins declaring this parameter, so it stays None for plugins that don't
+            and for plugins running in worker processes.
+        :type flow: UdpFlow | None
         :returns: None if this plugin takes no action and the next plugin in the chain should be called. Otherwise, a
             tuple should be returned, specifying the taken FilterAction, and the data that should be passed on to the
             next stage. REJECT will close the connection immediately, discarding this packet. ACCEPT will forward the
@@ -161,7 +207,28 @@ class PluginBase:
         """
         return None
 
-    async def udp_log(self, metadata: Metadata, data: bytes, action: None | tuple[FilterAction, bytes | None]) -> None:
+    async def udp_filter_batch(self, packets: list[tuple[Metadata, bytes]], flows: list[UdpFlow] | None = None
+                               ) -> list[None | tuple[FilterAction, bytes | None]]:
+        """This hook is the batched variant of `udp_filter`. When the proxy batches udp packets, it is called once with
+        all packets of a batch which are still undecided by previous plugins, instead of calling `udp_filter` once per
+        packet. Use this to amortize per-call costs, e.g. handing all packets to a filter engine at once.
+
+        A plugin may implement either of `udp_filter` and `udp_filter_batch` or both, the proxy adapts between them as
+        needed. Each packet in a batch is travelling in the same ProxyDirection.
+
+        :param packets: The metadata and packet bytes of each packet, as passed to `udp_filter`
+        :type packets: list[tuple[Metadata, bytes]]
+        :param flows: The udp flow of each packet, as passed to `udp_filter`. Only passed to plugins declaring this
+            parameter.
+        :type flows: list[UdpFlow] | None
+        :returns: One result per packet, in the same order and with the same meaning as the return value of
+            `udp_filter`. Packets for which None is returned are passed on to the next plugin.
+        :rtype: list[None | tuple[FilterAction, bytes | None]]
+        """
+        return [None] * len(packets)
+
+    async def udp_log(self, metadata: Metadata, data: bytes, action: None | tuple[FilterAction, bytes | None],
+                      flow: UdpFlow | None = None) -> None:
         """This hook is called in the log stage of any udp packet.
 
         :param metadata: The metadata of this packet. For this hook, `metadata.direction` is always just ProxyDirection,
@@ -174,10 +241,14 @@ class PluginBase:
             plugins, or to produce a diff between what went into the filter stage (`data`) and what came out
             (`action[1]`).
         :type action: None | tuple[FilterAction, bytes | None]
+        :param flow: The udp flow this packet belongs to, with the context of previous packets and `extra` for
+            per-flow state. Only passed to plugins declaring this parameter, so it stays None for plugins that don't
+            and for plugins running in worker processes.
+        :type flow: UdpFlow | None
         """
         pass
 
-    async def udp_encrypt(self, metadata: Metadata, data: bytes) -> None | bytes:
+    async def udp_encrypt(self, metadata: Metadata, data: bytes, flow: UdpFlow | None = None) -> None | bytes:
         """This hook is called in the encrypt stage of any udp packet.
 
         :param metadata: The metadata of this packet. For this hook, `metadata.direction` is always just ProxyDirection,
@@ -186,6 +257,10 @@ class PluginBase:
         :type metadata: Metadata
         :param data: The packet bytes, as passed on from the filter stage
         :type data: bytes
+        :param flow: The udp flow this packet belongs to, with the context of previous packets and `extra` for
+            per-flow state. Only passed to plugins declaring this parameter, so it stays None for plugins that don't
+            and for plugins running in worker processes.
+        :type flow: UdpFlow | None
         :returns: None if this plugin takes no action and the next plugin in the chain should be called. If the plugin
             can encrypt the given `data` and wishes to skip the rest of the pipeline, return a `bytes` object. If all
             plugins return None, `data` is instead used.
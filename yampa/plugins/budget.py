@@ -0,0 +1,41 @@
+from dataclasses import dataclass, field
+
+from ..shared import FilterAction
+
+# Filter hooks, which can take `HookBudgets.filter_timeout` on traffic when they exceed their budget
+FILTER_HOOKS = ("tcp_filter", "udp_filter", "udp_filter_batch")
+
+
+@dataclass(frozen=True)
+class HookBudgets:
+    """Latency budgets for the hooks returning a result, i.e. the decrypt, filter and encrypt stages.
+
+    Hooks exceeding their budget fail open: the call is abandoned and counts as if the plugin returned None, so a slow
+    plugin never holds up traffic. Awaitables returned by async hooks are cancelled, except for futures and tasks, which
+    might be shared with other calls, so only waiting for them stops. Filter hooks can instead fail closed by setting
+    `filter_timeout`, taking that action on the traffic, e.g. to never let traffic through a filter might have rejected.
+
+    A plugin exceeding budgets `violations` times within `window` seconds is bypassed for `bypass_duration` seconds,
+    that is, it is skipped for all hooks returning a result, filter hooks included. Its other hooks, like
+    `tcp_new_connection`, keep running so its state stays consistent once it is retried.
+    """
+    # Budget in seconds for all hooks returning a result, None disables budgets
+    default: float | None = None
+    # Budgets overriding the default for single hooks by hook name, 0 disables the budget of a hook
+    hooks: dict[str, float] = field(default_factory=dict)
+    violations: int = 5
+    window: float = 10
+    bypass_duration: float = 30
+    # Action taken on traffic whose filter hook exceeded its budget, None to fail open
+    filter_timeout: FilterAction | None = None
+
+    def budget(self, name: str) -> float | None:
+        budget = self.hooks.get(name, self.default)
+        return budget if budget else None
+
+    def fails_closed(self, name: str) -> bool:
+        """:returns: Whether the hook `name` takes `filter_timeout` on traffic when exceeding its budget, instead of
+            failing open.
+        :rtype: bool
+        """
+        return self.filter_timeout is not None and name in FILTER_HOOKS
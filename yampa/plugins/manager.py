@@ -2,24 +2,109 @@ import asyncio
 import logging
 import os
 import importlib
+import inspect
 import traceback
 import typing
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import repeat
+from time import monotonic, perf_counter
+from typing import Any, Callable, NamedTuple
 
 from .base import PluginBase
+from .budget import HookBudgets
 from .plugin import Plugin
+from .subscription import Subscription
+from ..metrics import HookStats, PLUGIN_BYPASSES
+from ..shared import ProxyDirection, ConnectionDirection, Protocol
 
 logger = logging.getLogger(__name__)
 
+# All hooks defined by PluginBase, in definition order
+HOOK_NAMES = tuple(name for name, value in vars(PluginBase).items()
+                   if not name.startswith("_") and callable(value))
+# Hooks called for every chunk of a TCP connection
+TCP_STAGE_HOOKS = ("tcp_decrypt", "tcp_filter", "tcp_encrypt", "tcp_log")
+# Hooks taking the udp flow of a packet as an optional last parameter, by the number of parameters before it
+FLOW_HOOKS = {"udp_decrypt": 2, "udp_filter": 2, "udp_log": 3, "udp_encrypt": 2}
+# Index of the packet bytes in the arguments of the single filter hooks, to take action on them after a timeout
+FILTER_DATA = {"tcp_filter": 2, "udp_filter": 1}
+
+
+class HookImplementation(NamedTuple):
+    plugin: Plugin
+    function: Callable[..., Any]
+    # Whether the hook is a coroutine function, otherwise it is called inline without awaiting
+    is_async: bool
+    subscription: Subscription | None
+    stats: HookStats | None = None
+    # Whether the hook declares the flow parameter of udp hooks, otherwise it is called without it
+    takes_flow: bool = False
+
+
+@dataclass(frozen=True)
+class HookTable:
+    """Immutable dispatch table for a single hook, built on every change of the loaded plugin set.
+
+    `implementations` holds the bound hook functions of all plugins defining the hook, in plugin order. If `gather` is
+    set, the hook is annotated to always return None and all implementations are executed in parallel. Otherwise, they
+    are executed in order until the first one returns something other than None, falling back to `default`.
+
+    Implementations of hooks with a `budget` are only waited for that many seconds, see `HookBudgets`.
+
+    If any of the implementing plugins declares a subscription, `select` narrows the implementations down to those
+    matching a given packet. Selections are indexed by the subscribed ports, so that traffic on ports no plugin
+    subscribed to shares a single entry.
+    """
+    name: str
+    gather: bool
+    implementations: tuple[HookImplementation, ...]
+    default: Callable[..., Any]
+    protocol: Protocol
+    ports: frozenset[int] = frozenset()
+    subscribed: bool = False
+    budget: float | None = None
+    _selections: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def select(self, ports: tuple[int, ...], proxy_direction: ProxyDirection,
+               connection_direction: ConnectionDirection | None) -> tuple[HookImplementation, ...]:
+        if not self.subscribed:
+            return self.implementations
+
+        key = (tuple(port if port in self.ports else None for port in ports), proxy_direction, connection_direction)
+        try:
+            return self._selections[key]
+        except KeyError:
+            selection = tuple(implementation for implementation in self.implementations
+                              if implementation.subscription is None or
+                              implementation.subscription.matches(self.protocol, ports, proxy_direction,
+                                                                  connection_direction))
+            self._selections[key] = selection
+            return selection
+
 
 class PluginManager(PluginBase):
-    def __init__(self):
+    # Maximum number of hook calls in flight while replaying `tcp_new_connection` and `udp_flow_new` on reload
+    REPLAY_CONCURRENCY = 64
+    # Maximum number of rounds replaying them for connections and flows that opened during the previous round
+    REPLAY_ROUNDS = 3
+
+    def __init__(self, budgets: HookBudgets = HookBudgets()):
         self._default_plugin = PluginBase()
-        self._plugins = {}
+        self._plugins: dict[str, Plugin] = {}
         self._open_connections = set()
+        self._open_flows = set()
+        self._hooks: dict[str, HookTable] = {}
+        # Incremented on every change of the dispatch tables
+        self._generation = 0
+        self._reload_lock = asyncio.Lock()
+        self._budgets = budgets
+        # Times of the latest budget violations per plugin, and the plugins currently bypassed because of them
+        self._violations: dict[Plugin, deque[float]] = {}
+        self._bypassed: set[Plugin] = set()
+        self._swap({})
 
     async def reload(self):
-        success = True
-
         found_plugins = []
         with os.scandir("./plugins") as scanner:
             for candidate in scanner:
@@ -30,96 +115,536 @@ class PluginManager(PluginBase):
                     if not os.path.isfile(os.path.join(candidate.path, "__init__.py")):
                         logger.info("... skipping directory %s: does not have __init__.py", candidate)
                         continue
-                    success &= await self.reload_plugin(candidate.name)
                     found_plugins += [candidate.name]
                 elif candidate.is_file() and candidate.name.endswith(".py"):
-                    success &= await self.reload_plugin(candidate.name[:-3])
                     found_plugins += [candidate.name[:-3]]
                 else:
                     # Ignore files not ending in .py and symlinks
                     pass
 
-        # unload all plugins that are not found
-        # this copies the values into a temporary list to avoid modify-while-iterate
-        for unload in [x for x in self._plugins.keys() if x not in found_plugins]:
-            success &= self.unload_plugin(unload)
-
-        return success
+        # All plugins that are not found are unloaded
+        return await self._reload(found_plugins, True)
 
     async def reload_plugin(self, name):
-        importlib.invalidate_caches()
+        return await self._reload([name], False)
 
-        if name in self._plugins:
-            # reload
-            logger.info("... reloading %s", name)
-            plugin = self._plugins[name]
-
-            success = plugin.reload()
-        else:
-            # fresh load
-            logger.info("... fresh loading %s", name)
-            plugin = Plugin(name)
-            success = plugin.load()
-            self._plugins[name] = plugin
-
-        # replay all open connection closed
-        await asyncio.gather(*[plugin.tcp_new_connection(conn) for conn in self._open_connections])
-        return success
+    async def _reload(self, names: list[str], complete: bool) -> bool:
+        """Load the plugins `names` into a new plugin set next to the running one, and swap it in once they are ready.
+        Until then, all traffic keeps being handled by the running plugin set.
+
+        :param complete: Whether `names` is the complete new plugin set, otherwise the other running plugins are kept.
+        """
+        async with self._reload_lock:
+            importlib.invalidate_caches()
+            success = True
+
+            plugins = {} if complete else dict(self._plugins)
+            fresh = []
+            for name in names:
+                old = self._plugins.get(name)
+                if old is not None and not old.changed():
+                    # Keep the running plugin along with its state
+                    logger.info("... keeping unchanged %s", name)
+                    plugin = old
+                elif old is not None:
+                    logger.info("... reloading %s", name)
+                    plugin = await old.reloaded()
+                else:
+                    logger.info("... fresh loading %s", name)
+                    plugin = Plugin(name)
+                    plugin = plugin if await plugin.load() else None
+
+                if plugin is None:
+                    # If the new version fails to load, the old version keeps running
+                    success = False
+                    plugin = old
+                elif plugin is not old:
+                    fresh.append(plugin)
+                if plugin is not None:
+                    plugins[name] = plugin
+
+            # Let the new plugins know about all open connections and flows. Connections may open while doing so, which
+            # are still handled by the old plugin set, so catch up on them a few times to keep the final step small.
+            tracked = (("tcp_new_connection", "tcp_connection_closed", self._open_connections),
+                       ("udp_flow_new", "udp_flow_expired", self._open_flows))
+            replayed = {new: set() for new, _, _ in tracked}
+            for new, _, open_items in tracked:
+                for _ in range(self.REPLAY_ROUNDS):
+                    items = [item for item in open_items if item not in replayed[new]]
+                    if not items:
+                        break
+                    replayed[new].update(items)
+                    for plugin in await self._replay(fresh, new, items):
+                        success = False
+                        fresh.remove(plugin)
+                        plugins[plugin.name] = self._plugins.get(plugin.name)
+                        plugin.unload()
+            # Running plugins may have been unloaded meanwhile, after failing on some traffic
+            plugins = {name: plugin for name, plugin in plugins.items()
+                       if plugin in fresh or (plugin is not None and self._plugins.get(name) is plugin)}
+
+            old_plugins = self._plugins
+            self._swap(plugins)
+
+            # Connections that opened during the last round are announced to the new plugins right after the swap, and
+            # connections that closed during the replay were only announced to the old plugin set
+            for new, closed_hook, open_items in tracked:
+                opened = [item for item in open_items if item not in replayed[new]]
+                closed = [item for item in replayed[new] if item not in open_items]
+                success &= not await self._replay(fresh, new, opened)
+                success &= not await self._replay(fresh, closed_hook, closed)
+
+            for name, plugin in old_plugins.items():
+                if plugins.get(name) is not plugin:
+                    if name not in plugins:
+                        logger.info("... unloading %s", name)
+                    success &= plugin.unload()
+
+            return success
+
+    async def _replay(self, plugins: list[Plugin], name: str, connections: list) -> list[Plugin]:
+        """Call the hook `name` of `plugins` for `connections`, which are tcp connections or udp flows, at most
+        `REPLAY_CONCURRENCY` at a time, yielding to the event loop in between to keep the traffic flowing.
+
+        :returns: The plugins that raised an exception.
+        :rtype: list[Plugin]
+        """
+        key = _subscription_key(name)
+        protocol = _HOOK_PROTOCOLS[name.split("_", 1)[0]]
+        calls = []
+        for plugin in plugins:
+            function = plugin.implementation(name)
+            if function is None:
+                continue
+            subscription = plugin.subscription
+            calls += [(plugin, function, conn) for conn in connections
+                      if subscription is None or subscription.matches(protocol, *key(conn))]
+
+        failed = []
+
+        def fail(plugin, exception):
+            logger.error("Error occurred while replaying %s for plugin %s", name, plugin.name)
+            logger.error("".join(traceback.format_exception(exception)))
+            if plugin not in failed:
+                failed.append(plugin)
+
+        for i in range(0, len(calls), self.REPLAY_CONCURRENCY):
+            # Synchronous hooks run inline, so the first chunk is done before anything else gets to run
+            pending = []
+            for plugin, function, conn in calls[i:i + self.REPLAY_CONCURRENCY]:
+                if plugin in failed:
+                    continue
+                try:
+                    if inspect.isawaitable(ret := function(conn)):
+                        pending.append((plugin, ret))
+                except Exception as e:
+                    fail(plugin, e)
+
+            results = await asyncio.gather(*[ret for _, ret in pending], return_exceptions=True)
+            for (plugin, _), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    fail(plugin, result)
+            await asyncio.sleep(0)
+
+        return failed
 
     def unload_plugin(self, name):
         # unload
         logger.info("... unloading %s", name)
         if name in self._plugins:
-            success = self._plugins[name].unload()
-            del self._plugins[name]
-            return success
+            plugins = dict(self._plugins)
+            plugin = plugins.pop(name)
+            self._swap(plugins)
+            return plugin.unload()
         return False
 
-    def __getattribute__(self, name):
-        if hasattr(PluginBase, name):
-            # store history for open TCP connections
-            if name == "tcp_new_connection":
-                async def wrapper(connection, *args, **kwargs):
-                    self._open_connections.add(connection)
-                    await self._delegate_plugin_call(name)(connection, *args, **kwargs)
-            elif name == "tcp_connection_closed":
-                async def wrapper(connection, *args, **kwargs):
-                    self._open_connections.remove(connection)
-                    await self._delegate_plugin_call(name)(connection, *args, **kwargs)
+    def _swap(self, plugins: dict[str, Plugin]):
+        """Make `plugins` the current plugin set, compiling its dispatch tables. The plugin set and the tables are
+        swapped in as a whole, so calls that are already in flight finish on the tables they started with."""
+        gather = {name: typing.get_type_hints(getattr(PluginBase, name))["return"] is type(None) for name in HOOK_NAMES}
+
+        implementations = {}
+        for name in HOOK_NAMES:
+            implementations[name] = {}
+            for plugin in plugins.values():
+                # Bypassed plugins only keep the hooks not returning a result, to keep track of connections
+                if plugin in self._bypassed and not gather[name]:
+                    continue
+                function = plugin.implementation(name)
+                if function is not None:
+                    implementations[name][plugin] = HookImplementation(plugin, function,
+                                                                       inspect.iscoroutinefunction(function),
+                                                                       plugin.subscription,
+                                                                       takes_flow=_takes_flow(name, function))
+
+        # Plugins implementing only one of a single and batched hook pair get an adapter for the other one
+        for single, batch in _BATCH_HOOKS.items():
+            for plugin in plugins.values():
+                if plugin in implementations[single] and plugin not in implementations[batch]:
+                    implementations[batch][plugin] = _batched(implementations[single][plugin])
+                elif plugin in implementations[batch] and plugin not in implementations[single]:
+                    implementations[single][plugin] = _unbatched(implementations[batch][plugin])
+
+        hooks = {}
+        for name in HOOK_NAMES:
+            # Keep plugin order, even for adapted implementations
+            table = tuple(implementations[name][plugin]._replace(stats=HookStats(plugin.name, name))
+                          for plugin in plugins.values() if plugin in implementations[name])
+            subscriptions = [x.subscription for x in table if x.subscription is not None]
+            hooks[name] = HookTable(name, gather[name], table,
+                                    getattr(self._default_plugin, name), _HOOK_PROTOCOLS[name.split("_", 1)[0]],
+                                    frozenset().union(*[x.ports for x in subscriptions if x.ports is not None]),
+                                    len(subscriptions) > 0, None if gather[name] else self._budgets.budget(name))
+
+        self._plugins = plugins
+        self._hooks = hooks
+        self._generation += 1
+
+    @property
+    def generation(self) -> int:
+        """A number that changes whenever the set of plugins or the hooks they are called for change, e.g. on reload.
+        Anything derived from the dispatch tables, like `inspects`, is valid until then."""
+        return self._generation
 
+    def inspects(self, connection, metadata) -> bool:
+        """:returns: Whether any plugin is called for the chunks of `connection` travelling in the direction of
+            `metadata`. If not, its traffic can be forwarded as is without dispatching the per-chunk hooks.
+        :rtype: bool
+        """
+        key = _tcp_key(connection, metadata)
+        return any(self._hooks[name].select(*key) for name in TCP_STAGE_HOOKS)
+
+    def _hook_failed(self, implementation: HookImplementation, exception: BaseException):
+        implementation.stats.errors.inc()
+        self._plugin_failed(implementation.plugin, exception)
+
+    @staticmethod
+    async def _await_budgeted(awaitable, deadline: float):
+        """Await the result of a hook, giving up at `deadline` (in terms of `perf_counter`) with a `TimeoutError`.
+
+        Coroutines are cancelled then, futures and tasks are not, as they might be shared with other calls, e.g. a task
+        a plugin started itself. Cancelling the caller from elsewhere still cancels it as usual."""
+        if not asyncio.iscoroutine(awaitable):
+            awaitable = asyncio.shield(awaitable)
+        loop = asyncio.get_running_loop()
+        async with asyncio.timeout_at(loop.time() + deadline - perf_counter()):
+            return await awaitable
+
+    def _budget_exceeded(self, implementation: HookImplementation, duration: float):
+        implementation.stats.exceeded.inc()
+        plugin = implementation.plugin
+        hook = implementation.stats.hook
+        outcome = (f"taking {self._budgets.filter_timeout.value} on the traffic" if self._budgets.fails_closed(hook)
+                   else "ignoring the result")
+        logger.warning("Plugin %s took %.1f ms in %s, exceeding its budget, %s", plugin.name, duration * 1000, hook,
+                       outcome)
+
+        violations = self._violations.setdefault(plugin, deque(maxlen=self._budgets.violations))
+        violations.append(now := monotonic())
+        if len(violations) < violations.maxlen or now - violations[0] > self._budgets.window:
+            return
+        # Bypassing could already be under way from a concurrent call, or the plugin could be gone
+        if plugin in self._bypassed or self._plugins.get(plugin.name) is not plugin:
+            return
+
+        logger.error("Plugin %s exceeded its budgets %d times within %s s, bypassing it for %s s", plugin.name,
+                     len(violations), self._budgets.window, self._budgets.bypass_duration)
+        PLUGIN_BYPASSES.labels(plugin.name).inc()
+        violations.clear()
+        self._bypassed.add(plugin)
+        self._swap(self._plugins)
+        asyncio.get_running_loop().call_later(self._budgets.bypass_duration, self._retry, plugin)
+
+    def _retry(self, plugin: Plugin):
+        self._bypassed.discard(plugin)
+        if self._plugins.get(plugin.name) is plugin:
+            logger.info("Retrying bypassed plugin %s", plugin.name)
+            self._swap(self._plugins)
+
+    def _plugin_failed(self, plugin: Plugin, exception: BaseException):
+        logger.error("Error occurred while executing plugin %s, skipping and unloading...", plugin.name)
+        logger.error("".join(traceback.format_exception(exception)))
+        # The plugin might already be gone if it failed on multiple calls concurrently
+        if self._plugins.get(plugin.name) is plugin:
+            self.unload_plugin(plugin.name)
+
+    async def udp_filter_batch(self, packets, flows=None):
+        table = self._hooks["udp_filter_batch"]
+        results = [None] * len(packets)
+        pending = range(len(packets))
+
+        # Like the single filter hook, each packet is handed to the plugins in order until one takes action on it
+        for implementation in table.implementations:
+            _, function, is_async, subscription, stats, takes_flow = implementation
+            if subscription is not None:
+                indices = [i for i in pending if subscription.matches(Protocol.UDP, *_udp_key(packets[i][0]))]
             else:
-                return self._delegate_plugin_call(name)
-            return wrapper
+                indices = pending
+            if not indices:
+                continue
+
+            error = None
+            start = perf_counter()
+            try:
+                args = ([packets[i] for i in indices],)
+                if takes_flow and flows is not None:
+                    args += ([flows[i] for i in indices],)
+                ret = function(*args)
+                if is_async or inspect.isawaitable(ret):
+                    ret = await (ret if table.budget is None else self._await_budgeted(ret, start + table.budget))
+                if len(ret) != len(indices):
+                    raise ValueError(f"Expected {len(indices)} results from {table.name}, got {len(ret)}")
+            except Exception as e:
+                error = e
+            duration = perf_counter() - start
+            stats.duration.observe(duration)
+            if table.budget is not None and duration > table.budget:
+                self._budget_exceeded(implementation, duration)
+                if not self._budgets.fails_closed(table.name):
+                    continue
+                ret = [(self._budgets.filter_timeout, packets[i][1]) for i in indices]
+            elif error is not None:
+                self._hook_failed(implementation, error)
+                continue
+
+            for i, result in zip(indices, ret):
+                results[i] = result
+            pending = [i for i in pending if results[i] is None]
+            if not pending:
+                break
+
+        return results
+
+    # store history for open TCP connections
+    async def tcp_new_connection(self, connection):
+        self._open_connections.add(connection)
+        await _DISPATCHERS["tcp_new_connection"](self, connection)
+
+    async def tcp_connection_closed(self, connection):
+        self._open_connections.discard(connection)
+        await _DISPATCHERS["tcp_connection_closed"](self, connection)
+
+    # and for udp flows
+    async def udp_flow_new(self, flow):
+        self._open_flows.add(flow)
+        await _DISPATCHERS["udp_flow_new"](self, flow)
+
+    async def udp_flow_expired(self, flow):
+        self._open_flows.discard(flow)
+        await _DISPATCHERS["udp_flow_expired"](self, flow)
+
+
+# Hooks that have a batched variant, mapping the single hook to the batched one
+_BATCH_HOOKS = {"udp_filter": "udp_filter_batch"}
+
+
+def _batched(implementation: HookImplementation) -> HookImplementation:
+    """Adapt a single packet hook to the batched hook signature, calling it once per packet."""
+    function = implementation.function
+    if implementation.takes_flow and implementation.is_async:
+        async def batch(packets, flows=None):
+            flows = repeat(None) if flows is None else flows
+            return [await function(*packet, flow) for packet, flow in zip(packets, flows)]
+    elif implementation.takes_flow:
+        def batch(packets, flows=None):
+            flows = repeat(None) if flows is None else flows
+            return _settle([function(*packet, flow) for packet, flow in zip(packets, flows)])
+    elif implementation.is_async:
+        async def batch(packets):
+            return [await function(*packet) for packet in packets]
+    else:
+        def batch(packets):
+            return _settle([function(*packet) for packet in packets])
+
+    return implementation._replace(function=batch)
+
+
+def _unbatched(implementation: HookImplementation) -> HookImplementation:
+    """Adapt a batched hook to the single packet hook signature, passing on a batch of size one."""
+    function = implementation.function
+    if implementation.takes_flow and implementation.is_async:
+        async def single(metadata, data, flow=None):
+            return (await function([(metadata, data)], None if flow is None else [flow]))[0]
+    elif implementation.takes_flow:
+        def single(metadata, data, flow=None):
+            return _first(function([(metadata, data)], None if flow is None else [flow]))
+    elif implementation.is_async:
+        async def single(*packet):
+            return (await function([packet]))[0]
+    else:
+        def single(*packet):
+            return _first(function([packet]))
+
+    return implementation._replace(function=single)
+
+
+def _settle(results: list):
+    """The results of a synchronous single packet hook for a batch, or an awaitable of them if the hook returned
+    awaitables, e.g. a coroutine function hidden behind a decorator."""
+    if not any(inspect.isawaitable(result) for result in results):
+        return results
+
+    async def settle():
+        try:
+            return [await result if inspect.isawaitable(result) else result for result in results]
+        finally:
+            # Close the coroutines left over if cancelled, e.g. when exceeding the budget
+            for result in results:
+                if inspect.iscoroutine(result):
+                    result.close()
+    return settle()
+
+
+def _first(results):
+    """The result of a synchronous batched hook for a batch of one packet, or an awaitable of it."""
+    if not inspect.isawaitable(results):
+        return results[0]
+
+    async def first():
+        return (await results)[0]
+    return first()
+
+
+def _takes_flow(name: str, function: Callable[..., Any]) -> bool:
+    """Whether a hook implementation declares the optional flow parameter of the udp hooks. Hooks are only passed the
+    flow if they do, so plugins written before it existed keep working."""
+    if name == "udp_filter_batch":
+        parameter = "flows"
+    elif name in FLOW_HOOKS:
+        parameter = "flow"
+    else:
+        return False
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+    # It is passed positionally
+    return parameter in parameters and parameters[parameter].kind in (inspect.Parameter.POSITIONAL_ONLY,
+                                                                      inspect.Parameter.POSITIONAL_OR_KEYWORD)
 
-        return object.__getattribute__(self, name)
 
-    # Forward plugin calls to all plugins
-    def _delegate_plugin_call(self, name):
-        spec = getattr(PluginBase, name)
+_HOOK_PROTOCOLS = {"tcp": Protocol.TCP, "udp": Protocol.UDP, "other": Protocol.OTHER}
 
-        logger.debug("Executing plugin hook %s", name)
 
-        async def catchall(plugin, awaitable):
+# Extract the (ports, proxy direction, connection direction) a hook call is matched against subscriptions with
+def _tcp_connection_key(connection):
+    return (connection.metadata.dst_port,), connection.metadata.direction, None
+
+
+def _tcp_key(connection, metadata, *_):
+    return (connection.metadata.dst_port,), metadata.direction[0], metadata.direction[1]
+
+
+def _udp_key(metadata, *_):
+    return (metadata.src_port, metadata.dst_port), metadata.direction, None
+
+
+def _udp_flow_key(flow):
+    return (flow.metadata.src_port, flow.metadata.dst_port), flow.metadata.direction, None
+
+
+def _other_key(direction, *_):
+    return (), direction, None
+
+
+def _subscription_key(name):
+    if name in ("tcp_new_connection", "tcp_connection_closed"):
+        return _tcp_connection_key
+    if name in ("udp_flow_new", "udp_flow_expired"):
+        return _udp_flow_key
+    return {"tcp": _tcp_key, "udp": _udp_key, "other": _other_key}[name.split("_", 1)[0]]
+
+
+async def _timed(stats: HookStats, awaitable):
+    start = perf_counter()
+    try:
+        return await awaitable
+    finally:
+        stats.duration.observe(perf_counter() - start)
+
+
+# Forward plugin calls to all plugins
+def _make_dispatcher(name):
+    key = _subscription_key(name)
+    flow_index = FLOW_HOOKS.get(name)
+
+    async def dispatcher(self, *args):
+        table = self._hooks[name]
+        # Skip plugins not subscribed to this traffic without ever calling them
+        implementations = table.select(*key(*args)) if table.subscribed else table.implementations
+        # Plugins not declaring the flow parameter are called without it
+        plain_args = args[:flow_index] if flow_index is not None else args
+
+        if table.gather:
+            # If the function is annotated to never return anything other than None, execute all plugins. Synchronous
+            # hooks run inline, only coroutines are gathered.
+            pending = []
+            for implementation in implementations:
+                _, function, is_async, _, stats, takes_flow = implementation
+                start = perf_counter()
+                try:
+                    if is_async:
+                        pending.append((implementation, function(*(args if takes_flow else plain_args))))
+                        continue
+                    elif inspect.isawaitable(ret := function(*(args if takes_flow else plain_args))):
+                        # e.g. a coroutine function hidden behind a decorator
+                        pending.append((implementation, ret))
+                        continue
+                except Exception as e:
+                    self._hook_failed(implementation, e)
+                stats.duration.observe(perf_counter() - start)
+
+            if len(pending) == 1:
+                implementation, awaitable = pending[0]
+                start = perf_counter()
+                try:
+                    await awaitable
+                except Exception as e:
+                    self._hook_failed(implementation, e)
+                finally:
+                    implementation.stats.duration.observe(perf_counter() - start)
+            elif pending:
+                results = await asyncio.gather(*[_timed(implementation.stats, awaitable)
+                                                 for implementation, awaitable in pending], return_exceptions=True)
+                for (implementation, _), result in zip(pending, results):
+                    if isinstance(result, Exception):
+                        self._hook_failed(implementation, result)
+            return None
+
+        # Otherwise, run them until the first not-None result appears. Results arriving after the budget are ignored, to
+        # fail open, except for filter hooks taking the configured action instead.
+        budget = table.budget
+        for implementation in implementations:
+            _, function, is_async, _, stats, takes_flow = implementation
+            call_args = args if takes_flow else plain_args
+            error = None
+            start = perf_counter()
             try:
-                return await awaitable
+                ret = function(*call_args)
+                if is_async or inspect.isawaitable(ret):
+                    ret = await (ret if budget is None else self._await_budgeted(ret, start + budget))
             except Exception as e:
-                logger.error("Error occurred while executing plugin %s, skipping and unloading...", plugin.name)
-                logger.error(traceback.format_exc())
-                self.unload_plugin(plugin.name)
-                return None
-
-        if typing.get_type_hints(spec)["return"] is type(None):
-            # If the function is annotated to never return anything other than None, execute all plugins
-            async def _my_plugin_forwarder(*args, **kwargs):
-                await asyncio.gather(*[catchall(plugin, getattr(plugin, name)(*args, **kwargs))
-                                       for plugin in self._plugins.values() if hasattr(plugin, name)])
-        else:
-            # Otherwise, run them until the first not-None result appears
-            async def _my_plugin_forwarder(*args, **kwargs):
-                for plugin in [x for x in self._plugins.values() if hasattr(x, name)]:
-                    if (ret := await catchall(plugin, getattr(plugin, name)(*args, **kwargs))) is not None:
-                        return ret
-                # If no plugin is implemented or all plugins return None, run a default implementation
-                return await getattr(self._default_plugin, name)(*args, **kwargs)
-
-        return _my_plugin_forwarder
+                error = e
+            duration = perf_counter() - start
+            stats.duration.observe(duration)
+            if budget is not None and duration > budget:
+                self._budget_exceeded(implementation, duration)
+                if self._budgets.fails_closed(name):
+                    return self._budgets.filter_timeout, args[FILTER_DATA[name]]
+            elif error is not None:
+                self._hook_failed(implementation, error)
+            elif ret is not None:
+                return ret
+        # If no plugin is implemented or all plugins return None, run a default implementation
+        return await table.default(*args)
+
+    dispatcher.__name__ = dispatcher.__qualname__ = name
+    return dispatcher
+
+
+_DISPATCHERS = {name: _make_dispatcher(name) for name in HOOK_NAMES}
+
+# Forward every remaining hook through its dispatch table
+for _name, _dispatcher in _DISPATCHERS.items():
+    if _name not in vars(PluginManager):
+        setattr(PluginManager, _name, _dispatcher)
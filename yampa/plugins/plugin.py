@@ -1,8 +1,14 @@
+import glob
+import hashlib
 import logging
+import os
+import sys
 import traceback
 from importlib import import_module, reload
+from types import ModuleType
 
 from .base import PluginBase
+from .worker import WorkerPlugin
 
 logger = logging.getLogger(__name__)
 
@@ -12,17 +18,21 @@ class Plugin(PluginBase):
         self._name = name
         self._module = None
         self._impl: PluginBase | None = None
+        self._fingerprint: dict[str, str | None] | None = None
 
     @property
     def name(self):
         return self._name
 
-    def load(self):
+    async def load(self):
         try:
             self._module = import_module(f"plugins.{self._name}")
             # Need to also reload in case a plugin was unloaded and loaded again
-            reload(self._module)
-            self._impl = self._module.constructor()
+            _reload_module(self._module)
+            # Taken from the reloaded module, whose RELOAD_DEPENDENCIES might have changed, before the constructor reads
+            # them
+            self._fingerprint = _fingerprint(self._module)
+            self._set_impl(await self._construct())
             return True
         except Exception as e:
             logger.error("Error occurred while reloading plugin %s", self._name)
@@ -34,27 +44,65 @@ class Plugin(PluginBase):
             logging.warning("Unloaded a plugin before it was loaded: %s", self._name)
             return False
 
+        self._set_impl(None)
         return True
 
-    def reload(self):
+    async def reloaded(self) -> "Plugin | None":
+        """Load the current code of this plugin into a new Plugin, leaving this one untouched. This one can then keep
+        running until the new one takes over.
+
+        :returns: The new Plugin, or None if the plugin declares no reload or loading it failed.
+        :rtype: Plugin | None
+        """
         if self._module is None:
-            return self.load()
+            plugin = Plugin(self._name)
+            return plugin if await plugin.load() else None
 
         try:
             if self._module.DO_NOT_RELOAD:
                 logger.info("Not reloading plugin %s because it declares no reload", self._name)
-                return False
+                return None
         except AttributeError:
             pass
 
         try:
-            reload(self._module)
-            self._impl = self._module.constructor()
-            return True
+            plugin = Plugin(self._name)
+            plugin._module = self._module
+            _reload_module(self._module)
+            plugin._fingerprint = _fingerprint(self._module)
+            plugin._set_impl(await plugin._construct())
+            return plugin
         except Exception as e:
             logger.error("Error occurred while reloading plugin %s", self._name)
             logger.error(traceback.format_exc())
-            return False
+            return None
+
+    def changed(self) -> bool:
+        """:returns: Whether the source code of the plugin, including all modules of a plugin package, or any of the
+            data files it declares in `RELOAD_DEPENDENCIES` changed since it was loaded.
+        :rtype: bool
+        """
+        return self._module is None or _fingerprint(self._module) != self._fingerprint
+
+    async def _construct(self) -> PluginBase:
+        processes = getattr(self._module, "WORKER_PROCESSES", 0)
+        if processes > 0:
+            logger.info("... starting %d worker processes for %s", processes, self._name)
+            return await WorkerPlugin.create(self._module.__name__, processes)
+        return self._module.constructor()
+
+    def _set_impl(self, impl: PluginBase | None):
+        if isinstance(self._impl, WorkerPlugin):
+            self._impl.close()
+        self._impl = impl
+
+    def implementation(self, name):
+        """:returns: The bound hook `name` of the plugin implementation, or None if the implementation does not define
+            it (see `PluginBase` on which hooks are considered defined).
+        """
+        if self._impl is None or name not in self._impl.__class__.__dict__:
+            return None
+        return getattr(self._impl, name)
 
     # Forward inherited methods to the Plugin impl
     def __getattribute__(self, name):
@@ -63,3 +111,52 @@ class Plugin(PluginBase):
                 return getattr(self._impl, name)
 
         return object.__getattribute__(self, name)
+
+
+# Digests of files by path, along with the (mtime, size) they were computed for
+_digests: dict[str, tuple[tuple[int, int], str]] = {}
+
+
+def _digest(path: str) -> str | None:
+    """Hash the contents of `path`, only reading files whose mtime or size changed since the last call."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _digests.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _digests[path] = (key, digest)
+    return digest
+
+
+def _fingerprint(module: ModuleType) -> dict[str, str | None]:
+    """Digests of all source files of a plugin module or package and of the data files it depends on. Content is
+    compared instead of mtimes alone, so touching or re-copying an unchanged file does not trigger a reload."""
+    if hasattr(module, "__path__"):
+        paths = []
+        for directory in module.__path__:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [x for x in dirs if not x.startswith(".") and x != "__pycache__"]
+                paths += [os.path.join(root, x) for x in files if x.endswith(".py")]
+    else:
+        paths = [module.__file__]
+
+    # Data files plugins read in their constructor, e.g. `RELOAD_DEPENDENCIES = ["./rules/*.rls"]`
+    for pattern in getattr(module, "RELOAD_DEPENDENCIES", []):
+        paths += glob.glob(pattern, recursive=True)
+
+    return {path: _digest(path) for path in sorted(paths)}
+
+
+def _reload_module(module: ModuleType):
+    # Submodules of a package are not reloaded along with it, so drop them to have the package import them again
+    prefix = module.__name__ + "."
+    for name in [x for x in sys.modules if x.startswith(prefix)]:
+        del sys.modules[name]
+    reload(module)
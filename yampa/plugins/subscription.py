@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterable
+
+from ..shared import ProxyDirection, ConnectionDirection, Protocol
+
+
+def _freeze(values) -> frozenset | None:
+    if values is None:
+        return None
+    if isinstance(values, (int, Enum)):
+        return frozenset([values])
+    return frozenset(values)
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """Declares which traffic a plugin is interested in. Hooks of a plugin are only called for traffic matching its
+    subscription, everything else is skipped by the `PluginManager` before the hook is even called.
+
+    Every field restricts the matching traffic, leaving a field as None matches anything. Each field accepts either a
+    single value or any iterable of values.
+
+    :param ports: The service ports to match. A tcp connection matches if the port it was opened to (that is,
+        `connection.metadata.dst_port`) is listed, for both directions of the connection. A udp packet matches if
+        either its source or destination port is listed. Other packets have no ports and never match if ports are set.
+    :param proxy_directions: The ProxyDirection to match. This is the direction of the individual packet, with
+        `tcp_new_connection`, `tcp_connection_closed`, `udp_flow_new` and `udp_flow_expired` using the direction the
+        connection or flow was opened in.
+    :param connection_directions: The ConnectionDirection of tcp packets to match. This does not restrict
+        `tcp_new_connection` and `tcp_connection_closed` or any non-tcp hook.
+    :param protocols: The protocols to match, deciding which of the `tcp_*`, `udp_*` and `other_*` hooks are called.
+    """
+    ports: int | Iterable[int] | None = None
+    proxy_directions: ProxyDirection | Iterable[ProxyDirection] | None = None
+    connection_directions: ConnectionDirection | Iterable[ConnectionDirection] | None = None
+    protocols: Protocol | Iterable[Protocol] | None = None
+
+    def __post_init__(self):
+        for field in ("ports", "proxy_directions", "connection_directions", "protocols"):
+            object.__setattr__(self, field, _freeze(getattr(self, field)))
+
+    def matches(self, protocol: Protocol, ports: tuple[int, ...], proxy_direction: ProxyDirection,
+                connection_direction: ConnectionDirection | None = None) -> bool:
+        if self.protocols is not None and protocol not in self.protocols:
+            return False
+        if self.ports is not None and not any(port in self.ports for port in ports):
+            return False
+        if self.proxy_directions is not None and proxy_direction not in self.proxy_directions:
+            return False
+        if connection_direction is not None and self.connection_directions is not None \
+                and connection_direction not in self.connection_directions:
+            return False
+        return True
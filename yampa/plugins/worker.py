@@ -0,0 +1,486 @@
+import asyncio
+import concurrent.futures
+import inspect
+import itertools
+import logging
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, NamedTuple
+from weakref import WeakKeyDictionary
+
+from .base import PluginBase
+from ..proxy.stream import WrapperStream
+from ..shared import Metadata, Context
+
+logger = logging.getLogger(__name__)
+
+# All hooks defined by PluginBase
+_HOOK_NAMES = tuple(name for name, value in vars(PluginBase).items() if not name.startswith("_") and callable(value))
+# Index of the connection or flow in the arguments of the hooks taking one, which is replaced by a stand-in
+_STAND_IN_INDEX = {"tcp_new_connection": 0, "tcp_decrypt": 0, "tcp_filter": 0, "tcp_encrypt": 0, "tcp_log": 0,
+                   "tcp_connection_closed": 0, "udp_flow_new": 0, "udp_flow_expired": 0,
+                   "udp_decrypt": 2, "udp_filter": 2, "udp_encrypt": 2, "udp_log": 3}
+# Hooks after which workers forget the connection or flow. They are always forwarded, even if the plugin does not
+# define them.
+_CLOSING_HOOKS = ("tcp_connection_closed", "udp_flow_expired")
+# Hooks the workers set up a connection or flow for again, along with its current extra
+_OPENING_HOOKS = ("tcp_new_connection", "udp_flow_new")
+
+
+class _SharedBytes(NamedTuple):
+    """Reference to a payload placed in the shared memory segment of a worker instead of being pickled."""
+    offset: int
+    length: int
+
+
+class _ConnectionRef(NamedTuple):
+    """Picklable stand-in for a ProxyConnection, identifying it across calls by a number unique to the connection."""
+    id: int
+    metadata: Metadata
+    # Only sent along when the worker first sees the connection
+    extra: dict[str, Any] | None
+    released: bool
+
+
+class _FlowRef(NamedTuple):
+    """Picklable stand-in for a UdpFlow, identifying it across calls by a number unique to the flow."""
+    id: int
+    metadata: Metadata
+    # Only sent along when the worker first sees the flow
+    extra: dict[str, Any] | None
+    context: Context
+
+
+class _ContextRef(NamedTuple):
+    """Picklable stand-in for a Context, holding the traffic of both directions."""
+    capacity: int
+    data: dict
+
+
+class RemoteConnection:
+    """The view of a ProxyConnection inside a worker process. The same object is passed to every hook call for the same
+    connection, so it can be used as a key for per-connection state like a ProxyConnection. Changes to `extra` and
+    releasing the connection are synchronized back to the ProxyConnection after each hook call."""
+
+    def __init__(self, metadata: Metadata, extra: dict[str, Any], released: bool):
+        self._metadata = metadata
+        self._released = released
+        self.extra = extra
+
+    @property
+    def metadata(self) -> Metadata:
+        return self._metadata
+
+    @property
+    def released(self) -> bool:
+        return self._released
+
+    def release(self):
+        """Stop inspecting the traffic of this connection once the hook call returns, see `ProxyConnection.release`."""
+        self._released = True
+
+    def wrap(self, streams):
+        # Plugins defining wrapper streams are rejected when loading, see `WorkerPlugin.create`
+        raise NotImplementedError("Connections can not be wrapped by plugins running in worker processes")
+
+
+class RemoteFlow:
+    """The view of a UdpFlow inside a worker process. The same object is passed to every hook call for the same flow,
+    so it can be used as a key for per-flow state like a UdpFlow. Changes to `extra` are synchronized back to the
+    UdpFlow after each hook call."""
+
+    def __init__(self, metadata: Metadata, extra: dict[str, Any], context: Context):
+        self._metadata = metadata
+        self._context = context
+        self.extra = extra
+
+    @property
+    def metadata(self) -> Metadata:
+        return self._metadata
+
+    @property
+    def context(self) -> Context:
+        """The context of the flow as of the current hook call."""
+        return self._context
+
+
+class WorkerPlugin(PluginBase):
+    """Hosts a plugin in a pool of worker processes, to use more than a single core for CPU-heavy plugin logic.
+
+    A plugin module opts into this by declaring `WORKER_PROCESSES = <number of processes>`. Every worker process imports
+    the plugin module and calls its `constructor`, hook calls are then forwarded to the workers. All calls for one tcp
+    connection or udp flow go to the same worker, so plugins can keep per-connection state as usual. Payloads are
+    passed through a shared memory segment per worker instead of being pickled.
+
+    Use `create` to instantiate this, which returns a subclass defining exactly the hooks the plugin defines.
+    """
+
+    # Number of payloads per worker that can be in flight in shared memory, and the maximum size of all payloads of a
+    # single call. Calls exceeding either fall back to pickling their payloads.
+    SLOTS = 64
+    SLOT_SIZE = 64 * 1024
+
+    def __init__(self, module_name: str, processes: int):
+        context = multiprocessing.get_context("spawn")
+        self._module_name = module_name
+        self._memory = [SharedMemory(create=True, size=self.SLOTS * self.SLOT_SIZE) for _ in range(processes)]
+        self._free_slots = [list(range(self.SLOTS)) for _ in range(processes)]
+        self._executors = [ProcessPoolExecutor(1, context, _worker_init, (module_name, memory.name))
+                           for memory in self._memory]
+        self._round_robin = itertools.cycle(range(processes))
+        # The hooks the hosted plugin defines
+        self._hooks: frozenset[str] = frozenset()
+        # Numbers identifying the connections and flows in the workers, as `id` values are reused once they are gone
+        self._ids: WeakKeyDictionary[Any, int] = WeakKeyDictionary()
+        self._next_id = itertools.count()
+        # Calls submitted to the workers that are not done yet
+        self._in_flight: set[concurrent.futures.Future] = set()
+
+    @classmethod
+    async def create(cls, module_name: str, processes: int) -> "WorkerPlugin":
+        """Start the worker processes for `module_name` and wait for all of them to construct the plugin, without
+        blocking the event loop meanwhile."""
+        plugin = cls(module_name, processes)
+        try:
+            descriptions = await asyncio.gather(*[asyncio.wrap_future(executor.submit(_worker_describe, module_name))
+                                                  for executor in plugin._executors])
+            if any(description != descriptions[0] for description in descriptions):
+                raise RuntimeError(f"The worker processes of {module_name} disagree on the hooks or subscription of "
+                                   f"the plugin")
+            hooks, flow_hooks, subscription, wraps = descriptions[0]
+            if wraps:
+                raise RuntimeError(f"{module_name} defines wrapper streams, but connections can not be wrapped by "
+                                   f"plugins running in worker processes, as their streams stay in the proxy. Remove "
+                                   f"WORKER_PROCESSES from it.")
+        except BaseException:
+            plugin.close()
+            raise
+
+        # Only hooks in the class dict of a plugin are called, so swap in a subclass defining exactly the hooks of the
+        # hosted plugin. Closing connections and expiring flows is always forwarded, for the workers to forget them.
+        namespace = {name: _make_forwarder(name, name in flow_hooks) for name in {*hooks, *_CLOSING_HOOKS}}
+        namespace["subscription"] = subscription
+        plugin._hooks = frozenset(hooks)
+        plugin.__class__ = type(f"{cls.__name__}[{module_name}]", (cls,), namespace)
+        return plugin
+
+    def close(self):
+        """Shut down the worker processes once the calls in flight are done, e.g. the ones for traffic that was still
+        being processed when the plugin was reloaded, without blocking meanwhile."""
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        in_flight = list(self._in_flight)
+        if in_flight:
+            threading.Thread(target=self._release_memory, args=(in_flight,), daemon=True).start()
+        else:
+            self._release_memory([])
+
+    def _release_memory(self, in_flight: list[concurrent.futures.Future]):
+        # The workers read the payloads of calls from the shared memory until they are done
+        concurrent.futures.wait(in_flight)
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+
+    def _worker(self, name: str, args: tuple) -> int:
+        """Select the worker for a call, keeping all calls of a tcp connection or udp flow on the same worker."""
+        if name.startswith("tcp_"):
+            return hash(args[0]) % len(self._executors)
+        if name in ("udp_flow_new", "udp_flow_expired"):
+            return _flow_hash(args[0].metadata) % len(self._executors)
+        if name.startswith("udp_"):
+            metadata = args[0] if name != "udp_filter_batch" else args[0][0][0]
+            return _flow_hash(metadata) % len(self._executors)
+        return next(self._round_robin)
+
+    async def _call(self, name: str, args: tuple):
+        if name == "udp_filter_batch":
+            return await self._call_batch(name, *args)
+
+        worker = self._worker(name, args)
+        index = _STAND_IN_INDEX.get(name)
+        value = args[index] if index is not None and index < len(args) else None
+        stand_ins = {}
+        if value is not None:
+            if value not in self._ids and name not in self._hooks:
+                # Closing a connection or flow the workers never saw
+                return None
+            args = args[:index] + (self._stand_in(name, value, stand_ins),) + args[index + 1:]
+
+        try:
+            ret, changes = await self._submit(worker, name, args)
+        finally:
+            if name in _CLOSING_HOOKS:
+                self._ids.pop(value, None)
+        _apply_changes(changes, stand_ins)
+        return ret
+
+    async def _call_batch(self, name: str, packets: list[tuple[Metadata, bytes]], flows: list | None = None):
+        # Split the batch by worker to keep flow affinity, and run the parts in parallel
+        parts: dict[int, list[int]] = {}
+        for i, (metadata, _) in enumerate(packets):
+            parts.setdefault(_flow_hash(metadata) % len(self._executors), []).append(i)
+
+        stand_ins = {}
+        calls = []
+        for worker, indices in parts.items():
+            args = ([packets[i] for i in indices],)
+            if flows is not None:
+                args += ([None if flows[i] is None else self._stand_in(name, flows[i], stand_ins) for i in indices],)
+            calls.append(self._submit(worker, name, args))
+
+        results = [None] * len(packets)
+        rets = await asyncio.gather(*calls)
+        for indices, (ret, changes) in zip(parts.values(), rets):
+            _apply_changes(changes, stand_ins)
+            for i, result in zip(indices, ret):
+                results[i] = result
+        return results
+
+    def _stand_in(self, name: str, value, stand_ins: dict[int, Any]) -> _ConnectionRef | _FlowRef:
+        """Replace a ProxyConnection or UdpFlow by a stand-in identifying it in the workers, and remember it in
+        `stand_ins` by that number."""
+        number = self._ids.get(value)
+        first = number is None
+        if first:
+            number = self._ids[value] = next(self._next_id)
+        stand_ins[number] = value
+        # Only send extra along when the worker sees this connection or flow for the first time
+        extra = value.extra if first or name in _OPENING_HOOKS else None
+        if name.startswith("tcp_"):
+            return _ConnectionRef(number, value.metadata, extra, value.released)
+        return _FlowRef(number, value.metadata, extra, value.context)
+
+    async def _submit(self, worker: int, name: str, args: tuple):
+        free_slots = self._free_slots[worker]
+        slot = free_slots.pop() if free_slots else None
+        encoded = args
+        try:
+            if slot is not None:
+                buffer = self._memory[worker].buf[slot * self.SLOT_SIZE:(slot + 1) * self.SLOT_SIZE]
+                try:
+                    encoded, _ = _encode(args, buffer, slot * self.SLOT_SIZE, 0)
+                except _SlotFull:
+                    free_slots.append(slot)
+                    slot = None
+                finally:
+                    buffer.release()
+            future = self._executors[worker].submit(_worker_call, name, encoded)
+        except BaseException:
+            if slot is not None:
+                free_slots.append(slot)
+            raise
+
+        self._in_flight.add(future)
+        future.add_done_callback(self._in_flight.discard)
+        if slot is not None:
+            # The worker only reads the payload once the call runs, which it might still do after the caller was
+            # cancelled, so the slot is only freed once the call itself is done
+            loop = asyncio.get_running_loop()
+            future.add_done_callback(lambda _: _call_soon(loop, free_slots.append, slot))
+        return await asyncio.wrap_future(future)
+
+
+def _make_forwarder(name: str, takes_flow: bool):
+    # Hooks taking a flow have to declare it, for the plugin manager to pass it
+    if takes_flow and name == "udp_filter_batch":
+        async def forwarder(self: WorkerPlugin, packets, flows=None):
+            return await self._call(name, (packets, flows))
+    elif takes_flow and _STAND_IN_INDEX[name] == 2:
+        async def forwarder(self: WorkerPlugin, metadata, data, flow=None):
+            return await self._call(name, (metadata, data, flow))
+    elif takes_flow:
+        async def forwarder(self: WorkerPlugin, metadata, data, action, flow=None):
+            return await self._call(name, (metadata, data, action, flow))
+    else:
+        async def forwarder(self: WorkerPlugin, *args):
+            return await self._call(name, args)
+
+    forwarder.__name__ = forwarder.__qualname__ = name
+    return forwarder
+
+
+def _apply_changes(changes: dict[int, tuple[dict[str, Any], list[str], bool]], stand_ins: dict[int, Any]):
+    """Apply the changes a plugin made to the stand-ins of connections and flows in a worker to the real ones."""
+    for number, (changed, deleted, released) in changes.items():
+        value = stand_ins[number]
+        value.extra.update(changed)
+        for key in deleted:
+            value.extra.pop(key, None)
+        if released:
+            value.release()
+
+
+def _call_soon(loop: asyncio.AbstractEventLoop, callback, *args):
+    # Called from the thread managing the worker process
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        # The event loop is closed, so there is nothing left to free
+        pass
+
+
+def _flow_hash(metadata: Metadata) -> int:
+    # Both directions of a flow hash the same
+    a, b = (metadata.src_ip, metadata.src_port), (metadata.dst_ip, metadata.dst_port)
+    return hash((a, b) if a < b else (b, a))
+
+
+class _SlotFull(Exception):
+    pass
+
+
+def _encode(value, buffer: memoryview, base: int, offset: int):
+    """Place all bytes in `value` into `buffer`, replacing them by references. Returns the encoded value and the new
+    offset into `buffer`."""
+    if isinstance(value, (bytes, memoryview)):
+        end = offset + len(value)
+        if end > len(buffer):
+            raise _SlotFull()
+        buffer[offset:end] = value
+        return _SharedBytes(base + offset, len(value)), end
+    if isinstance(value, Context):
+        data, offset = _encode({direction: value.view(direction) for direction in value}, buffer, base, offset)
+        return _ContextRef(value.capacity, data), offset
+    if isinstance(value, _FlowRef):
+        context, offset = _encode(value.context, buffer, base, offset)
+        return value._replace(context=context), offset
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        encoded = []
+        for item in value:
+            item, offset = _encode(item, buffer, base, offset)
+            encoded.append(item)
+        return tuple(encoded), offset
+    if isinstance(value, list):
+        encoded = []
+        for item in value:
+            item, offset = _encode(item, buffer, base, offset)
+            encoded.append(item)
+        return encoded, offset
+    if isinstance(value, dict):
+        encoded = {}
+        for key, item in value.items():
+            encoded[key], offset = _encode(item, buffer, base, offset)
+        return encoded, offset
+    return value, offset
+
+
+# State of a worker process
+
+_plugin: PluginBase | None = None
+_memory: SharedMemory | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+# The stand-ins of the connections and flows the worker knows, by their number
+_remotes: dict[int, RemoteConnection | RemoteFlow] = {}
+# The pickled values of the extra of every connection and flow as the parent process knows it, by key
+_extras: dict[int, dict[str, bytes]] = {}
+
+
+def _worker_init(module_name: str, memory_name: str):
+    global _plugin, _memory, _loop
+
+    logging.basicConfig(encoding='utf-8', level=logging.INFO)
+
+    # Spawned processes share the resource tracker of the parent, which unlinks the segment on close
+    _memory = SharedMemory(memory_name)
+
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+
+    async def construct():
+        # Constructors may create tasks, so run them inside the event loop
+        return import_module(module_name).constructor()
+
+    _plugin = _loop.run_until_complete(construct())
+
+
+def _worker_describe(module_name: str):
+    # Imported here, as the plugin manager imports this module
+    from .manager import _takes_flow
+
+    hooks = [name for name in _HOOK_NAMES if name in _plugin.__class__.__dict__]
+    flow_hooks = [name for name in hooks if _takes_flow(name, getattr(_plugin, name))]
+    wraps = [name for name, value in vars(import_module(module_name)).items()
+             if isinstance(value, type) and issubclass(value, WrapperStream) and value is not WrapperStream]
+    return hooks, flow_hooks, _plugin.subscription, wraps
+
+
+def _decode(value):
+    if isinstance(value, _SharedBytes):
+        return bytes(_memory.buf[value.offset:value.offset + value.length])
+    if isinstance(value, _ContextRef):
+        context = Context(value.capacity)
+        for direction, data in value.data.items():
+            context.append(direction, _decode(data))
+        return context
+    if isinstance(value, _FlowRef):
+        return value._replace(context=_decode(value.context))
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return tuple(_decode(item) for item in value)
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _decode(item) for key, item in value.items()}
+    return value
+
+
+def _worker_call(name: str, args: tuple):
+    args = tuple(_decode(arg) for arg in args)
+
+    # The stand-ins are the top level arguments, or in the list of flows of a batch, which might hold a flow repeatedly
+    refs: dict[int, _ConnectionRef | _FlowRef] = {}
+
+    def resolve(value):
+        if isinstance(value, list):
+            return [resolve(item) for item in value]
+        if not isinstance(value, (_ConnectionRef, _FlowRef)):
+            return value
+        refs.setdefault(value.id, value)
+        if value.extra is not None or value.id not in _remotes:
+            if isinstance(value, _ConnectionRef):
+                _remotes[value.id] = RemoteConnection(value.metadata, dict(value.extra or {}), value.released)
+            else:
+                _remotes[value.id] = RemoteFlow(value.metadata, dict(value.extra or {}), value.context)
+            _extras[value.id] = _pickle_items(_remotes[value.id].extra)
+        elif isinstance(value, _ConnectionRef):
+            _remotes[value.id]._released |= value.released
+        else:
+            _remotes[value.id]._context = value.context
+        return _remotes[value.id]
+
+    args = tuple(resolve(arg) for arg in args)
+
+    try:
+        ret = None
+        # Closing connections and expiring flows is forwarded even if the plugin does not define the hook
+        if name in _plugin.__class__.__dict__:
+            ret = getattr(_plugin, name)(*args)
+            if inspect.isawaitable(ret):
+                ret = _loop.run_until_complete(ret)
+    finally:
+        changes = {}
+        for ref in refs.values():
+            remote = _remotes.get(ref.id)
+            if remote is None:
+                continue
+            # Only send back the keys of extra the plugin set or deleted
+            pickled = _pickle_items(remote.extra)
+            known = _extras[ref.id]
+            released = isinstance(remote, RemoteConnection) and remote.released and not ref.released
+            if pickled != known or released:
+                changed = {key: remote.extra[key] for key, value in pickled.items() if known.get(key) != value}
+                changes[ref.id] = changed, [key for key in known if key not in pickled], released
+                _extras[ref.id] = pickled
+            if name in _CLOSING_HOOKS:
+                del _remotes[ref.id]
+                del _extras[ref.id]
+
+    return ret, changes
+
+
+def _pickle_items(extra: dict[str, Any]) -> dict[str, bytes]:
+    return {key: pickle.dumps(value) for key, value in extra.items()}
@@ -1,4 +1,12 @@
 from .connection import ProxyConnection
 from .proxy import Proxy
+from .front import ProxyFront
 from .config import load_config, ProxyConfig, WireguardConfig
 from .stream import ProxyStream, WrapperStream
+from .log_queue import LogQueue, OverflowPolicy
+from .connection_table import ConnectionTable, EvictionPolicy
+from .timing_wheel import TimingWheel
+from .udp_flow import UdpFlow, UdpFlowTable
+from .scheduler import PacketScheduler
+from .profiler import SamplingProfiler
+from .event_loop import EventLoop
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import traceback
+from typing import Awaitable, Callable, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Batcher(Generic[T]):
+    """Collects items into batches, handing a batch to `handler` once it holds `size` items or `delay` seconds after its
+    first item arrived. With a delay of 0, a batch holds all items submitted within the same event loop iteration."""
+
+    def __init__(self, handler: Callable[[list[T]], Awaitable[None]], size: int, delay: float):
+        self._handler = handler
+        self._size = size
+        self._delay = delay
+        self._pending: list[T] = []
+        self._timer: asyncio.Handle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, item: T):
+        self._pending.append(item)
+
+        if len(self._pending) >= self._size:
+            self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            if self._delay > 0:
+                self._timer = loop.call_later(self._delay, self.flush)
+            else:
+                self._timer = loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch = self._pending
+        self._pending = []
+
+        # Keep a reference to the task, the event loop only keeps weak ones
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[T]):
+        try:
+            await self._handler(batch)
+        except Exception:
+            logger.error("Error occurred while handling a batch")
+            logger.error(traceback.format_exc())
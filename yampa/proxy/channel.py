@@ -0,0 +1,67 @@
+import asyncio
+import struct
+from enum import IntEnum
+
+
+class MessageType(IntEnum):
+    # front -> worker: a new tcp connection with flow id `flow`, `arg` is the server to forward it to, the body the
+    # pickled (src_addr, dst_addr)
+    TCP_OPEN = 1
+    # both ways: payload of side `arg` of a tcp connection
+    TCP_DATA = 2
+    # front -> worker: side `arg` of a tcp connection closed for reading. worker -> front: write eof to side `arg`
+    TCP_EOF = 3
+    # worker -> front: close side `arg` of a tcp connection
+    TCP_CLOSE = 4
+    # front -> worker: the body (a 64-bit integer) bytes written to side `arg` of a tcp connection were sent
+    TCP_ACK = 5
+    # worker -> front: the tcp connection is done for good
+    TCP_DONE = 6
+    # both ways: a udp datagram arriving at / to be sent by server `arg`, the body the pickled
+    # (data, src_addr, dst_addr)
+    UDP = 7
+    # both ways: another packet arriving at / to be sent by server `arg`, the body the packet
+    OTHER = 8
+    # front -> worker: reload the plugins
+    RELOAD = 9
+    # front -> worker: start profiling, the body the name of the profile
+    PROFILE = 10
+
+
+class Channel:
+    """Framed messages between the front process and a worker process over a stream socket. Every message is a header
+    of (body length, type, flow id, argument) followed by the body, which is the raw payload for the hot paths."""
+    HEADER = struct.Struct("!IBQB")
+    ACK = struct.Struct("!Q")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, sock) -> "Channel":
+        return cls(*await asyncio.open_unix_connection(sock=sock))
+
+    def send(self, kind: MessageType, flow: int = 0, arg: int = 0, body: bytes = b""):
+        self._writer.writelines((self.HEADER.pack(len(body), kind, flow, arg), body))
+
+    @property
+    def buffered(self) -> int:
+        """:returns: The number of bytes sent but not yet written to the socket."""
+        return self._writer.transport.get_write_buffer_size()
+
+    async def drain(self):
+        """Wait while the socket buffer is full, which is how a busy peer slows the other side down."""
+        await self._writer.drain()
+
+    async def receive(self) -> tuple[MessageType, int, int, bytes] | None:
+        """:returns: The next message as (type, flow id, argument, body), or None once the other side closed."""
+        try:
+            length, kind, flow, arg = self.HEADER.unpack(await self._reader.readexactly(self.HEADER.size))
+            body = await self._reader.readexactly(length) if length else b""
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return MessageType(kind), flow, arg, body
+
+    def close(self):
+        self._writer.close()
@@ -3,6 +3,12 @@ from dataclasses import dataclass
 
 import mitmproxy_wireguard as wireguard
 
+from .connection_table import EvictionPolicy
+from .event_loop import EventLoop
+from .log_queue import OverflowPolicy
+from ..plugins.budget import HookBudgets
+from ..shared import FilterAction
+
 
 @dataclass
 class WireguardConfig:
@@ -16,6 +22,58 @@ class WireguardConfig:
 class ProxyConfig:
     network: WireguardConfig
     proxy: WireguardConfig
+    # Number of processes handling traffic, flows are distributed over them by their endpoints. 1 handles everything in
+    # a single process
+    proxy_workers: int
+    # Event loop implementation to run on
+    event_loop: EventLoop
+    # Maximum number of udp packets per direction handled as one batch, 1 disables batching
+    udp_batch_size: int
+    # Time in seconds to wait for further udp packets before handling a batch, 0 only batches packets arriving in the
+    # same event loop iteration
+    udp_batch_delay: float
+    # Where to serve prometheus metrics, either `host:port` or `unix:/path`. Empty to disable
+    metrics_listen: str
+    # Maximum number of log hook calls waiting to be executed, 0 executes them inline before forwarding
+    log_queue_size: int
+    # What to do with log hook calls while the log queue is full
+    log_queue_policy: OverflowPolicy
+    # Number of tasks executing log hook calls in parallel, calls of the same connection or flow stay in order
+    log_workers: int
+    # Number of bytes of previous traffic per direction passed to the filter hooks as context
+    context_size: int
+    # Number of bytes written to a tcp stream that are collected and handed to the transport at once, 0 disables it
+    write_coalesce_size: int
+    # Time in seconds to wait for further writes to a tcp stream, 0 only collects writes of one loop iteration
+    write_coalesce_delay: float
+    # Number of bytes written to a tcp stream after which writing waits for the transport to drain, 0 after every write
+    write_high_water: int
+    # Maximum number of open tcp connections, 0 for no limit
+    max_connections: int
+    # Which connection to close when opening one more than `max_connections`
+    connection_eviction: EvictionPolicy
+    # Time in seconds after which tcp connections without traffic are closed, 0 to keep them open
+    idle_timeout: float
+    # Time in seconds after which tcp connections are closed, no matter their traffic, 0 to keep them open
+    connection_lifetime: float
+    # Maximum number of tracked udp flows, 0 for no limit
+    max_udp_flows: int
+    # Time in seconds after which udp flows without packets expire, 0 to keep them until evicted
+    udp_idle_timeout: float
+    # Number of bytes of previous packets per direction kept as the context of a udp flow, 0 disables it
+    udp_context_size: int
+    # Maximum number of udp and other packets queued or being handled at a time, 0 for no limit
+    max_pending_packets: int
+    # Maximum number of those packets from the same remote peer, 0 for no limit
+    max_pending_per_source: int
+    # Directory profiles are written to
+    profile_dir: str
+    # Time in seconds a profile samples the proxy for
+    profile_duration: float
+    # Time in seconds between the samples of a profile
+    profile_interval: float
+    # Latency budgets of plugin hooks
+    hook_budgets: HookBudgets
 
     def __init__(self, e):
         network_own_private = e["NETWORK_OWN_PRIVATE"]
@@ -37,6 +95,42 @@ class ProxyConfig:
 
         self.proxy = WireguardConfig(proxy_own_private, proxy_own_public, proxy_peer_public, proxy_peer_endpoint)
 
+        self.proxy_workers = int(e.get("PROXY_WORKERS", 1))
+        self.event_loop = EventLoop(e.get("EVENT_LOOP", EventLoop.AUTO.value))
+        self.udp_batch_size = int(e.get("UDP_BATCH_SIZE", 1))
+        self.udp_batch_delay = float(e.get("UDP_BATCH_DELAY", 0))
+        self.metrics_listen = e.get("METRICS_LISTEN", "127.0.0.1:9100")
+        self.log_queue_size = int(e.get("LOG_QUEUE_SIZE", 4096))
+        self.log_queue_policy = OverflowPolicy(e.get("LOG_QUEUE_POLICY", OverflowPolicy.BLOCK.value))
+        self.log_workers = int(e.get("LOG_WORKERS", 4))
+        self.context_size = int(e.get("CONTEXT_SIZE", 8192))
+        self.write_coalesce_size = int(e.get("WRITE_COALESCE_SIZE", 65536))
+        self.write_coalesce_delay = float(e.get("WRITE_COALESCE_DELAY", 0))
+        self.write_high_water = int(e.get("WRITE_HIGH_WATER", 262144))
+        self.max_connections = int(e.get("MAX_CONNECTIONS", 65536))
+        self.connection_eviction = EvictionPolicy(e.get("CONNECTION_EVICTION", EvictionPolicy.IDLE.value))
+        self.idle_timeout = float(e.get("IDLE_TIMEOUT", 0))
+        self.connection_lifetime = float(e.get("CONNECTION_LIFETIME", 0))
+        self.max_udp_flows = int(e.get("MAX_UDP_FLOWS", 65536))
+        self.udp_idle_timeout = float(e.get("UDP_IDLE_TIMEOUT", 60))
+        self.udp_context_size = int(e.get("UDP_CONTEXT_SIZE", 4096))
+        self.max_pending_packets = int(e.get("MAX_PENDING_PACKETS", 1024))
+        self.max_pending_per_source = int(e.get("MAX_PENDING_PER_SOURCE", 256))
+        self.profile_dir = e.get("PROFILE_DIR", "./rules")
+        self.profile_duration = float(e.get("PROFILE_DURATION", 30))
+        self.profile_interval = float(e.get("PROFILE_INTERVAL", 0.005))
+
+        # e.g. HOOK_BUDGETS=tcp_filter=0.02,udp_filter_batch=0.05
+        hook_budgets = [x.split("=", 1) for x in e.get("HOOK_BUDGETS", "").split(",") if x.strip()]
+        # Either "ignore" to fail open, or a FilterAction to take on the traffic
+        filter_timeout = e.get("HOOK_BUDGET_FILTER_ACTION", "ignore")
+        self.hook_budgets = HookBudgets(float(e.get("HOOK_BUDGET", 0)) or None,
+                                        {name.strip(): float(budget) for name, budget in hook_budgets},
+                                        int(e.get("HOOK_BUDGET_VIOLATIONS", 5)),
+                                        float(e.get("HOOK_BUDGET_WINDOW", 10)),
+                                        float(e.get("HOOK_BYPASS_DURATION", 30)),
+                                        None if filter_timeout == "ignore" else FilterAction(filter_timeout))
+
 
 def load_config() -> ProxyConfig:
     return ProxyConfig(os.environ)
@@ -1,28 +1,81 @@
 import asyncio
-import dataclasses
 import logging
 from asyncio import Task
+from time import monotonic
 from typing import TYPE_CHECKING, Any
 
 from .stream import ProxyStream, WrapperStream
-from ..shared import Metadata, ConnectionDirection, ProxyDirection, FilterAction
+from ..metrics import BYTES, REJECTS
+from ..shared import Metadata, ConnectionDirection, ProxyDirection, FilterAction, Protocol, Context
+from ..shared.metadata import TCP_DIRECTIONS
 
 if TYPE_CHECKING:
     from ..plugins import PluginManager
+    from .log_queue import LogQueue
 
 logger = logging.getLogger(__name__)
 
+_BYTES = {direction: BYTES.labels(Protocol.TCP.value, direction.value) for direction in ProxyDirection}
+_REJECTS = {direction: REJECTS.labels(Protocol.TCP.value, direction.value) for direction in ProxyDirection}
+
+
+class _ReadSize:
+    """The size of the next read of one direction of a connection. It doubles whenever a read fills it, as in bulk
+    transfers, and drops back to the minimum after a couple of reads in a row using less than a quarter of it, as in
+    interactive traffic."""
+    SHRINK_AFTER = 2
+
+    __slots__ = ("size", "_minimum", "_small")
+
+    def __init__(self, minimum: int):
+        self.size = minimum
+        self._minimum = minimum
+        self._small = 0
+
+    def update(self, n: int, maximum: int):
+        if n >= self.size:
+            self.size = min(2 * self.size, maximum)
+            self._small = 0
+        elif n < self.size // 4:
+            self._small += 1
+            if self._small >= self.SHRINK_AFTER:
+                self.size = self._minimum
+                self._small = 0
+        else:
+            self._small = 0
+
 
 class ProxyConnection:
     BUFFER_SIZE = 8192
+    # Reads start at this size and grow for bulk transfers
+    MIN_READ_SIZE = 4096
+    # Maximum read size for inspected traffic, independently of the context size. Filters get every chunk as a whole,
+    # even if it is longer than the context.
+    MAX_READ_SIZE = 65536
+    # Maximum read size for traffic no plugin inspects, which is forwarded as is
+    SPLICE_BUFFER_SIZE = 262144
 
-    def __init__(self, pm: "PluginManager", streams: dict[ConnectionDirection, ProxyStream],
-                 src_addr: tuple[str, int], dst_addr: tuple[str, int], direction: ProxyDirection):
+    def __init__(self, pm: "PluginManager", log_queue: "LogQueue", streams: dict[ConnectionDirection, ProxyStream],
+                 src_addr: tuple[str, int], dst_addr: tuple[str, int], direction: ProxyDirection,
+                 context_size: int = BUFFER_SIZE):
         self._pm = pm
+        self._log_queue = log_queue
         self._streams: dict[ConnectionDirection, ProxyStream] = streams
         self._tasks: dict[ConnectionDirection, Task] | None = None
-        self._context: dict[ProxyDirection, bytes] = {}
+        self._context = Context(context_size)
         self._metadata = Metadata(src_addr[0], src_addr[1], dst_addr[0], dst_addr[1], direction)
+        # The metadata of the traffic going to either side, passed to every hook call of that direction
+        self._directed_metadata = {
+            ConnectionDirection.TO_SERVER: Metadata(src_addr[0], src_addr[1], dst_addr[0], dst_addr[1],
+                                                    TCP_DIRECTIONS[direction, ConnectionDirection.TO_SERVER]),
+            # Returning traffic, so src and dst are swapped
+            ConnectionDirection.TO_CLIENT: Metadata(dst_addr[0], dst_addr[1], src_addr[0], src_addr[1],
+                                                    TCP_DIRECTIONS[~direction, ConnectionDirection.TO_CLIENT]),
+        }
+        self._released = False
+        # In terms of `time.monotonic`
+        self._opened = monotonic()
+        self._last_activity = self._opened
         self.extra: dict[str, Any] = {}
 
     def init(self):
@@ -34,7 +87,22 @@ class ProxyConnection:
     async def wait_closed(self):
         if self._tasks is None:
             self.init()
-        await asyncio.gather(*self._tasks.values())
+        # Tasks cancelled by `abort` just count as closed
+        for result in await asyncio.gather(*self._tasks.values(), return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+
+    def abort(self):
+        """Close both sides of the connection right away, e.g. once it timed out. `tcp_connection_closed` is still
+        called for it."""
+        for stream in self._streams.values():
+            try:
+                stream.close(True)
+            except OSError:
+                pass
+        if self._tasks is not None:
+            for task in self._tasks.values():
+                task.cancel()
 
     def wrap(self, streams: dict[ConnectionDirection, WrapperStream]):
         """Wrap a connection, taking exclusive control over future writes and reads to the specified stream(s).
@@ -71,6 +139,34 @@ class ProxyConnection:
             self._streams[direction] = new_stream
             new_stream.stream = old_stream
 
+    def release(self):
+        """Stop inspecting the traffic of this connection, forwarding it as is from now on.
+
+        The per-chunk hooks (decrypt, filter, encrypt and log) of all plugins are no longer called for this connection,
+        and its context is no longer tracked. Use this as soon as a plugin knows that a connection is of no interest,
+        e.g. a bulk download, to take it off the slow path. A released connection stays released across reloads.
+        `tcp_connection_closed` is still called once it closes.
+
+        Chunks that are already being processed when releasing still pass through the remaining hooks.
+        """
+        self._released = True
+
+    @property
+    def released(self) -> bool:
+        return self._released
+
+    @property
+    def opened(self) -> float:
+        """:returns: When the connection was opened, in terms of `time.monotonic`.
+        :rtype: float"""
+        return self._opened
+
+    @property
+    def last_activity(self) -> float:
+        """:returns: When the connection last received data from either side, in terms of `time.monotonic`.
+        :rtype: float"""
+        return self._last_activity
+
     @property
     def metadata(self) -> Metadata:
         """:returns: The metadata of the initial packet that started this connection. `direction` here is always just a
@@ -78,23 +174,16 @@ class ProxyConnection:
         :rtype: Metadata"""
         return self._metadata
 
-    async def _read_forward_task(self, to_direction: ConnectionDirection):
-        initial_proxy_direction = self._metadata.direction
-        proxy_direction = initial_proxy_direction if to_direction == ConnectionDirection.TO_SERVER else ~initial_proxy_direction
-
-        if proxy_direction == initial_proxy_direction:
-            metadata = dataclasses.replace(self._metadata, direction=(proxy_direction, to_direction))
-        else:
-            # If it's a returning packet, also swap src and dst
-            metadata = Metadata(self._metadata.dst_ip, self._metadata.dst_port, self._metadata.src_ip,
-                                self._metadata.src_port, (proxy_direction, to_direction))
-
-        self._context[proxy_direction] = b""
+    async def _read(self, to_direction: ConnectionDirection, n: int) -> bytes | None:
+        """Read the next chunk to forward to `to_direction`, closing the connection if the other side closed.
 
+        :returns: The chunk, or None if the connection closed.
+        :rtype: bytes | None
+        """
         while True:
             from_stream = self._streams[~to_direction]
             try:
-                data = await from_stream.read(self.BUFFER_SIZE)
+                data = await from_stream.read(n)
                 # If read got interrupted, reset the interrupt and start loop again, using new stream
                 if from_stream.interrupted:
                     from_stream.reset_interrupt()
@@ -110,18 +199,72 @@ class ProxyConnection:
                     self._streams[to_direction].close()
                 except OSError:
                     pass
-                return
+                return None
+            self._last_activity = monotonic()
+            return data
+
+    async def _splice(self, to_direction: ConnectionDirection, metadata: Metadata, received,
+                      read_size: _ReadSize) -> bytes | None:
+        """Forward traffic to `to_direction` as is with large reads, until the connection closes or, unless it was
+        released, a change of the loaded plugins makes a plugin inspect it.
+
+        :returns: The first chunk read after a plugin started inspecting the traffic, which was not forwarded yet, or
+            None if the connection closed.
+        :rtype: bytes | None
+        """
+        generation = self._pm.generation
+        while (data := await self._read(to_direction, read_size.size)) is not None:
+            received.inc(len(data))
+            read_size.update(len(data), self.SPLICE_BUFFER_SIZE)
+            if generation != self._pm.generation:
+                generation = self._pm.generation
+                if not self._released and self._pm.inspects(self, metadata):
+                    return data
+
+            try:
+                await self._streams[to_direction].write(data)
+            except OSError:
+                pass
+        return None
+
+    async def _read_forward_task(self, to_direction: ConnectionDirection):
+        metadata = self._directed_metadata[to_direction]
+        proxy_direction = metadata.direction[0]
+
+        received = _BYTES[proxy_direction]
+        read_size = _ReadSize(self.MIN_READ_SIZE)
+        max_read_size = self.MAX_READ_SIZE
+        generation = None
+
+        while True:
+            # Traffic no plugin wants to see bypasses all hooks, until a reload loads a plugin that does
+            if generation != self._pm.generation:
+                generation = self._pm.generation
+                inspected = self._pm.inspects(self, metadata)
+            if self._released or not inspected:
+                data = await self._splice(to_direction, metadata, received, read_size)
+                if data is None:
+                    return
+                generation = None
+                read_size.size = min(read_size.size, max_read_size)
+            else:
+                data = await self._read(to_direction, read_size.size)
+                if data is None:
+                    return
+                received.inc(len(data))
+                read_size.update(len(data), max_read_size)
 
             data = await self._pm.tcp_decrypt(self, metadata, data)
 
             # Context tracking
-            self._context[proxy_direction] = (self._context[proxy_direction] + data)[-self.BUFFER_SIZE:]
+            self._context.append(proxy_direction, data)
 
             action = await self._pm.tcp_filter(self, metadata, data, self._context)
-            await self._pm.tcp_log(self, metadata, data, action)
+            await self._log_queue.submit(self, self._pm.tcp_log, self, metadata, data, action)
             if action is not None:
                 (action, data) = action
                 if action == FilterAction.REJECT:
+                    _REJECTS[proxy_direction].inc()
                     self._streams[~to_direction].close()
                     self._streams[to_direction].close()
                     return
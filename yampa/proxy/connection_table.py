@@ -0,0 +1,126 @@
+import logging
+from collections import OrderedDict
+from enum import Enum
+from time import monotonic
+
+from .connection import ProxyConnection
+from .timing_wheel import TimingWheel
+from ..metrics import CONNECTION_DROPS
+
+logger = logging.getLogger(__name__)
+
+
+class EvictionPolicy(Enum):
+    # Close the connection that has been idle for the longest time to make room for a new one
+    IDLE = "idle"
+    # Close the connection that was opened first to make room for a new one
+    OLDEST = "oldest"
+    # Refuse new connections while the table is full
+    REJECT = "reject"
+
+
+class ConnectionTable:
+    """The open tcp connections of the proxy.
+
+    Connections without traffic for `idle_timeout` seconds, or open for longer than `lifetime` seconds, are closed
+    (0 disables either). A single timing wheel keeps track of all of them. At most `size` connections are open at a
+    time (0 for no limit), further ones are handled according to `policy`. Connections still being opened count as
+    well, so concurrent accepts cannot exceed the limit.
+
+    Closed connections still run through the regular teardown of the proxy, so plugins get `tcp_connection_closed` for
+    them and can drop their per-connection state, even if the peers vanished without closing.
+    """
+
+    def __init__(self, size: int, policy: EvictionPolicy, idle_timeout: float, lifetime: float):
+        self._size = size
+        self._policy = policy
+        self._idle_timeout = idle_timeout
+        self._lifetime = lifetime
+        # Open connections in eviction order, along with the time of their last activity when they were put there
+        self._connections: OrderedDict[ProxyConnection, float] = OrderedDict()
+        # Connections admitted but not added yet
+        self._admitted = 0
+        self._wheel: TimingWheel[ProxyConnection] = TimingWheel(self._expired)
+        self._drops = {reason: CONNECTION_DROPS.labels(reason)
+                       for reason in ("idle", "lifetime", "evicted", "rejected")}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def start(self):
+        self._wheel.start()
+
+    def close(self):
+        self._wheel.close()
+
+    def admit(self) -> bool:
+        """Make room for a new connection if the table is full, evicting another connection unless the policy is to
+        reject new ones. Room made for a connection is kept for it until it is added, or given back with `release` if
+        it fails to open.
+
+        :returns: Whether a new connection may be opened.
+        :rtype: bool
+        """
+        if self._size <= 0 or len(self._connections) + self._admitted < self._size:
+            self._admitted += 1
+            return True
+
+        if self._policy == EvictionPolicy.REJECT:
+            self._drops["rejected"].inc()
+            return False
+
+        while self._connections:
+            connection, last_activity = self._connections.popitem(last=False)
+            if self._policy == EvictionPolicy.IDLE and connection.last_activity > last_activity:
+                # Active since it was queued, so give it another round instead of sorting on every chunk
+                self._connections[connection] = connection.last_activity
+                continue
+            self._wheel.cancel(connection)
+            self._close(connection, "evicted")
+            self._admitted += 1
+            return True
+
+        # All the room is taken by connections still being opened, which cannot be evicted
+        self._drops["rejected"].inc()
+        return False
+
+    def release(self):
+        """Give back the room made by `admit` for a connection that failed to open."""
+        self._admitted -= 1
+
+    def add(self, connection: ProxyConnection):
+        """Add a connection admitted before."""
+        self._admitted -= 1
+        self._connections[connection] = connection.last_activity
+        deadline = self._deadline(connection)
+        if deadline is not None:
+            self._wheel.schedule(connection, deadline)
+
+    def remove(self, connection: ProxyConnection):
+        self._connections.pop(connection, None)
+        self._wheel.cancel(connection)
+
+    def _deadline(self, connection: ProxyConnection) -> float | None:
+        deadlines = []
+        if self._lifetime > 0:
+            deadlines.append(connection.opened + self._lifetime)
+        if self._idle_timeout > 0:
+            deadlines.append(connection.last_activity + self._idle_timeout)
+        return min(deadlines, default=None)
+
+    def _expired(self, connection: ProxyConnection):
+        now = monotonic()
+        if self._lifetime > 0 and now >= connection.opened + self._lifetime:
+            self._close(connection, "lifetime")
+        elif self._idle_timeout > 0 and now >= connection.last_activity + self._idle_timeout:
+            self._close(connection, "idle")
+        else:
+            # There was traffic since it was scheduled, which does not touch the wheel to keep forwarding cheap
+            self._wheel.schedule(connection, self._deadline(connection))
+
+    def _close(self, connection: ProxyConnection, reason: str):
+        self._drops[reason].inc()
+        metadata = connection.metadata
+        logger.info("Closing connection %s:%d -> %s:%d (%s)", metadata.src_ip, metadata.src_port, metadata.dst_ip,
+                    metadata.dst_port, reason)
+        connection.abort()
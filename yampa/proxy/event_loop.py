@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from enum import Enum
+from typing import Any, Callable, Coroutine
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoop(Enum):
+    # uvloop if it is installed, the default asyncio event loop otherwise
+    AUTO = "auto"
+    # The default asyncio event loop
+    ASYNCIO = "asyncio"
+    # uvloop, failing if it is not installed
+    UVLOOP = "uvloop"
+
+
+def loop_factory(kind: EventLoop) -> Callable[[], asyncio.AbstractEventLoop]:
+    """Resolve the event loop implementation to use.
+
+    uvloop is an optional dependency, it is only imported here.
+
+    :param kind: The configured event loop.
+    :type kind: EventLoop
+    :returns: A function creating a new event loop of that kind.
+    :rtype: Callable[[], asyncio.AbstractEventLoop]
+    :raises ImportError: If uvloop was asked for explicitly, but is not installed.
+    """
+    if kind != EventLoop.ASYNCIO:
+        try:
+            import uvloop
+            return uvloop.new_event_loop
+        except ImportError:
+            if kind == EventLoop.UVLOOP:
+                raise
+    return asyncio.new_event_loop
+
+
+def run(main: Coroutine[Any, Any, Any], kind: EventLoop) -> Any:
+    """Like `asyncio.run`, but on the configured event loop."""
+    with asyncio.Runner(loop_factory=loop_factory(kind)) as runner:
+        return runner.run(main)
+
+
+def loop_name(loop: asyncio.AbstractEventLoop) -> str:
+    """:returns: The name of an event loop implementation, like `uvloop` or `asyncio`."""
+    return type(loop).__module__.split(".", 1)[0]
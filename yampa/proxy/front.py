@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import pickle
+import signal
+import socket
+import traceback
+
+import mitmproxy_wireguard as wireguard
+
+from .channel import Channel, MessageType
+from .config import load_config
+from .event_loop import run
+from .profiler import SamplingProfiler, profile_name
+from .proxy import Proxy, start_servers
+from .scheduler import packet_addresses
+from ..metrics import WORKER_DROPS
+from ..shared import Protocol
+
+logger = logging.getLogger(__name__)
+
+_WORKER_DROPS = {protocol: WORKER_DROPS.labels(protocol.value) for protocol in (Protocol.UDP, Protocol.OTHER)}
+
+
+class _Worker:
+    __slots__ = ("index", "process", "channel")
+
+    def __init__(self, index: int, process: multiprocessing.Process, channel: Channel):
+        self.index = index
+        self.process = process
+        self.channel = channel
+
+
+class _Connection:
+    """A tcp connection relayed to a worker, with the client stream as side 0 and the server stream as side 1."""
+    __slots__ = ("worker", "streams", "closed", "unacked", "drains", "pumps")
+
+    def __init__(self, worker: _Worker, streams: tuple[wireguard.TcpStream, wireguard.TcpStream]):
+        self.worker = worker
+        self.streams = streams
+        # Whether the worker closed or half-closed a side
+        self.closed = [False, False]
+        # Bytes written to a side since it drained last, and the task waiting for that
+        self.unacked = [0, 0]
+        self.drains: list[asyncio.Task | None] = [None, None]
+        self.pumps: list[asyncio.Task] = []
+
+
+class ProxyFront:
+    """Runs the wireguard servers and distributes their flows over `PROXY_WORKERS` worker processes, each running its
+    own Proxy with its own plugins, to use more than a single core for handling traffic.
+
+    Every tcp connection, udp flow and (by its addresses) other packet is pinned to one worker by a hash of its
+    endpoints, both directions alike. The front only relays payloads between the wireguard streams and the workers,
+    all decisions are made by the plugins in the workers. Reloads are fanned out to all workers.
+    """
+    # Read size of the wireguard streams relayed to the workers
+    READ_SIZE = 65536
+    # Maximum number of bytes waiting to be sent to a worker before udp and other packets for it are dropped
+    HIGH_WATER = 4 * 1024 * 1024
+
+    def __init__(self):
+        self._config = load_config()
+        self._workers: list[_Worker] = []
+        self._servers: tuple[wireguard.Server, wireguard.Server] | None = None
+        self._flows = itertools.count(1)
+        self._connections: dict[int, _Connection] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._closed = asyncio.Event()
+        self._profiler = SamplingProfiler(self._config.profile_dir, self._config.profile_duration,
+                                          self._config.profile_interval)
+
+    async def start(self):
+        context = multiprocessing.get_context("spawn")
+        for index in range(self._config.proxy_workers):
+            ours, theirs = socket.socketpair()
+            process = context.Process(target=_worker_main, args=(index, theirs), name=f"yampa-worker-{index}")
+            process.start()
+            theirs.close()
+            worker = _Worker(index, process, await Channel.connect(ours))
+            self._workers.append(worker)
+            self._tasks.append(asyncio.create_task(self._receive(worker)))
+        logger.info("Started %d worker processes", len(self._workers))
+
+        self._servers = await start_servers(self._config, self._handle_connection, self._handle_datagram,
+                                            self._handle_other)
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    def close(self):
+        if self._servers is not None:
+            for server in self._servers:
+                server.close()
+        for task in self._tasks:
+            task.cancel()
+        for worker in self._workers:
+            worker.channel.close()
+            worker.process.terminate()
+        self._closed.set()
+
+    async def reload(self):
+        for worker in self._workers:
+            worker.channel.send(MessageType.RELOAD)
+
+    def profile(self):
+        """Profile the front process and all workers for `PROFILE_DURATION` seconds, see `SamplingProfiler`. The
+        profiles of the workers are suffixed with their index."""
+        name = profile_name()
+        if not self._profiler.start(f"{name}-front"):
+            logger.info("Already profiling")
+            return
+        for worker in self._workers:
+            worker.channel.send(MessageType.PROFILE, body=name.encode())
+
+    def _worker(self, key) -> _Worker:
+        return self._workers[hash(key) % len(self._workers)]
+
+    async def _handle_connection(self, to_server: wireguard.Server, connection: wireguard.TcpStream):
+        src_addr = connection.get_extra_info('peername')
+        dst_addr = connection.get_extra_info('original_dst')
+        worker = self._worker((Protocol.TCP, src_addr, dst_addr))
+
+        try:
+            forward_connection = await to_server.new_connection(src_addr, dst_addr)
+        except Exception as e:
+            logger.error("Error occurred")
+            logger.error(traceback.format_exc())
+            connection.close()
+            return
+
+        flow = next(self._flows)
+        relayed = _Connection(worker, (connection, forward_connection))
+        self._connections[flow] = relayed
+        worker.channel.send(MessageType.TCP_OPEN, flow, self._servers.index(to_server),
+                            pickle.dumps((src_addr, dst_addr)))
+        relayed.pumps = [asyncio.create_task(self._pump(flow, relayed, side)) for side in (0, 1)]
+
+    async def _handle_datagram(self, to_server: wireguard.Server, data, src_addr, dst_addr):
+        # Both directions of a flow go to the same worker
+        worker = self._worker((src_addr, dst_addr) if src_addr < dst_addr else (dst_addr, src_addr))
+        if worker.channel.buffered > self.HIGH_WATER:
+            _WORKER_DROPS[Protocol.UDP].inc()
+            return
+        worker.channel.send(MessageType.UDP, 0, self._servers.index(to_server),
+                            pickle.dumps((data, src_addr, dst_addr)))
+
+    async def _handle_other(self, to_server: wireguard.Server, data):
+        worker = self._worker(_addresses(data))
+        if worker.channel.buffered > self.HIGH_WATER:
+            _WORKER_DROPS[Protocol.OTHER].inc()
+            return
+        worker.channel.send(MessageType.OTHER, 0, self._servers.index(to_server), data)
+
+    async def _pump(self, flow: int, relayed: _Connection, side: int):
+        """Relay what side `side` of a connection sends to its worker."""
+        channel = relayed.worker.channel
+        try:
+            while data := await relayed.streams[side].read(self.READ_SIZE):
+                channel.send(MessageType.TCP_DATA, flow, side, data)
+                # Stop reading while the worker falls behind
+                await channel.drain()
+        except OSError:
+            pass
+        channel.send(MessageType.TCP_EOF, flow, side)
+
+    async def _drain(self, flow: int, relayed: _Connection, side: int):
+        """Acknowledge the data written to side `side` of a connection to its worker, once it was sent."""
+        while relayed.unacked[side] > 0:
+            n = relayed.unacked[side]
+            try:
+                await relayed.streams[side].drain()
+            except OSError:
+                pass
+            relayed.unacked[side] -= n
+            relayed.worker.channel.send(MessageType.TCP_ACK, flow, side, Channel.ACK.pack(n))
+        relayed.drains[side] = None
+
+    async def _receive(self, worker: _Worker):
+        while (message := await worker.channel.receive()) is not None:
+            kind, flow, arg, body = message
+            if kind in (MessageType.UDP, MessageType.OTHER):
+                try:
+                    if kind == MessageType.UDP:
+                        self._servers[arg].send_datagram(*pickle.loads(body))
+                    else:
+                        self._servers[arg].send_other_packet(body)
+                except OSError:
+                    pass
+                continue
+
+            relayed = self._connections.get(flow)
+            if relayed is None:
+                continue
+            stream = relayed.streams[arg] if kind != MessageType.TCP_DONE else None
+            try:
+                if kind == MessageType.TCP_DATA:
+                    stream.write(body)
+                    relayed.unacked[arg] += len(body)
+                    if relayed.drains[arg] is None:
+                        relayed.drains[arg] = asyncio.create_task(self._drain(flow, relayed, arg))
+                elif kind == MessageType.TCP_EOF:
+                    relayed.closed[arg] = True
+                    stream.write_eof()
+                elif kind == MessageType.TCP_CLOSE:
+                    relayed.closed[arg] = True
+                    stream.close()
+                elif kind == MessageType.TCP_DONE:
+                    del self._connections[flow]
+                    for pump in relayed.pumps:
+                        pump.cancel()
+                    # In case the worker failed to close it
+                    for side, stream in enumerate(relayed.streams):
+                        if not relayed.closed[side]:
+                            stream.close()
+            except OSError:
+                pass
+
+        if not self._closed.is_set():
+            logger.error("Worker %d exited unexpectedly, shutting down", worker.index)
+            self.close()
+
+
+def _addresses(data: bytes):
+    """The source and destination address of an IP packet, in the same order for both directions."""
+    a, b = packet_addresses(data)
+    return (a, b) if a < b else (b, a)
+
+
+def _worker_main(index: int, sock: socket.socket):
+    logging.basicConfig(encoding='utf-8', level=logging.INFO,
+                        format=f"%(levelname)s:worker {index}:%(name)s:%(message)s")
+    # Reloads and profiles are fanned out by the front process
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    run(_run_worker(index, sock), load_config().event_loop)
+
+
+async def _run_worker(index: int, sock: socket.socket):
+    proxy = Proxy()
+    await proxy.start_worker(await Channel.connect(sock), index)
+    await proxy.wait_closed()
+    proxy.close()
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+from enum import Enum
+from typing import Any, Awaitable, Callable, Hashable
+
+from ..metrics import LOG_DROPPED
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(Enum):
+    # Wait for space in the queue, slowing down forwarding only once the loggers fall behind by a full queue
+    BLOCK = "block"
+    # Discard the oldest queued event to make space for the new one
+    DROP_OLDEST = "drop-oldest"
+    # Discard the new event
+    DROP_NEWEST = "drop-newest"
+
+
+class _Shard:
+    __slots__ = ("events", "not_empty", "not_full", "busy", "deferred")
+
+    def __init__(self):
+        self.events: deque[tuple[Callable[..., Awaitable[Any]] | None, tuple]] = deque()
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        # Whether the worker is logging an event taken from `events`
+        self.busy = False
+        # Barriers dropped while the worker was busy, released once it is done with its event
+        self.deferred: list[asyncio.Future] = []
+
+
+class LogQueue:
+    """Runs log hooks off the forwarding path.
+
+    Events are distributed over `workers` shards by a key, usually the connection or flow they belong to. Each shard is
+    processed by a single worker task in submission order, so the log hooks of one connection see its events in the
+    order they were forwarded, while a slow logger on one shard does not hold up the others. The queue holds at most
+    `size` events, split evenly over the shards, further events are handled according to `policy`.
+
+    With a size of 0, events are not queued at all but logged inline, as before.
+    """
+
+    def __init__(self, size: int, policy: OverflowPolicy, workers: int):
+        self._capacity = -(-size // workers) if size > 0 else 0
+        self._policy = policy
+        self._shards = [_Shard() for _ in range(workers)] if size > 0 else []
+        self._tasks: list[asyncio.Task] = []
+        self._dropped: dict[str, Any] = {}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work(shard)) for shard in self._shards]
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def submit(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args):
+        """Queue a call of `function`, usually one of the log hooks of the PluginManager.
+
+        Only blocks with the `BLOCK` policy, and only while the shard of `key` is full."""
+        if not self._shards:
+            await function(*args)
+            return
+
+        shard = self._shards[hash(key) % len(self._shards)]
+        if len(shard.events) >= self._capacity:
+            if self._policy == OverflowPolicy.BLOCK:
+                while len(shard.events) >= self._capacity:
+                    shard.not_full.clear()
+                    await shard.not_full.wait()
+            elif self._policy == OverflowPolicy.DROP_NEWEST:
+                self._drop(shard, function, args)
+                return
+            else:
+                while len(shard.events) >= self._capacity:
+                    self._drop(shard, *shard.events.popleft())
+
+        shard.events.append((function, args))
+        shard.not_empty.set()
+
+    async def barrier(self, key: Hashable):
+        """Wait until all events queued so far for `key` have been logged, e.g. before announcing that a connection
+        closed. Barriers are never dropped."""
+        if not self._shards:
+            return
+
+        # Queued even if the shard is empty, as the worker might still be logging an event of `key`
+        shard = self._shards[hash(key) % len(self._shards)]
+        done = asyncio.get_running_loop().create_future()
+        shard.events.append((None, (done,)))
+        shard.not_empty.set()
+        await done
+
+    def _drop(self, shard: _Shard, function: Callable[..., Awaitable[Any]] | None, args: tuple):
+        if function is None:
+            # A barrier, all events before it were taken from the queue, so release it early instead of dropping it,
+            # but not before the event the worker might still be logging is done
+            if shard.busy:
+                shard.deferred.extend(args)
+            else:
+                _release(*args)
+            return
+        name = function.__name__
+        if name not in self._dropped:
+            self._dropped[name] = LOG_DROPPED.labels(name)
+        self._dropped[name].inc()
+
+    async def _work(self, shard: _Shard):
+        while True:
+            while not shard.events:
+                shard.not_empty.clear()
+                await shard.not_empty.wait()
+
+            function, args = shard.events.popleft()
+            shard.not_full.set()
+            if function is None:
+                _release(*args)
+                continue
+            shard.busy = True
+            try:
+                await function(*args)
+            except Exception:
+                logger.error("Error occurred while logging")
+                logger.error(traceback.format_exc())
+            finally:
+                shard.busy = False
+                deferred, shard.deferred = shard.deferred, []
+                for future in deferred:
+                    _release(future)
+
+
+def _release(future: asyncio.Future):
+    # The waiter might have been cancelled
+    if not future.done():
+        future.set_result(None)
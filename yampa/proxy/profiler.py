@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from functools import lru_cache
+from types import CodeType, FrameType
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Samples what the proxy is doing for a limited time, to find out where the time goes while it is running.
+
+    While profiling, a background thread takes a sample every `interval` seconds for `duration` seconds, then writes two
+    files of collapsed stacks into `directory`, ready for flamegraph.pl or speedscope:
+
+    - `<name>.threads.collapsed`: what every thread was executing, rooted at the thread name. This includes all plugin
+      code running on the event loop or in executor threads, and the event loop waiting for traffic in `select`.
+    - `<name>.await.collapsed`: where the tasks on the event loop were suspended, i.e. the time every coroutine spent
+      waiting for what it awaits, like a hook waiting for an external engine or a stream waiting for its peer.
+
+    The counts are numbers of samples, so multiplying them by `interval` gives seconds. Nothing runs while not
+    profiling.
+    """
+
+    def __init__(self, directory: str, duration: float, interval: float):
+        self._directory = directory
+        self._duration = duration
+        self._interval = interval
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, name: str) -> bool:
+        """Start profiling the running event loop and all threads, writing the results under `name`.
+
+        :returns: Whether profiling started, which it does not while already running.
+        :rtype: bool
+        """
+        if self.running:
+            return False
+        loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._run, args=(loop, name), name="yampa-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, loop: asyncio.AbstractEventLoop, name: str):
+        logger.info("Profiling for %s seconds", self._duration)
+        try:
+            threads, awaits, samples = self._sample(loop)
+            for kind, stacks in (("threads", threads), ("await", awaits)):
+                path = os.path.join(self._directory, f"{name}.{kind}.collapsed")
+                with open(path, "w") as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+                logger.info("Wrote %d samples of %s to %s", samples, kind, path)
+        except Exception:
+            logger.error("Error occurred while profiling")
+            logger.error(traceback.format_exc())
+
+    def _sample(self, loop: asyncio.AbstractEventLoop) -> tuple[Counter, Counter, int]:
+        own = threading.get_ident()
+        threads: Counter[str] = Counter()
+        awaits: Counter[str] = Counter()
+        samples = 0
+        deadline = time.monotonic() + self._duration
+        next_sample = time.monotonic()
+        while next_sample < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    threads[_collapse([names.get(ident, str(ident))], _frames(frame))] += 1
+
+            # The running task, if any, shows up in the event loop thread instead
+            current = asyncio.current_task(loop)
+            for task in asyncio.all_tasks(loop):
+                if task is not current:
+                    awaits[_collapse([], _task_frames(task))] += 1
+
+            samples += 1
+            next_sample += self._interval
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+        return threads, awaits, samples
+
+
+def profile_name() -> str:
+    """:returns: The name of a profile started now."""
+    return time.strftime("profile-%Y%m%d-%H%M%S")
+
+
+def _frames(frame: FrameType | None) -> list[FrameType]:
+    """:returns: The frames of a thread stack, outermost first."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _task_frames(task: asyncio.Task) -> list[FrameType]:
+    """:returns: The frames of the coroutines a suspended task awaits, outermost first."""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return frames
+
+
+def _collapse(roots: list[str], frames: list[FrameType]) -> str:
+    return ";".join(roots + [_describe(frame.f_code, frame.f_lineno) for frame in frames]) or "<unknown>"
+
+
+@lru_cache(maxsize=65536)
+def _describe(code: CodeType, line: int) -> str:
+    path = code.co_filename
+    if path.startswith(os.getcwd() + os.sep):
+        path = os.path.relpath(path)
+    else:
+        path = os.path.join(*path.split(os.sep)[-2:])
+    # Semicolons separate the frames of collapsed stacks
+    return f"{code.co_qualname} ({path}:{line})".replace(";", ":")
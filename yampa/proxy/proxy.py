@@ -4,52 +4,136 @@ import traceback
 
 import mitmproxy_wireguard as wireguard
 
-from .config import load_config
+from .batch import Batcher
+from .channel import Channel
+from .config import load_config, ProxyConfig
 from .connection import ProxyConnection
+from .connection_table import ConnectionTable
+from .log_queue import LogQueue
+from .profiler import SamplingProfiler, profile_name
+from .remote import WorkerLink
+from .scheduler import PacketScheduler, packet_addresses
 from .stream import WireguardStream
-from ..shared import FilterAction, ProxyDirection, ConnectionDirection, Metadata
+from .udp_flow import UdpFlow, UdpFlowTable
+from ..metrics import start_metrics_server, OPEN_CONNECTIONS, BYTES, PACKETS, REJECTS
+from ..shared import FilterAction, ProxyDirection, ConnectionDirection, Metadata, Protocol
 
 logger = logging.getLogger(__name__)
 
+_OPEN_CONNECTIONS = OPEN_CONNECTIONS.labels()
+_PACKETS = {(protocol, direction): PACKETS.labels(protocol.value, direction.value)
+            for protocol in (Protocol.UDP, Protocol.OTHER) for direction in ProxyDirection}
+_BYTES = {(protocol, direction): BYTES.labels(protocol.value, direction.value)
+          for protocol in (Protocol.UDP, Protocol.OTHER) for direction in ProxyDirection}
+_REJECTS = {(protocol, direction): REJECTS.labels(protocol.value, direction.value)
+            for protocol in (Protocol.UDP, Protocol.OTHER) for direction in ProxyDirection}
+
+
+async def start_servers(config: ProxyConfig, handle_connection, handle_datagram,
+                        handle_other) -> tuple[wireguard.Server, wireguard.Server]:
+    """Start the network and the proxy server. The handlers are called with the server to forward the traffic to as
+    their first argument, followed by the arguments of the corresponding wireguard callback.
+
+    :returns: The network and the proxy server.
+    :rtype: tuple[wireguard.Server, wireguard.Server]
+    """
+    servers = {}
+    servers["network"] = await wireguard.start_server("0.0.0.0", 51820,
+                                                      config.network.own_private,
+                                                      [config.network.peer_public],
+                                                      [config.network.peer_endpoint],
+                                                      lambda connection: handle_connection(
+                                                          servers["proxy"], connection),
+                                                      lambda data, src, dst: handle_datagram(
+                                                          servers["proxy"], data, src, dst),
+                                                      lambda data: handle_other(servers["proxy"], data))
+
+    servers["proxy"] = await wireguard.start_server("0.0.0.0", 51821,
+                                                    config.proxy.own_private,
+                                                    [config.proxy.peer_public],
+                                                    [config.proxy.peer_endpoint],
+                                                    lambda connection: handle_connection(
+                                                        servers["network"], connection),
+                                                    lambda data, src, dst: handle_datagram(
+                                                        servers["network"], data, src, dst),
+                                                    lambda data: handle_other(servers["network"], data))
+
+    logger.info(
+        f"Network server running with own public key %s and peer public key %s",
+        config.network.own_public, config.network.peer_public)
+    logger.info(
+        f"Proxy server running with own public key %s and peer public key %s",
+        config.proxy.own_public, config.proxy.peer_public)
+    return servers["network"], servers["proxy"]
+
+
+def worker_metrics_listen(listen: str, index: int) -> str:
+    """Where worker `index` serves its metrics: the first one on `listen` itself, the others on the following ports,
+    or on unix sockets suffixed with their index."""
+    if not listen or index == 0:
+        return listen
+    if listen.startswith("unix:"):
+        return f"{listen}.{index}"
+    host, port = listen.rsplit(":", 1)
+    return f"{host}:{int(port) + index}"
+
 
 class Proxy:
     def __init__(self):
         from ..plugins import PluginManager
         self._config = load_config()
-        self._pm = PluginManager()
+        self._pm = PluginManager(self._config.hook_budgets)
         self._network_server = None
         self._proxy_server = None
+        self._metrics_server = None
+        self._log_queue = LogQueue(self._config.log_queue_size, self._config.log_queue_policy,
+                                   self._config.log_workers)
+
+        self._udp_flows = UdpFlowTable(self._config.max_udp_flows, self._config.udp_idle_timeout,
+                                       self._config.udp_context_size, self._udp_flow_expired)
+        self._profiler = SamplingProfiler(self._config.profile_dir, self._config.profile_duration,
+                                          self._config.profile_interval)
+        # Distinguishes the profiles of the workers of a ProxyFront
+        self._profile_suffix = ""
+        self._scheduler = PacketScheduler(self._config.max_pending_packets, self._config.max_pending_per_source)
+        # Keep references to the tasks, the event loop only keeps weak ones
+        self._tasks: set[asyncio.Task] = set()
+        self._connections = ConnectionTable(self._config.max_connections, self._config.connection_eviction,
+                                            self._config.idle_timeout, self._config.connection_lifetime)
+
+        self._udp_batchers: dict[ProxyDirection, Batcher] | None = None
+        if self._config.udp_batch_size > 1:
+            self._udp_batchers = {
+                direction: Batcher(self._handle_datagram_batch, self._config.udp_batch_size,
+                                   self._config.udp_batch_delay)
+                for direction in ProxyDirection
+            }
 
     async def start(self):
+        await self._start()
+        self._network_server, self._proxy_server = await start_servers(self._config, self._handle_connection,
+                                                                       self._handle_datagram, self._handle_other)
+
+    async def start_worker(self, channel: Channel, index: int):
+        """Run as worker `index` of a `ProxyFront`, handling the flows it relays over `channel` instead of running the
+        wireguard servers."""
+        self._config.metrics_listen = worker_metrics_listen(self._config.metrics_listen, index)
+        self._profile_suffix = f"-worker-{index}"
+        link = WorkerLink(channel, self._handle_connection, self._handle_datagram, self._handle_other, self.reload,
+                          self.profile)
+        self._network_server, self._proxy_server = link.servers
+        await self._start()
+        link.start()
+
+    async def _start(self):
         # Initial plugin load
         await self._pm.reload()
+        self._log_queue.start()
+        self._connections.start()
+        self._udp_flows.start()
 
-        self._network_server = await wireguard.start_server("0.0.0.0", 51820,
-                                                            self._config.network.own_private,
-                                                            [self._config.network.peer_public],
-                                                            [self._config.network.peer_endpoint],
-                                                            lambda connection: self._handle_connection(
-                                                                self._proxy_server, connection),
-                                                            lambda data, src, dst: self._handle_datagram(
-                                                                self._proxy_server, data, src, dst),
-                                                            lambda data: self._handle_other(self._proxy_server, data))
-
-        self._proxy_server = await wireguard.start_server("0.0.0.0", 51821,
-                                                          self._config.proxy.own_private,
-                                                          [self._config.proxy.peer_public],
-                                                          [self._config.proxy.peer_endpoint],
-                                                          lambda connection: self._handle_connection(
-                                                              self._network_server, connection),
-                                                          lambda data, src, dst: self._handle_datagram(
-                                                              self._network_server, data, src, dst),
-                                                          lambda data: self._handle_other(self._network_server, data))
-
-        logger.info(
-            f"Network server running with own public key %s and peer public key %s",
-            self._config.network.own_public, self._config.network.peer_public)
-        logger.info(
-            f"Proxy server running with own public key %s and peer public key %s",
-            self._config.proxy.own_public, self._config.proxy.peer_public)
+        if self._config.metrics_listen:
+            self._metrics_server = await start_metrics_server(self._config.metrics_listen)
 
     async def wait_closed(self):
         await asyncio.gather(self._network_server.wait_closed(), self._proxy_server.wait_closed())
@@ -57,10 +141,20 @@ class Proxy:
     def close(self):
         self._network_server.close()
         self._proxy_server.close()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+        self._log_queue.close()
+        self._connections.close()
+        self._udp_flows.close()
 
     async def reload(self):
         await self._pm.reload()
 
+    def profile(self, name: str | None = None):
+        """Profile the proxy for `PROFILE_DURATION` seconds, see `SamplingProfiler`."""
+        if not self._profiler.start((name or profile_name()) + self._profile_suffix):
+            logger.info("Already profiling")
+
     async def _handle_connection(self, to_server: wireguard.Server, connection: wireguard.TcpStream):
         # see https://github.com/mitmproxy/mitmproxy/issues/5707 for why this is named like this
         src_addr = connection.get_extra_info('peername')
@@ -68,50 +162,145 @@ class Proxy:
 
         direction = ProxyDirection.INBOUND if to_server == self._proxy_server else ProxyDirection.OUTBOUND
 
-        forward_connection = await to_server.new_connection(src_addr, dst_addr)
-        streams = {ConnectionDirection.TO_CLIENT: WireguardStream(connection),
-                   ConnectionDirection.TO_SERVER: WireguardStream(forward_connection)}
+        if not self._connections.admit():
+            connection.close()
+            return
+
+        try:
+            forward_connection = await to_server.new_connection(src_addr, dst_addr)
+            streams = {ConnectionDirection.TO_CLIENT: self._wireguard_stream(connection),
+                       ConnectionDirection.TO_SERVER: self._wireguard_stream(forward_connection)}
 
-        connection = ProxyConnection(self._pm, streams, src_addr, dst_addr, direction)
+            connection = ProxyConnection(self._pm, self._log_queue, streams, src_addr, dst_addr, direction,
+                                         self._config.context_size)
+        except BaseException:
+            # Give back the room kept for the connection
+            self._connections.release()
+            raise
+        self._connections.add(connection)
+        _OPEN_CONNECTIONS.inc()
         try:
             await self._pm.tcp_new_connection(connection)
             connection.init()
             await connection.wait_closed()
+        except Exception as e:
+            logger.error("Error occurred")
+            logger.error(traceback.format_exc())
+        finally:
+            self._connections.remove(connection)
+            _OPEN_CONNECTIONS.dec()
+
+        # Always let the plugins know, so they can drop their state of the connection
+        try:
+            # Plugins may clean up per-connection state when it closed, so let them log everything before
+            await self._log_queue.barrier(connection)
             await self._pm.tcp_connection_closed(connection)
         except Exception as e:
             logger.error("Error occurred")
             logger.error(traceback.format_exc())
 
+    def _wireguard_stream(self, stream: wireguard.TcpStream) -> WireguardStream:
+        return WireguardStream(stream, self._config.write_coalesce_size, self._config.write_coalesce_delay,
+                               self._config.write_high_water)
+
     async def _handle_datagram(self, to_server: wireguard.Server, data, src_addr, dst_addr):
         direction = ProxyDirection.INBOUND if to_server == self._proxy_server else ProxyDirection.OUTBOUND
-        metadata = Metadata(src_addr[0], src_addr[1], dst_addr[0], dst_addr[1], direction)
+        _PACKETS[Protocol.UDP, direction].inc()
+        _BYTES[Protocol.UDP, direction].inc(len(data))
+
+        # Limits apply per remote peer, which is the destination of outbound packets
+        peer = src_addr[0] if direction == ProxyDirection.INBOUND else dst_addr[0]
+        if not self._scheduler.admit(Protocol.UDP, peer):
+            return
+
+        entry = self._udp_flows.get(direction, src_addr, dst_addr)
+        new = entry is None
+        if new:
+            entry = self._udp_flows.add(direction, src_addr, dst_addr)
+        flow, metadata = entry
+        await self._scheduler.run(flow, peer, self._process_datagram, to_server, flow, metadata, data, src_addr,
+                                  dst_addr, new)
+
+    async def _process_datagram(self, to_server: wireguard.Server, flow: UdpFlow, metadata: Metadata, data, src_addr,
+                                dst_addr, new: bool):
+        # The packet starting a flow is the first of it to be handled, so plugins always learn about the flow first
+        if new:
+            await self._pm.udp_flow_new(flow)
+
+        if self._udp_batchers is not None:
+            done = asyncio.get_running_loop().create_future()
+            self._udp_batchers[metadata.direction].submit((to_server, flow, metadata, data, src_addr, dst_addr, done))
+            # The next packet of the flow goes into a later batch, once this one was forwarded
+            await done
+            return
+
+        data = await self._pm.udp_decrypt(metadata, data, flow)
+        if self._config.udp_context_size > 0:
+            flow.context.append(metadata.direction, data)
+
+        action = await self._pm.udp_filter(metadata, data, flow)
+        await self._forward_datagram(to_server, flow, metadata, data, action, src_addr, dst_addr)
+
+    async def _handle_datagram_batch(self, batch):
+        try:
+            # All packets in a batch travel the same direction, so they share the same to_server. Packets of a flow
+            # are handled one at a time, so a batch holds at most one packet per flow.
+            flows = [flow for _, flow, _, _, _, _, _ in batch]
+            packets = [(metadata, await self._pm.udp_decrypt(metadata, data, flow))
+                       for _, flow, metadata, data, _, _, _ in batch]
+            if self._config.udp_context_size > 0:
+                for flow, (metadata, data) in zip(flows, packets):
+                    flow.context.append(metadata.direction, data)
 
-        data = await self._pm.udp_decrypt(metadata, data)
+            actions = await self._pm.udp_filter_batch(packets, flows)
+            for item, (metadata, data), action in zip(batch, packets, actions):
+                to_server, flow, _, _, src_addr, dst_addr, _ = item
+                await self._forward_datagram(to_server, flow, metadata, data, action, src_addr, dst_addr)
+        finally:
+            for *_, done in batch:
+                # The waiter might have been cancelled
+                if not done.done():
+                    done.set_result(None)
 
-        action = await self._pm.udp_filter(metadata, data)
-        await self._pm.udp_log(metadata, data, action)
+    async def _forward_datagram(self, to_server: wireguard.Server, flow: UdpFlow, metadata: Metadata, data, action,
+                                src_addr, dst_addr):
+        # Log calls of both directions of a flow stay in order
+        await self._log_queue.submit(flow, self._pm.udp_log, metadata, data, action, flow)
         if action is not None:
             (action, data) = action
             if action == FilterAction.REJECT:
+                _REJECTS[Protocol.UDP, metadata.direction].inc()
                 return
 
-        data = await self._pm.udp_encrypt(metadata, data)
+        data = await self._pm.udp_encrypt(metadata, data, flow)
 
-        side = "net -> pro" if direction == ProxyDirection.INBOUND else "pro -> net"
+        side = "net -> pro" if metadata.direction == ProxyDirection.INBOUND else "pro -> net"
         logger.debug(f"[UDP] %s %s", side, data)
 
         to_server.send_datagram(data, src_addr, dst_addr)
 
     async def _handle_other(self, to_server: wireguard.Server, data):
         direction = ProxyDirection.INBOUND if to_server == self._proxy_server else ProxyDirection.OUTBOUND
+        _PACKETS[Protocol.OTHER, direction].inc()
+        _BYTES[Protocol.OTHER, direction].inc(len(data))
+
+        src, dst = packet_addresses(data)
+        peer = src if direction == ProxyDirection.INBOUND else dst
+        if not self._scheduler.admit(Protocol.OTHER, peer):
+            return
+        # Packets between the same two hosts stay in order, both directions alike
+        await self._scheduler.run((src, dst) if src < dst else (dst, src), peer, self._process_other, to_server,
+                                  direction, data)
 
+    async def _process_other(self, to_server: wireguard.Server, direction: ProxyDirection, data):
         data = await self._pm.other_decrypt(direction, data)
 
         action = await self._pm.other_filter(direction, data)
-        await self._pm.other_log(direction, data, action)
+        await self._log_queue.submit(direction, self._pm.other_log, direction, data, action)
         if action is not None:
             (action, data) = action
             if action == FilterAction.REJECT:
+                _REJECTS[Protocol.OTHER, direction].inc()
                 return
 
         data = await self._pm.other_encrypt(direction, data)
@@ -120,3 +309,19 @@ class Proxy:
         logger.debug(f"[???] %s %s", side, data)
 
         to_server.send_other_packet(data)
+
+    def _udp_flow_expired(self, flow: UdpFlow):
+        # Called by the flow table, which can't wait for the plugins
+        task = asyncio.create_task(self._close_udp_flow(flow))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close_udp_flow(self, flow: UdpFlow):
+        try:
+            # Plugins may clean up per-flow state once it expired, so let them handle and log everything before
+            await self._scheduler.barrier(flow)
+            await self._log_queue.barrier(flow)
+            await self._pm.udp_flow_expired(flow)
+        except Exception as e:
+            logger.error("Error occurred")
+            logger.error(traceback.format_exc())
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import pickle
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from .channel import Channel, MessageType
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteTcpStream:
+    """Stand-in for a wireguard TcpStream inside a worker process, relaying to the actual stream in the front process.
+
+    Writes are acknowledged by the front once it sent them, and `drain` waits while more than `WINDOW` bytes are not
+    acknowledged yet, so a slow peer slows down its connection just like with a local stream.
+    """
+    WINDOW = 262144
+
+    def __init__(self, channel: Channel, flow: int, side: int, src_addr: tuple[str, int], dst_addr: tuple[str, int]):
+        self._channel = channel
+        self._flow = flow
+        self._side = side
+        self._extra = {"peername": src_addr, "original_dst": dst_addr}
+        self._chunks: deque[bytes] = deque()
+        self._readable = asyncio.Event()
+        self._eof = False
+        self._unacked = 0
+        self._acked = asyncio.Event()
+        self._closing = False
+
+    def feed(self, data: bytes):
+        self._chunks.append(data)
+        self._readable.set()
+
+    def feed_eof(self):
+        self._eof = True
+        self._readable.set()
+
+    def ack(self, n: int):
+        self._unacked -= n
+        self._acked.set()
+
+    async def read(self, n: int) -> bytes:
+        while not self._chunks:
+            if self._eof:
+                return b""
+            self._readable.clear()
+            await self._readable.wait()
+
+        data = self._chunks.popleft()
+        if len(data) > n:
+            self._chunks.appendleft(data[n:])
+            data = data[:n]
+        return data
+
+    def write(self, data: bytes):
+        if not self._closing:
+            self._channel.send(MessageType.TCP_DATA, self._flow, self._side, data)
+            self._unacked += len(data)
+
+    async def drain(self):
+        await self._channel.drain()
+        while self._unacked > self.WINDOW and not self._closing:
+            self._acked.clear()
+            await self._acked.wait()
+
+    def write_eof(self):
+        if not self._closing:
+            self._channel.send(MessageType.TCP_EOF, self._flow, self._side)
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._channel.send(MessageType.TCP_CLOSE, self._flow, self._side)
+        # Wake up anyone reading or draining
+        self.feed_eof()
+        self._acked.set()
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def get_extra_info(self, name: str, default=None) -> Any:
+        return self._extra.get(name, default)
+
+
+class RemoteServer:
+    """Stand-in for a wireguard Server inside a worker process. Connections and packets to send are relayed to the
+    actual server in the front process."""
+
+    def __init__(self, link: "WorkerLink", index: int):
+        self._link = link
+        self._index = index
+        # Streams to the servers of connections relayed to this worker, which the front already opened
+        self.forward_streams: dict[tuple[tuple[str, int], tuple[str, int]], RemoteTcpStream] = {}
+
+    async def new_connection(self, src_addr: tuple[str, int], dst_addr: tuple[str, int]) -> RemoteTcpStream:
+        return self.forward_streams.pop((src_addr, dst_addr))
+
+    def send_datagram(self, data: bytes, src_addr: tuple[str, int], dst_addr: tuple[str, int]):
+        self._link.channel.send(MessageType.UDP, 0, self._index, pickle.dumps((data, src_addr, dst_addr)))
+
+    def send_other_packet(self, data: bytes):
+        self._link.channel.send(MessageType.OTHER, 0, self._index, data)
+
+    async def wait_closed(self):
+        await self._link.closed.wait()
+
+    def close(self):
+        self._link.close()
+
+
+class WorkerLink:
+    """The end of a worker process of the channel to the front process. It hands the flows the front relays to the
+    same handlers the wireguard servers call in a single process proxy, using `servers` as stand-ins for the network
+    and the proxy server."""
+
+    def __init__(self, channel: Channel,
+                 handle_connection: Callable[[RemoteServer, RemoteTcpStream], Awaitable[None]],
+                 handle_datagram: Callable[[RemoteServer, bytes, tuple[str, int], tuple[str, int]], Awaitable[None]],
+                 handle_other: Callable[[RemoteServer, bytes], Awaitable[None]],
+                 reload: Callable[[], Awaitable[None]], profile: Callable[[str], None]):
+        self.channel = channel
+        self.servers = (RemoteServer(self, 0), RemoteServer(self, 1))
+        self.closed = asyncio.Event()
+        self._handle_connection = handle_connection
+        self._handle_datagram = handle_datagram
+        self._handle_other = handle_other
+        self._reload = reload
+        self._profile = profile
+        self._streams: dict[int, tuple[RemoteTcpStream, RemoteTcpStream]] = {}
+        self._task: asyncio.Task | None = None
+        # Keep references to the tasks, the event loop only keeps weak ones
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._receive())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.channel.close()
+        self.closed.set()
+
+    def _spawn(self, awaitable: Awaitable):
+        task = asyncio.ensure_future(awaitable)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _receive(self):
+        while (message := await self.channel.receive()) is not None:
+            kind, flow, arg, body = message
+            if kind == MessageType.TCP_DATA:
+                if flow in self._streams:
+                    self._streams[flow][arg].feed(body)
+            elif kind == MessageType.TCP_ACK:
+                if flow in self._streams:
+                    self._streams[flow][arg].ack(Channel.ACK.unpack(body)[0])
+            elif kind == MessageType.TCP_EOF:
+                if flow in self._streams:
+                    self._streams[flow][arg].feed_eof()
+            elif kind == MessageType.TCP_OPEN:
+                src_addr, dst_addr = pickle.loads(body)
+                streams = (RemoteTcpStream(self.channel, flow, 0, src_addr, dst_addr),
+                           RemoteTcpStream(self.channel, flow, 1, src_addr, dst_addr))
+                self._streams[flow] = streams
+                to_server = self.servers[arg]
+                to_server.forward_streams[src_addr, dst_addr] = streams[1]
+                self._spawn(self._connection(flow, to_server, streams[0]))
+            elif kind == MessageType.UDP:
+                data, src_addr, dst_addr = pickle.loads(body)
+                self._spawn(self._handle_datagram(self.servers[arg], data, src_addr, dst_addr))
+            elif kind == MessageType.OTHER:
+                self._spawn(self._handle_other(self.servers[arg], body))
+            elif kind == MessageType.RELOAD:
+                self._spawn(self._reload())
+            elif kind == MessageType.PROFILE:
+                self._profile(body.decode())
+
+        logger.info("Front process closed the channel")
+        self.closed.set()
+
+    async def _connection(self, flow: int, to_server: RemoteServer, stream: RemoteTcpStream):
+        try:
+            await self._handle_connection(to_server, stream)
+        finally:
+            del self._streams[flow]
+            # A rejected connection never asked for its forward stream
+            to_server.forward_streams.pop((stream.get_extra_info("peername"), stream.get_extra_info("original_dst")),
+                                          None)
+            self.channel.send(MessageType.TCP_DONE, flow)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable
+
+from ..metrics import PACKET_DROPS, PENDING_PACKETS
+from ..shared import Protocol
+
+logger = logging.getLogger(__name__)
+
+_PENDING_PACKETS = PENDING_PACKETS.labels()
+
+
+class PacketScheduler:
+    """Handles udp and other packets with bounded concurrency, keeping the packets of each flow in order.
+
+    Packets with the same key, usually the flow they belong to, are handled one after another in arrival order, while
+    packets of different flows are handled concurrently. The coroutine submitting the first packet of an idle flow
+    handles all packets of that flow until its queue runs empty, the others only queue their packet and return, so there
+    is never more than one coroutine per flow waiting for the plugins.
+
+    At most `limit` packets are queued or being handled at a time, and at most `source_limit` of them from the same
+    source (0 for no limit each). Further packets are dropped right away and counted, so a flood costs a counter
+    increment per packet instead of memory and latency for all other flows.
+    """
+
+    def __init__(self, limit: int, source_limit: int):
+        self._limit = limit
+        self._source_limit = source_limit
+        # Packets of every flow with a packet being handled, the first one being the one in progress
+        self._queues: dict[Hashable, deque[tuple[Hashable, Callable[..., Awaitable[Any]] | None, tuple]]] = {}
+        # Number of packets queued or being handled, in total and by source
+        self._pending = 0
+        self._sources: dict[Hashable, int] = {}
+        self._drops = {(protocol, reason): PACKET_DROPS.labels(protocol.value, reason)
+                       for protocol in (Protocol.UDP, Protocol.OTHER) for reason in ("overload", "source")}
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def admit(self, protocol: Protocol, source: Hashable) -> bool:
+        """Reserve room for a packet from `source`, which has to be passed to `run` next.
+
+        :returns: Whether there is room, if not the packet is counted as dropped.
+        :rtype: bool
+        """
+        if 0 < self._limit <= self._pending:
+            self._drops[protocol, "overload"].inc()
+            return False
+        count = self._sources.get(source, 0)
+        if 0 < self._source_limit <= count:
+            self._drops[protocol, "source"].inc()
+            return False
+
+        self._pending += 1
+        self._sources[source] = count + 1
+        _PENDING_PACKETS.inc()
+        return True
+
+    async def run(self, key: Hashable, source: Hashable, function: Callable[..., Awaitable[Any]], *args):
+        """Handle an admitted packet of the flow `key` by calling `function`, after all earlier packets of the flow.
+
+        Returns right away if the flow already has packets in progress, otherwise only once the queue of the flow ran
+        empty."""
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append((source, function, args))
+            return
+
+        queue = self._queues[key] = deque(((source, function, args),))
+        try:
+            while queue:
+                # Stays queued while in progress, so that packets arriving meanwhile are queued behind it
+                source, function, args = queue[0]
+                if function is None:
+                    queue.popleft()
+                    _release(*args)
+                    continue
+                try:
+                    await function(*args)
+                except Exception:
+                    logger.error("Error occurred")
+                    logger.error(traceback.format_exc())
+                finally:
+                    queue.popleft()
+                    self._done(source)
+        finally:
+            # Only not empty when cancelled, e.g. on shutdown
+            del self._queues[key]
+            for source, function, args in queue:
+                if function is None:
+                    _release(*args)
+                else:
+                    self._done(source)
+
+    async def barrier(self, key: Hashable):
+        """Wait until all packets of the flow `key` queued so far have been handled, e.g. before announcing that a flow
+        expired."""
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        done = asyncio.get_running_loop().create_future()
+        queue.append((None, None, (done,)))
+        await done
+
+    def _done(self, source: Hashable):
+        self._pending -= 1
+        _PENDING_PACKETS.dec()
+        count = self._sources[source] - 1
+        if count:
+            self._sources[source] = count
+        else:
+            del self._sources[source]
+
+
+def packet_addresses(data: bytes) -> tuple[bytes, bytes]:
+    """:returns: The source and destination address of an IP packet, as raw bytes.
+    :rtype: tuple[bytes, bytes]
+    """
+    if data[:1] and data[0] >> 4 == 6:
+        return data[8:24], data[24:40]
+    return data[12:16], data[16:20]
+
+
+def _release(future: asyncio.Future):
+    # The waiter might have been cancelled
+    if not future.done():
+        future.set_result(None)
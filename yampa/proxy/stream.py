@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 import mitmproxy_wireguard as wireguard
@@ -82,18 +83,75 @@ class WrapperStream(ProxyStream, ABC):
 
 
 class WireguardStream(ProxyStream):
-    def __init__(self, stream: wireguard.TcpStream):
+    def __init__(self, stream: wireguard.TcpStream, coalesce_size: int = 0, coalesce_delay: float = 0,
+                 high_water: int = 0):
+        """
+        :param coalesce_size: Writes are collected until this many bytes are pending or `coalesce_delay` seconds
+            passed, and then handed to the transport at once. 0 hands every write to the transport right away.
+        :param coalesce_delay: Seconds to wait for further writes, 0 only collects writes of the same event loop
+            iteration and thus adds no latency.
+        :param high_water: Writes only wait for the transport to drain once this many bytes were written since it
+            drained last, as the transport does not expose the size of its buffer. 0 drains after every write.
+        """
         super().__init__()
         self._stream = stream
+        self._coalesce_size = coalesce_size
+        self._coalesce_delay = coalesce_delay
+        self._high_water = high_water
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+        self._flush_handle: asyncio.Handle | None = None
+        # Bytes handed to the transport since it drained last
+        self._written = 0
 
     async def do_read(self, n) -> bytes:
         return await self._stream.read(n)
 
     async def do_write(self, data: bytes):
-        self._stream.write(data)
-        await self._stream.drain()
+        if self._coalesce_size > 0:
+            self._pending.append(data)
+            self._pending_size += len(data)
+            if self._pending_size >= self._coalesce_size:
+                self._flush()
+            elif self._flush_handle is None:
+                loop = asyncio.get_running_loop()
+                if self._coalesce_delay > 0:
+                    self._flush_handle = loop.call_later(self._coalesce_delay, self._flush_later)
+                else:
+                    self._flush_handle = loop.call_soon(self._flush_later)
+        else:
+            self._stream.write(data)
+            self._written += len(data)
+
+        if self._written + self._pending_size >= self._high_water:
+            self._flush()
+            self._written = 0
+            await self._stream.drain()
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            data = self._pending[0] if len(self._pending) == 1 else b"".join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            self._written += len(data)
+            self._stream.write(data)
+
+    def _flush_later(self):
+        self._flush_handle = None
+        try:
+            self._flush()
+        except OSError:
+            pass
 
     def do_close(self, force_close: bool):
+        # Whatever was written before closing still goes out
+        try:
+            self._flush()
+        except OSError:
+            pass
         if force_close:
             return self._stream.close()
         self._stream.write_eof()
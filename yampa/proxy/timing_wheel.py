@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import math
+import traceback
+from time import monotonic
+from typing import Callable, Generic, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+
+
+class TimingWheel(Generic[K]):
+    """Calls `callback(key)` once the deadline scheduled for a key passed, for any number of keys, using a single timer.
+
+    Deadlines are hashed into `slots` buckets of `resolution` seconds each, by the tick they fall into. Every tick only
+    the bucket of that tick is looked at, so scheduling, cancelling and expiring a key are O(1), no matter how many
+    keys are scheduled. Deadlines further out than a full turn of the wheel stay in their bucket until a later turn
+    reaches them. Callbacks run up to `resolution` seconds late.
+
+    Deadlines are in terms of `time.monotonic`.
+    """
+
+    def __init__(self, callback: Callable[[K], None], resolution: float = 1, slots: int = 512):
+        self._callback = callback
+        self._resolution = resolution
+        self._slots: list[dict[K, float]] = [{} for _ in range(slots)]
+        # The slot each key is scheduled in
+        self._keys: dict[K, int] = {}
+        self._tick = int(monotonic() / resolution)
+        self._timer: asyncio.TimerHandle | None = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._keys
+
+    def start(self):
+        self._tick = int(monotonic() / self._resolution)
+        self._timer = asyncio.get_running_loop().call_later(self._resolution, self._advance)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def schedule(self, key: K, deadline: float):
+        """Schedule `key` to expire at `deadline`, replacing its previous deadline if it has one."""
+        self.cancel(key)
+        # Rounded up to the first tick the deadline passed by, as keys of a tick that are not due yet wait for another
+        # turn of the wheel. Deadlines that already passed expire on the next tick.
+        slot = max(math.ceil(deadline / self._resolution), self._tick + 1) % len(self._slots)
+        self._slots[slot][key] = deadline
+        self._keys[key] = slot
+
+    def cancel(self, key: K):
+        slot = self._keys.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def _advance(self):
+        now = monotonic()
+        tick = int(now / self._resolution)
+        # Catch up on all ticks since the last one, in case the event loop was busy, but at most one full turn
+        for i in range(max(self._tick + 1, tick - len(self._slots) + 1), tick + 1):
+            # Keys rescheduled by the callbacks land in a later tick, not in one already handled
+            self._tick = i
+            slot = self._slots[i % len(self._slots)]
+            expired = [key for key, deadline in slot.items() if deadline <= now]
+            for key in expired:
+                # An earlier callback may have cancelled it already
+                if slot.pop(key, None) is None:
+                    continue
+                del self._keys[key]
+                try:
+                    self._callback(key)
+                except Exception:
+                    logger.error("Error occurred while expiring %s", key)
+                    logger.error(traceback.format_exc())
+
+        self._timer = asyncio.get_running_loop().call_later(self._resolution, self._advance)
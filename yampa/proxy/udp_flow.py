@@ -0,0 +1,165 @@
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable
+
+from .timing_wheel import TimingWheel
+from ..metrics import OPEN_UDP_FLOWS, UDP_FLOW_EXPIRIES
+from ..shared import Metadata, ProxyDirection, Context
+
+logger = logging.getLogger(__name__)
+
+_Address = tuple[str, int]
+
+_OPEN_UDP_FLOWS = OPEN_UDP_FLOWS.labels()
+
+
+class UdpFlow:
+    """Both directions of a udp flow, the udp counterpart of a ProxyConnection.
+
+    A flow starts with the first datagram between two endpoints and lasts until no datagram was seen in either direction
+    for the configured idle timeout. `metadata` is the metadata of that first datagram, so its source is the peer that
+    started the flow. The same object is passed to all hooks for the flow, so it can be used as a key for per-flow
+    state.
+    """
+    __slots__ = ("_metadata", "_directed_metadata", "_context", "_opened", "_last_activity", "extra",
+                 # For plugins running in worker processes to tell flows apart, see `WorkerPlugin`
+                 "__weakref__")
+
+    def __init__(self, src_addr: _Address, dst_addr: _Address, direction: ProxyDirection, context_size: int):
+        self._metadata = Metadata(src_addr[0], src_addr[1], dst_addr[0], dst_addr[1], direction)
+        # The metadata of the datagrams going either way, passed to every hook call of that direction
+        self._directed_metadata = {
+            direction: self._metadata,
+            # Returning traffic, so src and dst are swapped
+            ~direction: Metadata(dst_addr[0], dst_addr[1], src_addr[0], src_addr[1], ~direction),
+        }
+        self._context = Context(context_size)
+        # In terms of `time.monotonic`
+        self._opened = monotonic()
+        self._last_activity = self._opened
+        self.extra: dict[str, Any] = {}
+
+    @property
+    def metadata(self) -> Metadata:
+        return self._metadata
+
+    def metadata_of(self, direction: ProxyDirection) -> Metadata:
+        """:returns: The metadata of the datagrams of the flow going `direction`, which is `metadata` for the direction
+            of the first datagram, and has source and destination swapped for returning traffic.
+        :rtype: Metadata
+        """
+        return self._directed_metadata[direction]
+
+    @property
+    def context(self) -> Context:
+        """Previous datagrams of both directions of the flow, up to the configured `UDP_CONTEXT_SIZE`. A datagram is
+        part of the context by the time its filter hooks are called."""
+        return self._context
+
+    @property
+    def opened(self) -> float:
+        """:returns: When the flow started, in terms of `time.monotonic`."""
+        return self._opened
+
+    @property
+    def last_activity(self) -> float:
+        """:returns: When the latest datagram of the flow was seen, in terms of `time.monotonic`."""
+        return self._last_activity
+
+    def __repr__(self) -> str:
+        metadata = self._metadata
+        return f"UdpFlow({metadata.src_ip}:{metadata.src_port} -> {metadata.dst_ip}:{metadata.dst_port})"
+
+
+class UdpFlowTable:
+    """The open udp flows of the proxy.
+
+    Datagrams are looked up by their direction and addresses, so that datagrams going either way find the same flow.
+    Flows without datagrams for `idle_timeout` seconds expire (0 keeps them until evicted), tracked by a single timing
+    wheel. At most `size` flows are kept (0 for no limit), beyond that the flow idle for the longest time is evicted to
+    make room for a new one. `expired` is called for every flow that expired or was evicted.
+    """
+
+    def __init__(self, size: int, idle_timeout: float, context_size: int, expired: Callable[[UdpFlow], None]):
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._context_size = context_size
+        self._expired_callback = expired
+        # Both directions of every flow along with the metadata of that direction, by (direction, src, dst)
+        self._entries: dict[tuple[ProxyDirection, _Address, _Address], tuple[UdpFlow, Metadata]] = {}
+        # Open flows in eviction order, along with the time of their last activity when they were put there
+        self._flows: OrderedDict[UdpFlow, float] = OrderedDict()
+        self._wheel: TimingWheel[UdpFlow] = TimingWheel(self._expired)
+        self._expiries = {reason: UDP_FLOW_EXPIRIES.labels(reason) for reason in ("idle", "evicted")}
+
+    def __len__(self) -> int:
+        return len(self._flows)
+
+    def __iter__(self):
+        return iter(self._flows)
+
+    def start(self):
+        self._wheel.start()
+
+    def close(self):
+        self._wheel.close()
+
+    def get(self, direction: ProxyDirection, src_addr: _Address,
+            dst_addr: _Address) -> tuple[UdpFlow, Metadata] | None:
+        """Look up the flow of a datagram and mark it as active.
+
+        :returns: The flow and the metadata of the datagram, or None if the datagram starts a new flow.
+        :rtype: tuple[UdpFlow, Metadata] | None
+        """
+        entry = self._entries.get((direction, src_addr, dst_addr))
+        if entry is not None:
+            entry[0]._last_activity = monotonic()
+        return entry
+
+    def add(self, direction: ProxyDirection, src_addr: _Address, dst_addr: _Address) -> tuple[UdpFlow, Metadata]:
+        """Start a new flow with a datagram, evicting another flow if the table is full.
+
+        :returns: The new flow and the metadata of the datagram.
+        :rtype: tuple[UdpFlow, Metadata]
+        """
+        if 0 < self._size <= len(self._flows):
+            self._evict()
+
+        flow = UdpFlow(src_addr, dst_addr, direction, self._context_size)
+        entry = (flow, flow.metadata)
+        self._entries[direction, src_addr, dst_addr] = entry
+        self._entries[~direction, dst_addr, src_addr] = (flow, flow.metadata_of(~direction))
+        self._flows[flow] = flow.last_activity
+        _OPEN_UDP_FLOWS.inc()
+        if self._idle_timeout > 0:
+            self._wheel.schedule(flow, flow.last_activity + self._idle_timeout)
+        return entry
+
+    def _evict(self):
+        while self._flows:
+            flow, last_activity = self._flows.popitem(last=False)
+            if flow.last_activity > last_activity:
+                # Active since it was queued, so give it another round instead of sorting on every datagram
+                self._flows[flow] = flow.last_activity
+                continue
+            self._wheel.cancel(flow)
+            self._remove(flow, "evicted")
+            return
+
+    def _expired(self, flow: UdpFlow):
+        deadline = flow.last_activity + self._idle_timeout
+        if monotonic() < deadline:
+            # There were datagrams since it was scheduled, which do not touch the wheel to keep forwarding cheap
+            self._wheel.schedule(flow, deadline)
+            return
+        self._flows.pop(flow, None)
+        self._remove(flow, "idle")
+
+    def _remove(self, flow: UdpFlow, reason: str):
+        self._expiries[reason].inc()
+        _OPEN_UDP_FLOWS.dec()
+        for direction in ProxyDirection:
+            directed = flow.metadata_of(direction)
+            del self._entries[direction, (directed.src_ip, directed.src_port), (directed.dst_ip, directed.dst_port)]
+        self._expired_callback(flow)
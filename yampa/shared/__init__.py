@@ -1,3 +1,5 @@
 from .direction import ConnectionDirection, ProxyDirection
 from .metadata import Metadata
 from .filter_action import FilterAction
+from .protocol import Protocol
+from .context import Context
@@ -0,0 +1,54 @@
+from collections.abc import Iterator, Mapping
+
+from .direction import ProxyDirection
+
+
+def _slide(window: bytes, data: bytes | memoryview, capacity: int) -> bytes:
+    """:returns: The latest `capacity` bytes of `window` followed by `data`.
+    :rtype: bytes
+    """
+    if len(data) >= capacity:
+        return bytes(data[len(data) - capacity:])
+    # Slicing bytes that are short enough already returns them as they are
+    return (window + data)[-capacity:]
+
+
+class Context(Mapping[ProxyDirection, bytes]):
+    """Previous traffic for both directions of a connection, each up to `capacity` bytes.
+
+    Each direction is kept as `bytes` that new traffic is concatenated to and cut down to `capacity` again. At context
+    sizes like the default this is cheaper than a ring buffer, whose bookkeeping in Python costs more than copying the
+    context, see `benchmarks.context`. As the bytes never change, indexing by ProxyDirection returns them without
+    copying, and `view` returns a memoryview of them that stays valid.
+    """
+    __slots__ = ("_capacity", "_inbound", "_outbound")
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._inbound = b""
+        self._outbound = b""
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def append(self, direction: ProxyDirection, data: bytes | memoryview):
+        if direction is ProxyDirection.INBOUND:
+            self._inbound = _slide(self._inbound, data, self._capacity)
+        else:
+            self._outbound = _slide(self._outbound, data, self._capacity)
+
+    def view(self, direction: ProxyDirection) -> memoryview:
+        """:returns: The traffic of `direction`, without copying.
+        :rtype: memoryview
+        """
+        return memoryview(self[direction])
+
+    def __getitem__(self, direction: ProxyDirection) -> bytes:
+        return self._inbound if direction is ProxyDirection.INBOUND else self._outbound
+
+    def __iter__(self) -> Iterator[ProxyDirection]:
+        return iter(ProxyDirection)
+
+    def __len__(self) -> int:
+        return len(ProxyDirection)
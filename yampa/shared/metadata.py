@@ -3,10 +3,20 @@ from dataclasses import dataclass
 from .direction import ProxyDirection, ConnectionDirection
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Metadata:
+    """Addresses and direction of a packet. Instances are immutable and without a `__dict__`, so the proxy can share a
+    single instance between all packets of a connection direction or udp flow. Use `dataclasses.replace` to derive
+    modified metadata."""
     src_ip: str
     src_port: int
     dst_ip: str
     dst_port: int
     direction: ProxyDirection | tuple[ProxyDirection, ConnectionDirection]
+
+
+# All directions of tcp traffic, so that metadata of the same direction share the same tuple
+TCP_DIRECTIONS: dict[tuple[ProxyDirection, ConnectionDirection], tuple[ProxyDirection, ConnectionDirection]] = {
+    (proxy_direction, connection_direction): (proxy_direction, connection_direction)
+    for proxy_direction in ProxyDirection for connection_direction in ConnectionDirection
+}
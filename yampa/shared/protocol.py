@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class Protocol(Enum):
+    TCP = "tcp"
+    UDP = "udp"
+    OTHER = "other"